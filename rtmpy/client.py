@@ -1,3 +1,5 @@
+# -*- test-case-name: rtmpy.tests.test_client -*-
+
 # Copyright the RTMPy Project
 #
 # RTMPy is free software: you can redistribute it and/or modify it under the
@@ -16,55 +18,329 @@
 """
 RTMP client implementation.
 
+Example::
+
+    def connected(nc):
+        d = nc.createStream()
+        d.addCallback(lambda stream: stream.play('foo', subscriber))
+
+        return d
+
+    f = ClientFactory({'app': 'live', 'tcUrl': 'rtmp://localhost/live'})
+    f.deferred.addCallback(connected)
+
+    reactor.connectTCP('localhost', 1935, f)
+
 @since: 0.1.0
 """
 
-from twisted.internet import protocol as twisted_protocol
+from twisted.internet import protocol, defer
+from twisted.python import log
+import pyamf
+
+from rtmpy import core, exc, message, rpc, versions
+from rtmpy.protocol import rtmp
+from rtmpy.protocol.rtmp import handshake
 
-from rtmpy import protocol, versions
-from rtmpy.protocol import handshake
 
+class NetStream(core.NetStream):
+    """
+    A client side NetStream. Only playing streams is supported.
 
-class ClientProtocol(protocol.BaseProtocol):
+    @ivar subscriber: Receives the audio/video/meta data of the stream being
+        played.
+    @type subscriber: L{rtmpy.server.IPublishingStream}
+    @ivar name: The name of the stream being played.
+    @cvar endCodes: The status codes that signal the end of the stream being
+        played.
+    """
+
+    endCodes = ('NetStream.Play.UnpublishNotify', 'NetStream.Play.Stop')
+
+    def __init__(self, nc, streamId):
+        core.NetStream.__init__(self, nc, streamId)
+
+        self.name = None
+        self.subscriber = None
+        self._pendingPlay = None
+
+
+    def play(self, name, subscriber):
+        """
+        Asks the peer to start sending the stream C{name}. The audio/video/meta
+        data is passed to C{subscriber}.
+
+        @return: A L{defer.Deferred} that fires with this stream when the peer
+            reports C{NetStream.Play.Start}, or errbacks if it reports an error.
+        """
+        self.name = name
+        self.subscriber = subscriber
+        self._pendingPlay = defer.Deferred()
+
+        self.call('play', name)
+
+        return self._pendingPlay
+
+
+    @rpc.expose
+    def onStatus(self, info, *args):
+        """
+        Called by the peer when the status of the stream changes. The
+        subscriber is told when the stream it is playing has been unpublished.
+        """
+        if info.get('code') in self.endCodes:
+            subscriber, self.subscriber = self.subscriber, None
+
+            if subscriber is not None:
+                subscriber.unpublish()
+
+        d = self._pendingPlay
+
+        if d is None:
+            return
+
+        if info.get('level') == 'error':
+            self._pendingPlay = None
+
+            d.errback(exc.CallFailed(info.get('description') or
+                info.get('code')))
+        elif info.get('code') == 'NetStream.Play.Start':
+            self._pendingPlay = None
+
+            d.callback(self)
+
+
+    @rpc.expose
+    def onMetaData(self, meta):
+        if self.subscriber:
+            self.subscriber.onMetaData(meta)
+
+
+    def onVideoData(self, data, timestamp):
+        if self.subscriber:
+            self.subscriber.videoDataReceived(data, timestamp)
+
+
+    def onAudioData(self, data, timestamp):
+        if self.subscriber:
+            self.subscriber.audioDataReceived(data, timestamp)
+
+
+    def onControlMessage(self, *args):
+        """
+        """
+
+
+    def closeStream(self):
+        """
+        Called when the stream is asked to close itself.
+        """
+        subscriber, self.subscriber = self.subscriber, None
+        d, self._pendingPlay = self._pendingPlay, None
+
+        if d is not None:
+            d.errback(exc.CallFailed('Stream closed'))
+
+        if subscriber is not None:
+            subscriber.unpublish()
+
+
+
+class NetConnection(core.NetConnection):
+    """
+    Client side NetConnection implementation.
+    """
+
+    objectEncoding = pyamf.AMF0
+
+    def __init__(self, protocol):
+        core.NetConnection.__init__(self, protocol)
+
+        self.connected = False
+
+
+    def buildStream(self, streamId):
+        return NetStream(self, streamId)
+
+
+    def sendMessage(self, msg, stream=None, whenDone=None):
+        self.protocol.sendMessage(msg, stream or self, whenDone=whenDone)
+
+
+    def connect(self, params, *args):
+        """
+        Connects to the application named by C{params['app']}.
+
+        @return: A L{defer.Deferred} that fires with this C{NetConnection} once
+            the connection has been accepted.
+        """
+        def cb(result):
+            info = result[-1]
+
+            if info.get('code') != 'NetConnection.Connect.Success':
+                raise exc.ConnectRejected(info.get('description') or
+                    info.get('code'))
+
+            self.connected = True
+
+            return self
+
+        d = self.call('connect', params, *args, **{'notify': True})
+
+        return d.addCallback(cb)
+
+
+    def createStream(self):
+        """
+        Asks the peer to create a new stream.
+
+        @return: A L{defer.Deferred} that fires with the L{NetStream}.
+        """
+        def cb(result):
+            streamId = int(result[-1])
+            stream = self.streams[streamId] = self.buildStream(streamId)
+
+            return stream
+
+        return self.call('createStream', notify=True).addCallback(cb)
+
+
+    @rpc.expose
+    def onStatus(self, info, *args):
+        """
+        Called by the peer to report a change of status.
+        """
+
+
+    def callExposedMethod(self, name, *args):
+        """
+        The peer may call methods that this client does not know about (e.g.
+        C{onBWDone}), they are ignored.
+        """
+        if name not in rpc.getExposedMethods(self.__class__):
+            log.msg('Ignoring call to %r from the peer' % (name,))
+
+            return
+
+        return core.NetConnection.callExposedMethod(self, name, *args)
+
+
+
+class ClientProtocol(rtmp.RTMPProtocol):
     """
     Client RTMP Protocol.
+
+    Once the handshake is complete, the connection to C{factory.params} is
+    requested and the result is passed to L{ClientFactory.connectionResult}.
     """
 
-    version = versions.FLASH_MIN_H264
-    protocolVersion = protocol.RTMP_PROTOCOL_VERSION
+    netconnection = NetConnection
+
 
     def connectionMade(self):
         """
-        Called when a connection has been made to this protocol instance. Used
-        to do general setup and protocol initialisation.
+        Sends our protocol version, the peer replies with its own.
+        """
+        rtmp.RTMPProtocol.connectionMade(self)
+
+        self.transport.write(chr(self.protocolVersion))
+
+
+    def buildStreamManager(self):
+        return self.nc
+
+
+    def startStreaming(self):
+        self.nc = self.netconnection(self)
+
+        rtmp.RTMPProtocol.startStreaming(self)
+
+        d = self.nc.connect(self.factory.params)
+
+        d.addBoth(self.factory.connectionResult)
+
+
+    def connectionLost(self, reason):
+        rtmp.RTMPProtocol.connectionLost(self, reason)
+
+        self.factory.connectionResult(reason)
+
+
+    def onUpstreamBandwidth(self, bandwidth, extra, timestamp):
+        """
+        The peer is telling us how often it will acknowledge the bytes that we
+        send. Servers wait for us to reply with our own window size before
+        completing the connection.
+        """
+        rtmp.RTMPProtocol.onUpstreamBandwidth(self, bandwidth, extra,
+            timestamp)
+
+        self.sendMessage(message.DownstreamBandwidth(bandwidth), self)
+
+
+    def onInvoke(self, name, callId, args, timestamp):
+        self.nc.onInvoke(name, callId, args, timestamp)
+
+
+    def onNotify(self, name, args, timestamp):
+        self.nc.onNotify(name, args, timestamp)
+
+
+    def onControlMessage(self, *args):
+        """
         """
-        rtmp.BaseProtocol.connectionMade(self)
 
-        self.negotiator = self.factory.getHandshakeNegotiator(self, self.protocolVersion)
 
-        self.negotiator.start(0, self.version)
+    def onBytesRead(self, *args):
+        """
+        """
+
+
+    def closeStream(self):
+        """
+        """
 
-    def connectionLost(self, *args):
-        print args
 
 
-class ClientFactory(twisted_protocol.ClientFactory):
+class ClientFactory(protocol.ClientFactory):
     """
     RTMP client protocol factory.
+
+    @ivar params: The connection parameters sent to the peer, C{app} (the name
+        of the application) is required.
+    @ivar deferred: Fires with the L{NetConnection} once the peer has accepted
+        the connection or errbacks if the connection could not be made.
     """
 
     protocol = ClientProtocol
+    handshake = handshake.ClientNegotiator
+
+    flashVer = versions.FLASH_MIN_H264
 
-    def getHandshakeNegotiator(self, protocol, version):
+    def __init__(self, params):
+        self.params = params
+        self.deferred = defer.Deferred()
+
+        self.params.setdefault('flashVer', str(self.flashVer))
+
+
+    def buildHandshakeNegotiator(self, observer, output):
+        """
+        Returns a negotiator capable of handling client side handshakes.
         """
-        Returns an implementation of L{handshake.IHandshakeNegotiator} based on
-        the version supplied.
+        return self.handshake(observer, output)
 
-        @param protocol: The client protocol instance.
-        @type protocol: L{ClientProtocol}
-        @param version: The RTMP version request.
-        @type version: C{int}
+
+    def connectionResult(self, result):
+        """
+        Called with the result of the connection attempt, the first result is
+        passed to L{deferred}.
         """
-        imp = handshake.get_implementation(version)
+        d, self.deferred = self.deferred, None
+
+        if d is not None:
+            d.callback(result)
+
 
-        return imp.ClientNegotiator(imp.HandshakeObserver(protocol))
+    def clientConnectionFailed(self, connector, reason):
+        self.connectionResult(reason)
@@ -217,19 +217,26 @@ class BaseStream(rpc.AbstractCallHandler):
         @param callId: Used for handling state.
         @param args: A tuple of arguments supplied with the RPC call.
         @param timestamp: A timestamp when the RPC call was made.
-        @return: Returns a L{defer.Deferred} that will hold the result of the
-           RPC call. A return value is not part of the interface but helps
-           greatly with testing.
+        @return: Returns the result of the RPC call, see
+           L{rpc.AbstractCallHandler.callReceived}. A return value is not part
+           of the interface but helps greatly with testing.
         """
-        command = None
+        if self.isCallActive(callId):
+            command = None
 
-        if len(args) > 0 and args[0] is None:
-            command = args[0]
-            args = args[1:]
+            if len(args) > 0 and args[0] is None:
+                command = args[0]
+                args = args[1:]
 
-        if self.isCallActive(callId):
             return self.handleResponse(name, callId, args, command=command)
 
+        if not self.isExposed(name):
+            # the method will not be found, the arguments are not needed
+            return self.callReceived(name, callId)
+
+        if len(args) > 0 and args[0] is None:
+            args = args[1:]
+
         return self.callReceived(name, callId, *args)
 
 
@@ -247,6 +254,10 @@ class BaseStream(rpc.AbstractCallHandler):
            RPC call. A return value is not part of the interface but helps
            greatly with testing.
         """
+        if not self.isExposed(name):
+            # nobody is listening, don't bother decoding the arguments
+            return
+
         self.callReceived(name, rpc.NO_RESULT, *args)
 
 
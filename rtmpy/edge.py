@@ -0,0 +1,355 @@
+# -*- test-case-name: rtmpy.tests.test_edge -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Edge servers pull the streams that their peers play from an origin server.
+
+However many peers play a stream, the edge opens one connection to the origin
+for it. The stream is played there and fed into a local
+L{server.StreamPublisher} that all of the local peers subscribe to::
+
+    factory = server.ServerFactory({'live': server.Application()})
+    factory.edge = edge.Edge('origin.example.com')
+
+The application name and the stream name are the same on the origin as they
+are on the edge. Once the last local peer has stopped playing a stream, the
+pull is stopped after L{Edge.idleTimeout} seconds. The timeout is armed as
+soon as the pull starts, so a stream that the origin does not publish in time
+is not pulled forever, and a pull that has not been published yet is stopped
+straight away when the last peer waiting for it goes away.
+"""
+
+from twisted.internet import defer
+from twisted.python import log
+
+from rtmpy import server, client
+from rtmpy.protocol import RTMP_PORT
+
+
+__all__ = [
+    'Edge',
+]
+
+
+class PullPublisher(server.StreamPublisher):
+    """
+    The local publisher of a pulled stream. Tells the L{Pull} when its
+    subscribers come and go.
+
+    @ivar pull: The L{Pull} that feeds the publisher.
+    """
+
+    pull = None
+
+
+    def addSubscriber(self, subscriber):
+        server.StreamPublisher.addSubscriber(self, subscriber)
+
+        if self.pull is not None:
+            self.pull.subscriberAdded()
+
+
+    def removeSubscriber(self, subscriber):
+        server.StreamPublisher.removeSubscriber(self, subscriber)
+
+        if self.pull is not None:
+            self.pull.checkIdle()
+
+
+
+class Pull(object):
+    """
+    Plays a stream from the origin and publishes it to a local application.
+
+    The pull subscribes to the L{client.NetStream} that plays the stream and
+    passes everything on to the local publisher.
+
+    @ivar edge: The L{Edge} that started the pull.
+    @ivar app: The local application.
+    @ivar name: The name of the stream.
+    @ivar publisher: The local publisher that receives the stream.
+    @ivar connector: Connects to the origin, see L{Edge.connect}.
+    @ivar nc: The L{client.NetConnection} to the origin, once connected.
+    @ivar idleCall: The delayed call that stops the pull while nothing is
+        subscribed to the publisher.
+    @ivar waiting: The number of local peers that are waiting for the stream
+        to be published, see L{addWaiter}.
+    @ivar stopped: Whether L{stop} has been called.
+    """
+
+    def __init__(self, edge, app, name):
+        self.edge = edge
+        self.app = app
+        self.name = name
+
+        self.publisher = edge.publisher_class(None, server.Client(None))
+        self.publisher.pull = self
+        self.published = False
+        self.connector = None
+        self.nc = None
+        self.idleCall = None
+        self.waiting = 0
+        self.stopped = False
+
+
+    def start(self):
+        """
+        Connects to the origin and asks it to play the stream. The idle
+        timeout is armed straight away, the stream must be published and
+        subscribed to before it expires.
+
+        @return: A L{defer.Deferred} that fires once the stream is playing.
+        """
+        self.checkIdle()
+
+        factory = self.edge.buildClientFactory(self.app)
+
+        self.connector = self.edge.connect(factory)
+
+        d = factory.deferred
+
+        d.addCallback(self.connected)
+        d.addCallback(lambda stream: stream.play(self.name, self))
+        d.addCallbacks(self.playing, self.failed)
+
+        return d
+
+
+    def connected(self, nc):
+        if self.stopped:
+            nc.protocol.transport.loseConnection()
+
+            raise defer.CancelledError()
+
+        self.nc = nc
+
+        return nc.createStream()
+
+
+    def playing(self, stream):
+        """
+        The origin is sending the stream, publish it locally.
+        """
+        if self.stopped:
+            return
+
+        if self.app.streams.get(self.name, None) is not None:
+            # published locally in the meantime
+            self.stop()
+
+            return
+
+        self.published = True
+
+        self.app.addPublisher(self.name, self.publisher)
+        self.checkIdle()
+
+
+    def failed(self, fail):
+        if self.stopped:
+            # the call to the origin was cut short by stop()
+            return
+
+        log.msg('Unable to pull %r from the origin' % (self.name,))
+        log.err(fail)
+
+        self.stop()
+
+
+    def subscriberAdded(self):
+        if self.idleCall is not None:
+            self.idleCall.cancel()
+            self.idleCall = None
+
+
+    def addWaiter(self):
+        """
+        A local peer is waiting for the stream to be published.
+        """
+        self.waiting += 1
+
+
+    def removeWaiter(self):
+        """
+        A local peer has stopped waiting for the stream, either because it has
+        been published or because the peer has gone away. The pull is stopped
+        if it has not been published and nothing else is waiting for it.
+        """
+        self.waiting -= 1
+
+        if not self.published and not self.waiting:
+            log.msg('Nothing is waiting for %r, stopping the pull' % (
+                self.name,))
+
+            self.stop()
+
+
+    def checkIdle(self):
+        """
+        Stops the pull after L{Edge.idleTimeout} seconds if nothing is
+        subscribed to the publisher.
+        """
+        if self.publisher.subscribers:
+            return
+
+        if self.idleCall is None:
+            self.idleCall = self.edge.reactor.callLater(self.edge.idleTimeout,
+                self.idle)
+
+
+    def idle(self):
+        self.idleCall = None
+
+        log.msg('Nothing is playing %r, stopping the pull' % (self.name,))
+
+        self.stop()
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.publisher.videoDataReceived(data, timestamp)
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.publisher.audioDataReceived(data, timestamp)
+
+
+    def onMetaData(self, data):
+        self.publisher.onMetaData(data)
+
+
+    def unpublish(self):
+        """
+        The stream from the origin has gone away.
+        """
+        self.nc = None
+
+        self.stop()
+
+
+    def stop(self):
+        """
+        Stops pulling the stream and unpublishes it.
+        """
+        self.stopped = True
+        self.edge.pullStopped(self)
+
+        if self.idleCall is not None:
+            self.idleCall.cancel()
+            self.idleCall = None
+
+        connector, self.connector = self.connector, None
+
+        if self.nc is not None:
+            nc, self.nc = self.nc, None
+
+            nc.protocol.transport.loseConnection()
+        elif connector is not None:
+            # still connecting to the origin
+            connector.disconnect()
+
+        if not self.published:
+            return
+
+        self.published = False
+
+        self.app.removePublisher(self.name, self.publisher)
+
+        try:
+            self.publisher.unpublish()
+        except:
+            log.err()
+
+
+
+class Edge(object):
+    """
+    Pulls streams from an origin server.
+
+    @ivar host: The host name of the origin.
+    @ivar port: The port of the origin.
+    @ivar pulls: The active pulls.
+    @type pulls: C{dict} of C{(appName, name)} -> L{Pull}
+    @ivar idleTimeout: The number of seconds that a stream is pulled for after
+        the last local peer has stopped playing it.
+    """
+
+    pull_class = Pull
+    publisher_class = PullPublisher
+    client_factory = client.ClientFactory
+
+    idleTimeout = 10.0
+
+    def __init__(self, host, port=RTMP_PORT, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.host = host
+        self.port = port
+        self.reactor = reactor
+
+        self.pulls = {}
+
+
+    def buildClientFactory(self, app):
+        """
+        Returns the client factory used to connect to the application C{app}
+        on the origin.
+        """
+        return self.client_factory({
+            'app': app.name,
+            'tcUrl': 'rtmp://%s:%d/%s' % (self.host, self.port, app.name),
+        })
+
+
+    def connect(self, factory):
+        return self.reactor.connectTCP(self.host, self.port, factory)
+
+
+    def pull(self, app, name):
+        """
+        Starts pulling the stream C{name} for the application C{app}, unless it
+        is already being pulled. It is published to C{app} once the origin is
+        playing it.
+
+        @rtype: L{Pull}
+        """
+        key = (app.name, name)
+        pull = self.pulls.get(key, None)
+
+        if pull is not None:
+            return pull
+
+        pull = self.pulls[key] = self.pull_class(self, app, name)
+
+        pull.start()
+
+        return pull
+
+
+    def pullStopped(self, pull):
+        key = (pull.app.name, pull.name)
+
+        if self.pulls.get(key, None) is pull:
+            del self.pulls[key]
+
+
+    def stop(self):
+        """
+        Stops all of the pulls.
+        """
+        for pull in self.pulls.values():
+            pull.stop()
@@ -0,0 +1,159 @@
+# -*- test-case-name: rtmpy.tests.test_flv -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Helpers for the FLV tag bodies carried by RTMP audio/video messages.
+
+The body of a video message is an FLV C{VIDEODATA} tag. The first byte holds
+the frame type (high nibble) and the codec id (low nibble). For AVC (H.264)
+the second byte is the C{AVCPacketType}. Audio messages are similar: the high
+nibble of the first byte is the sound format and for AAC the second byte is the
+C{AACPacketType}.
+
+An FLV file is a L{FILE_HEADER} followed by the tags, each of which is an
+11 byte tag header, the tag body and the size of the tag (C{PreviousTagSize}).
+
+@see: U{Video File Format Specification, Version 10 (Annex E)
+    <http://www.adobe.com/devnet/f4v.html>}
+"""
+
+import struct
+
+
+__all__ = [
+    'get_frame_type',
+    'get_codec_id',
+    'is_keyframe',
+    'is_sequence_header',
+    'is_disposable',
+    'pack_tag_header',
+    'unpack_tag_header',
+]
+
+
+#: A seekable frame.
+KEYFRAME = 1
+#: A non-seekable frame.
+INTER_FRAME = 2
+#: A non-seekable frame that no other frame depends on (H.263 only).
+DISPOSABLE_INTER_FRAME = 3
+#: A keyframe generated by the server.
+GENERATED_KEYFRAME = 4
+#: Video info/command frame, does not contain any picture.
+INFO_FRAME = 5
+
+#: Video codec id for AVC (H.264).
+CODEC_AVC = 7
+
+#: Audio sound format for AAC.
+SOUND_FORMAT_AAC = 10
+
+#: The C{AVCPacketType}/C{AACPacketType} of a sequence header.
+SEQUENCE_HEADER = 0
+
+#: FLV tag types, the same values as the RTMP datatypes.
+TAG_AUDIO = 8
+TAG_VIDEO = 9
+TAG_SCRIPT = 18
+
+#: The header of a file with audio and video, including the first (always 0)
+#: C{PreviousTagSize}.
+FILE_HEADER = 'FLV\x01\x05\x00\x00\x00\x09\x00\x00\x00\x00'
+
+#: The size of a tag header.
+TAG_HEADER_SIZE = 11
+
+#: type and size, timestamp (low 24 bits then the extended byte), stream id.
+_tag_header = struct.Struct('>II3x')
+#: C{PreviousTagSize}, the size of the tag header and body.
+previous_tag_size = struct.Struct('>I')
+
+
+def get_frame_type(data):
+    """
+    Returns the frame type of the video tag C{data}, or C{None} if C{data} is
+    empty.
+    """
+    if not data:
+        return None
+
+    return ord(data[0]) >> 4
+
+
+def get_codec_id(data):
+    """
+    Returns the codec id of the video tag C{data}, or C{None} if C{data} is
+    empty.
+    """
+    if not data:
+        return None
+
+    return ord(data[0]) & 0x0f
+
+
+def is_keyframe(data):
+    """
+    Whether the video tag C{data} can be decoded without any previous frames.
+    """
+    return get_frame_type(data) in (KEYFRAME, GENERATED_KEYFRAME)
+
+
+def is_sequence_header(data, audio=False):
+    """
+    Whether C{data} is an AVC (or AAC if C{audio} is set) sequence header, the
+    decoder configuration that must be sent before any other frame.
+    """
+    if len(data) < 2:
+        return False
+
+    if audio:
+        if ord(data[0]) >> 4 != SOUND_FORMAT_AAC:
+            return False
+    elif ord(data[0]) & 0x0f != CODEC_AVC:
+        return False
+
+    return ord(data[1]) == SEQUENCE_HEADER
+
+
+def is_disposable(data):
+    """
+    Whether the video tag C{data} can be dropped without corrupting the
+    picture once the next keyframe has been sent. This is true of every inter
+    frame that is not a sequence header.
+    """
+    if get_frame_type(data) not in (INTER_FRAME, DISPOSABLE_INTER_FRAME):
+        return False
+
+    return not is_sequence_header(data)
+
+
+def pack_tag_header(tagType, size, timestamp):
+    """
+    Returns the 11 byte header of a tag of C{size} bytes.
+    """
+    return _tag_header.pack((tagType << 24) | size,
+        ((timestamp & 0xffffff) << 8) | ((timestamp >> 24) & 0xff))
+
+
+def unpack_tag_header(data, offset=0):
+    """
+    Returns the C{(tagType, size, timestamp)} of the tag header that starts at
+    C{offset} in C{data}.
+    """
+    a, b = _tag_header.unpack_from(data, offset)
+
+    return a >> 24, a & 0xffffff, (b >> 8) | ((b & 0xff) << 24)
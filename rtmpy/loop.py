@@ -0,0 +1,423 @@
+# -*- test-case-name: rtmpy.tests.test_loop -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Serves RTMPy protocols from an event loop other than the Twisted reactor.
+
+A L{Loop} runs the standard library's C{asyncore} loop. The protocols are the
+same as they are on the reactor (L{server.ServerFactory} builds them), only
+the transport and the clock are different. The clock of the loop is set as the
+C{clock} of every protocol, so the handshake, the codec pumps, the pacing and
+the L{server.NetConnection} logic all run on the loop::
+
+    factory = server.ServerFactory({'live': server.Application()})
+
+    loop.run_server(factory, 1935)
+
+Recording (L{server.Application.recordPath}), playing files
+(L{server.Application.vodPath}) and pulling streams from an origin
+(L{server.ServerFactory.edge}) still need the reactor, for its thread pool,
+clock and outgoing connections. Nothing would run them on a loop, so
+L{Loop.listenTCP} refuses a factory that uses them (see L{check_factory}).
+Applications that are registered once the factory is listening are not
+checked.
+"""
+
+import time
+import socket
+import asyncore
+import collections
+
+from zope.interface import implements
+from twisted.internet import task, address, error, interfaces
+from twisted.python import log, failure
+
+from rtmpy.protocol import RTMP_PORT
+
+
+__all__ = [
+    'Clock',
+    'Loop',
+    'check_factory',
+    'run_server',
+]
+
+
+class Clock(task.Clock):
+    """
+    Provides C{seconds} and C{callLater} on a L{Loop}, with the wall clock.
+    """
+
+    def seconds(self):
+        return time.time()
+
+
+    def getTimeout(self):
+        """
+        Returns the number of seconds until the next call is due, or C{None}
+        if nothing has been scheduled.
+        """
+        if not self.calls:
+            return None
+
+        self._sortCalls()
+
+        return max(self.calls[0].getTime() - self.seconds(), 0)
+
+
+    def runUntilCurrent(self):
+        """
+        Runs the calls that are due. Calls scheduled while doing so are left
+        for the next iteration of the loop, so that a C{callLater(0)} yields to
+        the sockets.
+        """
+        now = self.seconds()
+
+        self._sortCalls()
+
+        due = [call for call in self.calls if call.getTime() <= now]
+
+        for call in due:
+            if call.cancelled or call.called or call.getTime() > now:
+                continue
+
+            self.calls.remove(call)
+            call.called = 1
+
+            try:
+                call.func(*call.args, **call.kw)
+            except:
+                log.err()
+
+
+
+class Connection(asyncore.dispatcher):
+    """
+    A TCP connection on a L{Loop}, the transport of C{protocol}.
+
+    A registered streaming producer is paused while more than C{bufferSize}
+    bytes are waiting to be sent and resumed once they have been.
+
+    @ivar protocol: The protocol connected to the transport.
+    @ivar buffer: The data waiting to be sent.
+    @ivar offset: The number of bytes of the first chunk in L{buffer} that
+        have already been sent.
+    @ivar buffered: The number of bytes in L{buffer} that have not been sent.
+    @ivar producer: The registered producer, if any.
+    """
+
+    implements(interfaces.ITransport, interfaces.IConsumer)
+
+    bufferSize = 0x10000
+    readSize = 0x10000
+
+    def __init__(self, loop, sock, protocol):
+        asyncore.dispatcher.__init__(self, sock, map=loop.map)
+
+        self.protocol = protocol
+        self.buffer = collections.deque()
+        self.offset = 0
+        self.buffered = 0
+        self.producer = None
+        self.producerPaused = False
+        self.disconnecting = False
+        self.disconnected = False
+
+        protocol.clock = loop.clock
+        protocol.makeConnection(self)
+
+
+    def write(self, data):
+        if self.disconnected or not data:
+            return
+
+        self.buffer.append(data)
+        self.buffered += len(data)
+
+        if self.producer is not None and not self.producerPaused and \
+                self.buffered > self.bufferSize:
+            self.producerPaused = True
+            self.producer.pauseProducing()
+
+
+    def writeSequence(self, data):
+        for chunk in data:
+            self.write(chunk)
+
+
+    def loseConnection(self):
+        self.disconnecting = True
+
+        if not self.buffered:
+            self.handle_close()
+
+
+    def getPeer(self):
+        return address.IPv4Address('TCP', *self.addr[:2])
+
+
+    def getHost(self):
+        return address.IPv4Address('TCP', *self.socket.getsockname()[:2])
+
+
+    def registerProducer(self, producer, streaming):
+        if not streaming:
+            raise TypeError('Only streaming producers are supported')
+
+        self.producer = producer
+        self.producerPaused = False
+
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+    def readable(self):
+        return not self.disconnected
+
+
+    def writable(self):
+        return self.buffered > 0
+
+
+    def handle_read(self):
+        data = self.recv(self.readSize)
+
+        if data:
+            self.protocol.dataReceived(data)
+
+
+    def handle_write(self):
+        """
+        Sends the chunks from the head of L{buffer} until the socket takes
+        less than it is offered. The chunks are not joined, a partially sent
+        chunk is resumed from L{offset}.
+        """
+        chunks = self.buffer
+
+        while chunks:
+            data = chunks[0]
+
+            if self.offset:
+                data = buffer(data, self.offset)
+
+            sent = self.send(data)
+            self.buffered -= sent
+
+            if sent < len(data):
+                self.offset += sent
+
+                return
+
+            chunks.popleft()
+            self.offset = 0
+
+        if self.producerPaused:
+            self.producerPaused = False
+            self.producer.resumeProducing()
+
+        if self.disconnecting:
+            self.handle_close()
+
+
+    def handle_close(self):
+        if self.disconnected:
+            return
+
+        self.disconnected = True
+        self.close()
+
+        producer, self.producer = self.producer, None
+
+        if producer is not None:
+            producer.stopProducing()
+
+        self.protocol.connectionLost(failure.Failure(error.ConnectionDone()))
+
+
+    def handle_error(self):
+        log.err()
+
+        self.handle_close()
+
+
+
+class Port(asyncore.dispatcher):
+    """
+    A listening TCP socket on a L{Loop}.
+
+    @ivar factory: Builds the protocols of the accepted connections.
+    """
+
+    def __init__(self, loop, port, factory, interface='', backlog=50):
+        asyncore.dispatcher.__init__(self, map=loop.map)
+
+        self.loop = loop
+        self.factory = factory
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((interface, port))
+        self.listen(backlog)
+
+        factory.doStart()
+
+
+    def getHost(self):
+        return address.IPv4Address('TCP', *self.socket.getsockname()[:2])
+
+
+    def handle_accept(self):
+        pair = self.accept()
+
+        if pair is None:
+            return
+
+        sock, addr = pair
+        protocol = self.factory.buildProtocol(
+            address.IPv4Address('TCP', *addr[:2]))
+
+        if protocol is None:
+            sock.close()
+
+            return
+
+        Connection(self.loop, sock, protocol)
+
+
+    def stopListening(self):
+        if not self.accepting:
+            return
+
+        self.close()
+        self.factory.doStop()
+
+
+    def handle_close(self):
+        self.stopListening()
+
+
+    def handle_error(self):
+        log.err()
+
+
+
+class Loop(object):
+    """
+    An C{asyncore} event loop for RTMPy protocols.
+
+    @ivar map: The C{asyncore} socket map of the loop.
+    @ivar clock: The L{Clock} of the loop.
+    @ivar maxTimeout: The longest that L{iterate} waits for the sockets when
+        nothing has been scheduled.
+    @ivar running: Whether L{run} is running.
+    """
+
+    maxTimeout = 1.0
+
+    def __init__(self):
+        self.map = {}
+        self.clock = Clock()
+        self.running = False
+
+
+    def listenTCP(self, port, factory, interface='', backlog=50):
+        """
+        Listens on C{port} and serves the protocols built by C{factory}.
+
+        C{ValueError} is raised if C{factory} uses a feature that needs the
+        reactor, see L{check_factory}.
+
+        @rtype: L{Port}
+        """
+        check_factory(factory)
+
+        return Port(self, port, factory, interface, backlog)
+
+
+    def iterate(self, timeout=None):
+        """
+        Waits up to C{timeout} seconds (L{maxTimeout} if C{None}) for the
+        sockets, less if a call is due sooner, then runs the calls that are
+        due.
+        """
+        if timeout is None:
+            timeout = self.maxTimeout
+
+        delay = self.clock.getTimeout()
+
+        if delay is not None:
+            timeout = min(timeout, delay)
+
+        if self.map:
+            asyncore.loop(timeout, map=self.map, count=1)
+        elif timeout:
+            time.sleep(timeout)
+
+        self.clock.runUntilCurrent()
+
+
+    def run(self):
+        """
+        Iterates until L{stop} is called.
+        """
+        self.running = True
+
+        while self.running:
+            self.iterate()
+
+
+    def stop(self):
+        """
+        Closes every connection and listening socket and stops L{run}.
+        """
+        self.running = False
+
+        for dispatcher in self.map.values():
+            dispatcher.handle_close()
+
+
+
+def check_factory(factory):
+    """
+    Raises C{ValueError} if C{factory} (a L{server.ServerFactory}) uses a
+    feature that needs the Twisted reactor: an C{edge}, or an application with
+    a C{recordPath} or a C{vodPath}.
+    """
+    if getattr(factory, 'edge', None) is not None:
+        raise ValueError('Edge pulls need the reactor, they cannot be served '
+            'from a Loop')
+
+    apps = dict(getattr(factory, '_pendingApplications', {}))
+    apps.update(getattr(factory, 'applications', {}))
+
+    for name, app in apps.items():
+        for attr in ('recordPath', 'vodPath'):
+            if getattr(app, attr, None) is not None:
+                raise ValueError('%s of application %r needs the reactor, it '
+                    'cannot be served from a Loop' % (attr, name))
+
+
+
+def run_server(factory, port=RTMP_PORT, interface=''):
+    """
+    Serves C{factory} on C{port} with a new L{Loop}, until the loop is stopped.
+    """
+    loop = Loop()
+
+    loop.listenTCP(port, factory, interface)
+    loop.run()
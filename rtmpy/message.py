@@ -19,6 +19,7 @@ RTMP message implementations.
 
 from zope.interface import Interface, implements
 import pyamf
+from pyamf.util import BufferedByteStream
 
 from rtmpy.util import add_to_class
 
@@ -54,6 +55,13 @@ INVOKE = 0x14
 #: FLV data
 FLV_DATA = 0x16
 
+#: The limit types of L{UpstreamBandwidth}. A hard limit replaces the current
+#: limit, a soft limit can only lower it and a dynamic limit is hard if the
+#: current limit is hard (and is ignored otherwise).
+LIMIT_HARD = 0
+LIMIT_SOFT = 1
+LIMIT_DYNAMIC = 2
+
 
 @add_to_class
 def set_type(locals, type):
@@ -233,7 +241,8 @@ class IMessageListener(Interface):
         @param bandwidth: The amount of bandwidth available (it appears to be
             measured in Kbps).
         @type bandwidth: C{int}
-        @param extra: Not quite sure what this represents atm.
+        @param extra: The limit type, L{LIMIT_HARD}, L{LIMIT_SOFT} or
+            L{LIMIT_DYNAMIC}.
         @type extra: C{int}
         @param timestamp: The timestamp that this message was dispatched.
         """
@@ -521,7 +530,8 @@ class UpstreamBandwidth(Message):
 
     @param bandwidth: The upstream bandwidth available.
     @type bandwidth: C{int}
-    @param extra: Not sure what this is supposed to represent at the moment.
+    @param extra: The limit type, L{LIMIT_HARD}, L{LIMIT_SOFT} or
+        L{LIMIT_DYNAMIC}.
     """
 
     set_type(UPSTREAM_BANDWIDTH)
@@ -572,6 +582,86 @@ class UpstreamBandwidth(Message):
 
 
 
+class Arguments(object):
+    """
+    The arguments of a decoded L{Notify} or L{Invoke}, which are only decoded
+    as they are accessed. A call to a method that is not exposed can then be
+    rejected without decoding them.
+
+    Behaves like a (read only) C{list}. Asking for an item decodes the
+    arguments up to and including that item, anything else decodes them all.
+
+    @ivar decoder: The AMF decoder positioned at the next argument to decode.
+        C{None} once all of the arguments have been decoded.
+    """
+
+
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.items = []
+
+
+    def _decode(self, count=None):
+        items = self.items
+        decoder = self.decoder
+
+        while decoder is not None and (count is None or len(items) < count):
+            try:
+                items.append(decoder.next())
+            except StopIteration:
+                decoder = self.decoder = None
+
+        return items
+
+
+    def __len__(self):
+        return len(self._decode())
+
+
+    def __nonzero__(self):
+        return bool(self._decode(1))
+
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index >= 0:
+            items = self._decode(index + 1)
+        else:
+            items = self._decode()
+
+        return items[index]
+
+
+    def __getslice__(self, i, j):
+        return self._decode()[i:j]
+
+
+    def __iter__(self):
+        i = 0
+
+        while True:
+            items = self._decode(i + 1)
+
+            if i >= len(items):
+                return
+
+            yield items[i]
+
+            i += 1
+
+
+    def __eq__(self, other):
+        return self._decode() == other
+
+
+    def __ne__(self, other):
+        return self._decode() != other
+
+
+    def __repr__(self):
+        return repr(self._decode())
+
+
+
 class Notify(Message):
     """
     A notification message.
@@ -579,10 +669,14 @@ class Notify(Message):
     @param name: The method name to call.
     @type name: C{str}
     @param args: A list of method arguments.
+    @cvar lazy: Whether the decoded arguments are an L{Arguments} instance
+        (decoded as they are accessed) rather than a C{list}.
     """
 
     set_type(NOTIFY)
 
+    lazy = True
+
 
     def __init__(self, name=None, *args):
         self.name = name
@@ -596,7 +690,11 @@ class Notify(Message):
         decoder = pyamf.get_decoder(pyamf.AMF0, stream=buf)
 
         self.name = decoder.next()
-        self.argv = [x for x in decoder]
+
+        if self.lazy:
+            self.argv = Arguments(decoder)
+        else:
+            self.argv = [x for x in decoder]
 
 
     def encode(self, buf):
@@ -622,11 +720,14 @@ class Notify(Message):
 class Invoke(Message):
     """
     Similar to L{Notify} but a reply is expected.
+
+    @cvar lazy: See L{Notify.lazy}.
     """
 
     set_type(INVOKE)
 
     encoding = pyamf.AMF0
+    lazy = True
 
 
     def __init__(self, name=None, id=None, *args):
@@ -643,7 +744,11 @@ class Invoke(Message):
 
         self.name = decoder.next()
         self.id = decoder.next()
-        self.argv = list(decoder)
+
+        if self.lazy:
+            self.argv = Arguments(decoder)
+        else:
+            self.argv = list(decoder)
 
 
     def encode(self, buf):
@@ -755,6 +860,133 @@ class VideoData(StreamingMessage):
 
 
 
+class Prepared(Message):
+    """
+    A message whose body has already been encoded. See L{prepare} and
+    L{Template}.
+
+    @ivar body: The encoded body of the message.
+    @type body: C{str}
+    """
+
+
+    def __init__(self, datatype, body):
+        self.__data_type__ = datatype
+        self.body = body
+
+
+    def decode(self, buf):
+        """
+        Keeps the body of the message as is.
+        """
+        try:
+            self.body = buf.read()
+        except IOError:
+            self.body = ''
+
+
+    def encode(self, buf):
+        """
+        Writes the already encoded body.
+        """
+        buf.write(self.body)
+
+
+    def dispatch(self, listener, timestamp):
+        """
+        Decodes the body as the message it was prepared from and dispatches
+        that instead.
+        """
+        m = classByType(self.__data_type__)()
+        m.decode(BufferedByteStream(self.body))
+
+        return m.dispatch(listener, timestamp)
+
+
+
+class Fragment(str):
+    """
+    An AMF0 encoded value. A L{Template} writes it as is rather than encoding
+    it.
+    """
+
+
+
+def encode_amf0(*values):
+    """
+    Returns the AMF0 encoding of C{values}, one after the other.
+
+    @rtype: L{Fragment}
+    """
+    buf = BufferedByteStream()
+    encoder = pyamf.get_encoder(pyamf.AMF0, buf)
+
+    for v in values:
+        encoder.writeElement(v)
+
+    return Fragment(buf.getvalue())
+
+
+
+def prepare(msg):
+    """
+    Encodes C{msg} once so that it can be sent any number of times without
+    being encoded again.
+
+    @type msg: L{IMessage}
+    @rtype: L{Prepared}
+    """
+    buf = BufferedByteStream()
+
+    msg.encode(buf)
+
+    return Prepared(msg.__data_type__, buf.getvalue())
+
+
+
+class Template(object):
+    """
+    Builds L{Invoke} or L{Notify} messages whose leading arguments never
+    change. These are encoded in AMF0 once, only the arguments passed to
+    L{build} are encoded for every message::
+
+        onStatus = Template(Invoke, 'onStatus', 0, None)
+
+        stream.sendMessage(onStatus.build({'code': 'NetStream.Data.Start'}))
+
+    @ivar datatype: The type of message that is built.
+    @ivar prefix: The AMF0 encoding of the constant arguments.
+    """
+
+
+    def __init__(self, cls, name, *args):
+        if getattr(cls, 'encoding', pyamf.AMF0) != pyamf.AMF0:
+            raise EncodeError('Templates only support AMF0 (got %r)' % (
+                cls,))
+
+        self.datatype = cls.__data_type__
+        self.prefix = encode_amf0(name, *args)
+
+
+    def build(self, *args):
+        """
+        Returns a message with C{args} appended to the constant arguments. Any
+        L{Fragment} is appended as is, everything else is encoded.
+
+        @rtype: L{Prepared}
+        """
+        parts = [self.prefix]
+
+        for a in args:
+            if not isinstance(a, Fragment):
+                a = encode_amf0(a)
+
+            parts.append(a)
+
+        return Prepared(self.datatype, ''.join(parts))
+
+
+
 #: Map event types to event classes
 TYPE_MAP = {}
 
@@ -44,3 +44,129 @@ class IMessageDispatcher(Interface):
 class IStreamManager(Interface):
     """
     """
+
+
+
+class IByteBuffer(Interface):
+    """
+    The byte container used by the RTMP codecs to hold raw RTMP data. This is
+    the subset of the L{pyamf.util.BufferedByteStream} api that the codecs use,
+    including the C{read_*}/C{write_*} methods and C{endian} attribute of
+    C{pyamf.util.pure.DataTypeMixIn}.
+
+    Positions are relative to the start of the unconsumed data.
+    """
+
+    endian = Attribute("The byte order used by the C{read_*}/C{write_*} "
+        "methods.")
+
+    def __len__():
+        """
+        Returns the number of bytes held by the buffer.
+        """
+
+    def tell():
+        """
+        Returns the position of the stream pointer.
+        """
+
+    def seek(pos, mode=0):
+        """
+        Moves the stream pointer, C{mode} has the same meaning as for
+        C{file.seek}.
+        """
+
+    def remaining():
+        """
+        Returns the number of bytes after the stream pointer.
+        """
+
+    def at_eof():
+        """
+        Whether the stream pointer is at the end of the buffer.
+        """
+
+    def read(length=-1):
+        """
+        Reads and returns C{length} bytes (or all remaining bytes if C{-1}) and
+        moves the stream pointer past them. Raises C{IOError} if there are not
+        enough bytes.
+        """
+
+    def peek(size=1):
+        """
+        Returns up to C{size} bytes from the stream pointer without moving it.
+        """
+
+    def write(data):
+        """
+        Writes C{data} at the stream pointer.
+        """
+
+    def append(data):
+        """
+        Appends C{data} to the end of the buffer without moving the stream
+        pointer.
+        """
+
+    def getvalue():
+        """
+        Returns the contents of the buffer as a C{str}.
+        """
+
+    def truncate(size=0):
+        """
+        Truncates the buffer to C{size} bytes.
+        """
+
+    def consume():
+        """
+        Discards all data before the stream pointer. The stream pointer is C{0}
+        afterwards.
+        """
+
+
+class ISegmentBuffer(Interface):
+    """
+    An output buffer that keeps the written byte strings as a list of segments
+    rather than copying them into one contiguous block, so that they can be
+    handed to C{ITransport.writeSequence} as is. Provides the C{write_*}
+    methods and C{endian} attribute of C{pyamf.util.pure.DataTypeMixIn}.
+    """
+
+    endian = Attribute("The byte order used by the C{write_*} methods.")
+
+    def __len__():
+        """
+        Returns the number of bytes held by the buffer.
+        """
+
+    def tell():
+        """
+        Returns the number of bytes held by the buffer.
+        """
+
+    def write(data):
+        """
+        Appends C{data} to the buffer.
+        """
+
+    def getSegments():
+        """
+        Returns the list of byte strings that make up the buffer.
+        """
+
+    def getvalue():
+        """
+        Returns the contents of the buffer as a C{str}.
+        """
+
+    def consume():
+        """
+        Discards the contents of the buffer.
+        """
+
+    def truncate(size=0):
+        """
+        Discards the contents of the buffer, C{size} must be C{0}.
+        """
@@ -30,12 +30,12 @@ into fixed size body chunks.
 """
 
 from twisted.python import log, failure
-from twisted.internet import protocol, task
+from twisted.internet import protocol
 from zope.interface import Interface, Attribute, implements
 from pyamf.util import BufferedByteStream
 
 from rtmpy import message
-from rtmpy.protocol.rtmp import codec
+from rtmpy.protocol.rtmp import codec, buffer, pump, pacer
 from rtmpy.protocol import interfaces
 
 
@@ -86,7 +86,12 @@ class MessageDispatcher(object):
         """
         m = message.classByType(datatype)()
 
-        m.decode(BufferedByteStream(data))
+        if isinstance(m, message.StreamingMessage):
+            # audio/video data is passed on as is, there is nothing to decode
+            m.data = data
+        else:
+            m.decode(BufferedByteStream(data))
+
         m.dispatch(stream, timestamp)
 
 
@@ -108,11 +113,55 @@ class BaseStreamer(object):
     Provides all the base functionality for handling an RTMP input/output.
 
     @ivar decoder: RTMP Decoder that is fed data via L{dataReceived}
+    @ivar syncDecodeBudget: If there are no more than this number of bytes
+        waiting to be decoded when data is received, they are decoded there and
+        then (see L{codec.Decoder.decodeAll}) rather than a frame at a time by
+        the decoder's pump. C{0} disables this.
+    @ivar decodingBuffer: The L{interfaces.IByteBuffer} implementation that
+        holds the raw RTMP data waiting to be decoded.
+    @ivar highWatermark: The number of bytes waiting to be encoded and written
+        to the peer at which the connection is considered congested. Streaming
+        channels report themselves as paused while the connection is congested.
+        C{None} disables the check.
+    @ivar lowWatermark: The number of bytes waiting to be written at which a
+        congested connection is considered clear again.
+    @ivar encodingBuffer: The buffer implementation that holds the encoded RTMP
+        data waiting to be written. An L{interfaces.ISegmentBuffer} (the
+        default) is written with C{writeSequence}, anything else must provide
+        L{interfaces.IByteBuffer}.
+    @ivar clock: Provides C{seconds} and C{callLater} for the
+        L{pump.Pump}s that drive the encoder and decoder. C{None} uses the
+        reactor. Anything else lets another event loop drive the codec, see
+        L{rtmpy.loop}.
+    @ivar timeSlice: The number of seconds that the encoder or decoder may run
+        for before yielding to the reactor. See L{pump.Pump}.
+    @ivar byteSlice: The number of bytes that the encoder or decoder may
+        process before yielding to the reactor. See L{pump.Pump}.
+    @ivar sendRate: The number of bytes per second that may be sent to the
+        peer, see L{setSendRate}. C{None} means no limit.
+    @ivar sendBurst: The number of bytes that may be sent at once after a quiet
+        period. C{None} allows a tenth of a second's worth of L{sendRate}.
+    @ivar peerBandwidth: The acknowledgement window that the peer has set, in
+        bytes, see L{onUpstreamBandwidth}. It is not a rate and does not limit
+        L{sendRate}.
+    @ivar peerLimitType: The type of L{peerBandwidth}.
     """
 
     implements(message.IMessageListener)
 
     dispatcher = MessageDispatcher
+    syncDecodeBudget = 0
+    highWatermark = 0x40000
+    lowWatermark = 0x10000
+    decodingBuffer = BufferedByteStream
+    encodingBuffer = buffer.SegmentBuffer
+    clock = None
+    timeSlice = pump.Pump.timeSlice
+    byteSlice = pump.Pump.byteSlice
+    sendRate = None
+    sendBurst = None
+    peerBandwidth = None
+    peerLimitType = None
 
 
     @property
@@ -122,7 +171,9 @@ class BaseStreamer(object):
 
         If all the input buffer has been consumed, this will be C{False}.
         """
-        return getattr(self, 'decoding_task', None) is not None
+        p = getattr(self, 'decoderPump', None)
+
+        return p is not None and p.running
 
 
     @property
@@ -130,7 +181,9 @@ class BaseStreamer(object):
         """
         Whether this streamer is currently encoding RTMP message/s.
         """
-        return getattr(self, 'encoding_task', None) is not None
+        p = getattr(self, 'encoderPump', None)
+
+        return p is not None and p.running
 
 
     def getWriter(self):
@@ -152,6 +205,40 @@ class BaseStreamer(object):
         raise NotImplementedError
 
 
+    def getClock(self):
+        """
+        Returns L{clock}, or the reactor if it is not set.
+        """
+        clock = self.clock
+
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        return clock
+
+
+    def buildPump(self, iterator):
+        """
+        Returns a L{pump.Pump} that drives C{iterator}.
+        """
+        p = pump.Pump(iterator, self.getClock(), self.codecFailed)
+
+        p.timeSlice = self.timeSlice
+        p.byteSlice = self.byteSlice
+
+        return p
+
+
+    def codecFailed(self, reason):
+        """
+        Called when the encoder or decoder has raised an error. It is no longer
+        being driven.
+
+        @param reason: L{failure.Failure}
+        """
+        log.err(reason)
+
+
     def getDispatcher(self):
         """
         Returns an instance that will provide L{interfaces.IMessageDispatcher}
@@ -172,16 +259,20 @@ class BaseStreamer(object):
         self.streamManager = self.buildStreamManager()
         self.controlStream = self.streamManager.getControlStream()
 
-        self._decodingBuffer = BufferedByteStream()
-        self._encodingBuffer = BufferedByteStream()
+        self._decodingBuffer = self.decodingBuffer()
+        self._encodingBuffer = self.encodingBuffer()
 
         self.decoder = codec.Decoder(self.getDispatcher(), self.streamManager,
             stream=self._decodingBuffer)
         self.encoder = codec.Encoder(self.getWriter(),
             stream=self._encodingBuffer)
+        self.encoder.highWatermark = self.highWatermark
+        self.encoder.lowWatermark = self.lowWatermark
+
+        self.decoderPump = self.buildPump(self.decoder)
+        self.encoderPump = self.buildPump(self.encoder)
 
-        self.decoder_task = None
-        self.encoder_task = None
+        self.updatePacing()
 
 
     def stopStreaming(self, reason=None):
@@ -195,8 +286,12 @@ class BaseStreamer(object):
         del self._decodingBuffer
         del self._encodingBuffer
 
-        del self.decoder_task, self.decoder
-        del self.encoder_task, self.encoder
+        self.decoderPump.stop()
+        self.encoderPump.stop()
+        self.encoder.setBucket(None)
+
+        del self.decoderPump, self.decoder
+        del self.encoderPump, self.encoder
 
 
     def dataReceived(self, data):
@@ -205,47 +300,33 @@ class BaseStreamer(object):
         """
         self.decoder.send(data)
 
-        if not self.decoding:
-            self.startDecoding()
-
+        if self.decoding:
+            return
 
-    def startDecoding(self):
-        """
-        Called to start the decoding process.
+        budget = self.syncDecodeBudget
 
-        @return: A C{Deferred} which will kill the task once the decoding is
-            done or on error.
-        """
-        def cullTask(result):
-            self.decoder_task = None
+        if budget and self.decoder.stream.remaining() <= budget:
+            self.decoder.decodeAll()
 
-            return result
+            return
 
-        self.decoder_task = task.coiterate(self.decoder)
+        self.startDecoding()
 
-        self.decoder_task.addBoth(cullTask)
 
-        return self.decoder_task
+    def startDecoding(self):
+        """
+        Called to start the decoding process. The buffered data is decoded
+        there and then, unless there is more of it than fits in a time/byte
+        slice. L{codecFailed} is called if decoding fails.
+        """
+        self.decoderPump.run()
 
 
     def startEncoding(self):
         """
-        Called to start asynchronously iterate the encoder.
-
-        @return: A C{Deferred} which will kill the task once the encoder is
-            done or on error will kill the connection.
-        @todo: See _startDecoding todo. The same applies here.
+        Called to start the encoding process. See L{startDecoding}.
         """
-        def cullTask(result):
-            self.encoder_task = None
-
-            return result
-
-        self.encoder_task = task.coiterate(self.encoder)
-
-        self.encoder_task.addBoth(cullTask)
-
-        return self.encoder_task
+        self.encoderPump.run()
 
 
     def sendMessage(self, msg, stream, whenDone=None):
@@ -260,18 +341,16 @@ class BaseStreamer(object):
         @param whenDone: A callback fired when the message has been written to
             the RTMP stream. See L{BaseStream.sendMessage}
         """
-        buf = BufferedByteStream()
         e = self.encoder
 
-        # this will probably need to be rethought as this could block for an
-        # unacceptable amount of time. For most messages however it seems to be
-        # fast enough and the penalty for setting up a new thread is too high.
-        msg.encode(buf)
-
-        e.send(buf.getvalue(), msg.__data_type__,
-            stream.streamId, stream.timestamp, whenDone)
+        # the message is encoded straight into the payload buffer of the
+        # channel that sends it. This will probably need to be rethought as
+        # this could block for an unacceptable amount of time. For most
+        # messages however it seems to be fast enough and the penalty for
+        # setting up a new thread is too high.
+        e.sendMessage(msg, stream.streamId, stream.timestamp, whenDone)
 
-        if e.active and not self.encoder_task:
+        if e.active and not self.encoderPump.running:
             self.startEncoding()
 
 
@@ -289,7 +368,48 @@ class BaseStreamer(object):
             # todo: make this better
             raise RuntimeError('No streaming channel available')
 
-        return codec.StreamingChannel(channel, stream.streamId, self.getWriter())
+        return codec.StreamingChannel(channel, stream.streamId,
+            self.encoder.output, self.encoder)
+
+
+    def setSendRate(self, rate, burst=None):
+        """
+        Limits the rate at which data is sent to the peer to C{rate} bytes per
+        second, with a burst allowance of C{burst} bytes. A C{rate} of C{None}
+        lifts the limit.
+        """
+        self.sendRate = rate
+        self.sendBurst = burst
+
+        self.updatePacing()
+
+
+    def updatePacing(self):
+        """
+        Gives the encoder a L{pacer.TokenBucket} for L{sendRate}, if it is
+        set. Does nothing until streaming has started.
+        """
+        encoder = getattr(self, 'encoder', None)
+
+        if encoder is None:
+            return
+
+        rate = self.sendRate
+
+        if rate is None:
+            encoder.setBucket(None)
+
+            return
+
+        burst = self.sendBurst
+
+        if burst is None:
+            burst = rate // 10
+
+        if encoder.bucket is None:
+            encoder.setBucket(pacer.TokenBucket(rate, burst, self.getClock()))
+        else:
+            encoder.bucket.setRate(rate, burst)
 
 
     def onFrameSize(self, size, timestamp):
@@ -312,6 +432,29 @@ class BaseStreamer(object):
         self.decoder.setBytesInterval(interval)
 
 
+    def onUpstreamBandwidth(self, bandwidth, extra, timestamp):
+        """
+        Called when the peer sets the window of bytes that we may send before
+        it acknowledges them (Set Peer Bandwidth). The window is recorded
+        following the limit types but, as it is not a rate, it does not pace
+        the connection, see L{setSendRate}.
+
+        @param bandwidth: The size of the window in bytes.
+        @param extra: The limit type, see L{message.LIMIT_HARD}.
+        """
+        if extra == message.LIMIT_DYNAMIC:
+            if self.peerLimitType != message.LIMIT_HARD:
+                return
+
+            extra = message.LIMIT_HARD
+
+        if extra == message.LIMIT_SOFT and self.peerBandwidth is not None:
+            bandwidth = min(bandwidth, self.peerBandwidth)
+
+        self.peerBandwidth = bandwidth
+        self.peerLimitType = extra
+
+
 
 class StateEngine(BaseStreamer):
     """
@@ -550,6 +693,19 @@ class RTMPProtocol(StateEngine, protocol.Protocol):
     def buildHandshakeNegotiator(self):
         return self.factory.buildHandshakeNegotiator(self, self.transport)
 
+    def startStreaming(self):
+        """
+        Registers the encoder as a streaming producer with the transport, so
+        that encoding stops while the transport's buffer is full. The
+        transport's buffer size is set to C{highWatermark}.
+        """
+        StateEngine.startStreaming(self)
+
+        if self.highWatermark is not None:
+            self.transport.bufferSize = self.highWatermark
+
+        self.transport.registerProducer(self.encoder, True)
+
     def dataReceived(self, data):
         try:
             StateEngine.dataReceived(self, data)
@@ -557,21 +713,8 @@ class RTMPProtocol(StateEngine, protocol.Protocol):
             self.logAndDisconnect(failure.Failure())
 
 
-    def startDecoding(self):
-        """
-        """
-        d = StateEngine.startDecoding(self)
-
-        d.addErrback(self.logAndDisconnect)
-
-        return d
-
-
-    def startEncoding(self):
+    def codecFailed(self, reason):
         """
+        The connection cannot carry on if the encoder or decoder has failed.
         """
-        d = StateEngine.startEncoding(self)
-
-        d.addErrback(self.logAndDisconnect)
-
-        return d
+        self.logAndDisconnect(reason)
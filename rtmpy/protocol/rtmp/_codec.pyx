@@ -0,0 +1,231 @@
+# cython: binding=True
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+C implementations of the hot paths of the RTMP chunk codec.
+
+This module is optional. L{rtmpy.protocol.rtmp.header} and
+L{rtmpy.protocol.rtmp.codec} replace their pure Python equivalents with the
+functions found here if it can be imported.
+"""
+
+from rtmpy.protocol.rtmp.header import Header, HeaderError
+
+
+cdef enum:
+    MAX_HEADER_SIZE = 18
+
+
+cdef int get_size_mask(old, new) except -1:
+    # header.get_size_mask is a cdef function when header.py is compiled
+    if old is new:
+        return 0xc0
+
+    if old.channelId != new.channelId:
+        raise HeaderError('channelId mismatch on diff old=%r, new=%r' % (
+            old, new))
+
+    if old.streamId != new.streamId:
+        return 0
+
+    if old.datatype == new.datatype and old.bodyLength == new.bodyLength:
+        if old.timestamp == new.timestamp:
+            return 0xc0
+
+        return 0x80
+
+    return 0x40
+
+
+cdef inline unsigned long read_24bit_uint(const unsigned char[:] buf,
+                                          Py_ssize_t pos):
+    return (buf[pos] << 16) | (buf[pos + 1] << 8) | buf[pos + 2]
+
+
+cdef inline unsigned long read_ulong(const unsigned char[:] buf,
+                                     Py_ssize_t pos):
+    return ((<unsigned long>buf[pos] << 24) | (buf[pos + 1] << 16) |
+        (buf[pos + 2] << 8) | buf[pos + 3])
+
+
+cdef inline Py_ssize_t write_24bit_uint(unsigned char *out, Py_ssize_t pos,
+                                        unsigned long n):
+    out[pos] = (n >> 16) & 0xff
+    out[pos + 1] = (n >> 8) & 0xff
+    out[pos + 2] = n & 0xff
+
+    return pos + 3
+
+
+def pack(header, previous=None):
+    """
+    C version of L{rtmpy.protocol.rtmp.header.pack}.
+    """
+    cdef unsigned char out[MAX_HEADER_SIZE]
+    cdef Py_ssize_t pos
+    cdef int mask
+    cdef unsigned long channelId, timestamp, streamId
+    cdef bint extended
+
+    if previous is None:
+        mask = 0
+    else:
+        if header.continuation:
+            mask = 0xc0
+        else:
+            mask = get_size_mask(header, previous)
+
+    channelId = header.channelId + 2
+
+    if channelId < 64:
+        out[0] = mask | channelId
+        pos = 1
+    elif channelId < 320:
+        out[0] = mask
+        out[1] = channelId - 64
+        pos = 2
+    else:
+        channelId -= 64
+
+        out[0] = mask + 1
+        out[1] = channelId & 0xff
+        out[2] = (channelId >> 8) & 0xff
+        pos = 3
+
+    if mask == 0xc0:
+        return (<char *>out)[:pos]
+
+    timestamp = header.timestamp
+    extended = timestamp >= 0xffffff
+
+    if extended:
+        pos = write_24bit_uint(out, pos, 0xffffff)
+    else:
+        pos = write_24bit_uint(out, pos, timestamp)
+
+    if mask <= 0x40:
+        pos = write_24bit_uint(out, pos, header.bodyLength)
+        out[pos] = <unsigned char>header.datatype
+        pos += 1
+
+    if mask == 0:
+        streamId = header.streamId
+
+        out[pos] = streamId & 0xff
+        out[pos + 1] = (streamId >> 8) & 0xff
+        out[pos + 2] = (streamId >> 16) & 0xff
+        out[pos + 3] = (streamId >> 24) & 0xff
+        pos += 4
+
+    if extended:
+        out[pos] = (timestamp >> 24) & 0xff
+        pos = write_24bit_uint(out, pos + 1, timestamp)
+
+    return (<char *>out)[:pos]
+
+
+def unpack_from(data, Py_ssize_t offset=0):
+    """
+    C version of L{rtmpy.protocol.rtmp.header.unpack_from}.
+    """
+    cdef const unsigned char[:] buf
+    cdef Py_ssize_t pos = offset + 1
+    cdef Py_ssize_t end
+    cdef unsigned long channelId
+    cdef int bits
+
+    try:
+        buf = data
+    except TypeError:
+        # old style buffer objects do not support the new buffer protocol
+        buf = str(data)
+
+    end = buf.shape[0]
+
+    if pos > end:
+        return None, 0
+
+    channelId = buf[offset]
+    bits = channelId >> 6
+    channelId &= 0x3f
+
+    if channelId == 0:
+        if pos + 1 > end:
+            return None, 0
+
+        channelId = buf[pos] + 64
+        pos += 1
+    elif channelId == 1:
+        if pos + 2 > end:
+            return None, 0
+
+        channelId = buf[pos] + (buf[pos + 1] << 8) + 64
+        pos += 2
+
+    if bits == 3:
+        header = Header(channelId - 2)
+        header.continuation = True
+
+        return header, pos - offset
+
+    if bits == 2:
+        if pos + 3 > end:
+            return None, 0
+
+        header = Header(channelId - 2, read_24bit_uint(buf, pos))
+        pos += 3
+    else:
+        if pos + 7 + (bits == 0) * 4 > end:
+            return None, 0
+
+        header = Header(channelId - 2, read_24bit_uint(buf, pos),
+            buf[pos + 6], read_24bit_uint(buf, pos + 3))
+        pos += 7
+
+        if bits == 0:
+            header.streamId = (buf[pos] | (buf[pos + 1] << 8) |
+                (buf[pos + 2] << 16) | (<unsigned long>buf[pos + 3] << 24))
+            header.full = True
+            pos += 4
+
+    if header.timestamp == 0xffffff:
+        if pos + 4 > end:
+            return None, 0
+
+        header.timestamp = read_ulong(buf, pos)
+        pos += 4
+
+    return header, pos - offset
+
+
+def marshall_one_frame(self):
+    """
+    C version of L{rtmpy.protocol.rtmp.codec.BaseChannel.marshallOneFrame}.
+    """
+    cdef long frameSize = self.frameSize
+    cdef long l = min(self.frameRemaining, frameSize, self._bodyRemaining)
+
+    ret = self.marshallFrame(l)
+
+    self.bytes += l
+    self._bodyRemaining -= l
+
+    if frameSize > 0 and l >= frameSize:
+        l %= frameSize
+
+    self.frameRemaining -= l
+
+    return ret
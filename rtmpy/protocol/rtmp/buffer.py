@@ -0,0 +1,335 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Byte buffers for the RTMP codecs.
+
+L{pyamf.util.BufferedByteStream} copies the unread tail of the stream every
+time it is consumed. L{ByteArrayBuffer} provides the same api on top of a
+C{bytearray} and only moves the unread data once enough has been consumed to
+make it worthwhile.
+
+L{SegmentBuffer} is an output only buffer that never joins what is written to
+it, the segments are handed to C{ITransport.writeSequence} instead.
+"""
+
+from zope.interface import implements
+from pyamf.util.pure import DataTypeMixIn
+
+from rtmpy.protocol import interfaces
+
+
+__all__ = [
+    'ByteArrayBuffer',
+    'SegmentBuffer',
+]
+
+
+#: The default number of consumed bytes that must build up at the start of a
+#  L{ByteArrayBuffer} before they are discarded.
+COMPACT_THRESHOLD = 0x10000
+
+#: Writes to a L{SegmentBuffer} of up to this many bytes are appended to the
+#  previous segment (if it is also this small) rather than starting a new one.
+#  This keeps headers that are encoded a field at a time in one segment.
+COALESCE_SIZE = 64
+
+
+
+class ByteArrayBuffer(DataTypeMixIn):
+    """
+    A L{interfaces.IByteBuffer} backed by a C{bytearray} and a read offset.
+
+    Consuming the buffer only moves the offset. The dead bytes in front of it
+    are discarded when the buffer has been consumed completely or when there are
+    at least C{compactThreshold} of them.
+
+    @ivar buf: The underlying bytes, including any dead prefix.
+    @type buf: C{bytearray}
+    @ivar start: The offset in C{buf} of the first live byte.
+    @ivar pos: The offset in C{buf} of the stream pointer.
+    @ivar compactThreshold: The size the dead prefix must reach before it is
+        discarded.
+    """
+
+    implements(interfaces.IByteBuffer)
+
+
+    def __init__(self, buf=None, compactThreshold=COMPACT_THRESHOLD):
+        self.buf = bytearray()
+        self.start = self.pos = 0
+        self.compactThreshold = compactThreshold
+
+        if buf is not None:
+            self.append(buf)
+
+
+    def __len__(self):
+        return len(self.buf) - self.start
+
+
+    def tell(self):
+        """
+        Returns the position of the stream pointer.
+        """
+        return self.pos - self.start
+
+
+    def seek(self, pos, mode=0):
+        """
+        Moves the stream pointer. C{mode} has the same meaning as for
+        C{file.seek}.
+        """
+        if mode == 1:
+            pos += self.pos
+        elif mode == 2:
+            pos += len(self.buf)
+        else:
+            pos += self.start
+
+        if pos < self.start:
+            raise IOError('Cannot seek to before the start of the buffer')
+
+        self.pos = pos
+
+
+    def remaining(self):
+        """
+        Returns the number of bytes between the stream pointer and the end of
+        the buffer.
+        """
+        return len(self.buf) - self.pos
+
+
+    def at_eof(self):
+        """
+        Whether the stream pointer is at the end of the buffer.
+        """
+        return self.pos >= len(self.buf)
+
+
+    def read(self, length=-1):
+        """
+        Reads C{length} bytes from the buffer, or all of the remaining bytes if
+        C{length} is C{-1}.
+
+        @raise IOError: Attempted to read past the end of the buffer.
+        @rtype: C{str}
+        """
+        pos = self.pos
+        end = len(self.buf)
+
+        if length == -1:
+            if pos >= end:
+                raise IOError('Attempted to read from the buffer but already '
+                    'at the end')
+        elif length < -1:
+            raise IOError('Cannot read backwards')
+        elif pos + length > end:
+            raise IOError('Attempted to read %d bytes from the buffer but only '
+                '%d remain' % (length, end - pos))
+        else:
+            end = pos + length
+
+        self.pos = end
+
+        return memoryview(self.buf)[pos:end].tobytes()
+
+
+    def peek(self, size=1):
+        """
+        Returns up to C{size} bytes from the stream pointer onwards without
+        moving it. C{-1} peeks at all of the remaining bytes.
+        """
+        if size < -1:
+            raise ValueError('Cannot peek backwards')
+
+        if size == -1:
+            end = len(self.buf)
+        else:
+            end = min(self.pos + size, len(self.buf))
+
+        return memoryview(self.buf)[self.pos:end].tobytes()
+
+
+    def write(self, data):
+        """
+        Writes C{data} at the stream pointer, overwriting any existing bytes and
+        extending the buffer as necessary.
+
+        @param data: C{str}, C{bytearray}, C{buffer} or C{memoryview}.
+        """
+        pos = self.pos
+        size = len(self.buf)
+
+        if pos == size:
+            self.buf += data
+        else:
+            if pos > size:
+                self.buf += '\x00' * (pos - size)
+
+            self.buf[pos:pos + len(data)] = data
+
+        self.pos = pos + len(data)
+
+
+    def append(self, data):
+        """
+        Appends C{data} to the end of the buffer, the stream pointer does not
+        move.
+
+        @param data: C{str}, C{bytearray}, C{buffer}, C{memoryview} or an object
+            with a C{getvalue} method.
+        """
+        if hasattr(data, 'getvalue'):
+            data = data.getvalue()
+
+        self.buf += data
+
+
+    def getvalue(self):
+        """
+        Returns the contents of the buffer.
+
+        @rtype: C{str}
+        """
+        return memoryview(self.buf)[self.start:].tobytes()
+
+
+    def truncate(self, size=0):
+        """
+        Truncates the buffer to C{size} bytes.
+        """
+        if size == 0:
+            self.buf = bytearray()
+            self.start = self.pos = 0
+
+            return
+
+        del self.buf[self.start + size:]
+
+        self.pos = min(self.pos, len(self.buf))
+
+
+    def consume(self):
+        """
+        Discards everything before the stream pointer, which then points at the
+        start of the buffer.
+        """
+        start = min(self.pos, len(self.buf))
+
+        if start == len(self.buf):
+            self.truncate()
+
+            return
+
+        if start < self.compactThreshold:
+            self.start = self.pos = start
+
+            return
+
+        del self.buf[:start]
+
+        self.start = self.pos = 0
+
+
+
+class SegmentBuffer(DataTypeMixIn):
+    """
+    A L{interfaces.ISegmentBuffer} that keeps a list of the C{str}s written to
+    it.
+
+    Small writes are coalesced (see L{COALESCE_SIZE}) but anything larger, e.g.
+    a frame of an audio/video payload, is kept as the object that was written.
+
+    @ivar segments: The written byte strings.
+    @type segments: C{list}
+    @ivar size: The total number of bytes in C{segments}.
+    """
+
+    implements(interfaces.ISegmentBuffer)
+
+
+    def __init__(self):
+        self.segments = []
+        self.size = 0
+
+
+    def __len__(self):
+        return self.size
+
+
+    def tell(self):
+        """
+        Returns the number of bytes written since the last L{consume}.
+        """
+        return self.size
+
+
+    def write(self, data):
+        """
+        Appends C{data} to the buffer.
+
+        @type data: C{str}
+        """
+        size = len(data)
+
+        if not size:
+            return
+
+        segments = self.segments
+
+        if size <= COALESCE_SIZE and segments and \
+                len(segments[-1]) <= COALESCE_SIZE:
+            segments[-1] += data
+        else:
+            segments.append(data)
+
+        self.size += size
+
+
+    def getSegments(self):
+        """
+        Returns the list of segments, it must not be modified.
+        """
+        return self.segments
+
+
+    def getvalue(self):
+        """
+        Returns the contents of the buffer.
+
+        @rtype: C{str}
+        """
+        return ''.join(self.segments)
+
+
+    def consume(self):
+        """
+        Discards the contents of the buffer.
+        """
+        self.segments = []
+        self.size = 0
+
+
+    def truncate(self, size=0):
+        """
+        Discards the contents of the buffer. Partial truncation is not
+        supported.
+        """
+        if size != 0:
+            raise IOError('SegmentBuffer can only be truncated to 0 bytes')
+
+        self.consume()
@@ -28,9 +28,14 @@ The Encoder/Decoder is not thread safe.
 
 import collections
 
+from zope.interface import implements
+from twisted.internet import defer
+from twisted.internet.interfaces import IPushProducer
 from pyamf.util import BufferedByteStream
 
 from rtmpy.protocol.rtmp import header
+from rtmpy.protocol.rtmp.buffer import SegmentBuffer
+from rtmpy.protocol import interfaces
 from rtmpy import message
 
 
@@ -40,7 +45,8 @@ __all__ = [
     'Decoder',
     'DecodeError',
     'EncodeError',
-    'StreamingChannel'
+    'StreamingChannel',
+    'PreparedMessage'
 ]
 
 
@@ -264,8 +270,11 @@ class ProducingChannel(BaseChannel):
     """
     Writes RTMP frames.
 
-    @ivar buffer: Any data waiting to be written to the underlying stream.
-    @type buffer: L{BufferedByteStream}
+    @ivar payload: The body of the message being written, a C{str} or the
+        L{messageBuffer} if the message was encoded into it.
+    @ivar offset: The position in C{payload} of the next frame.
+    @ivar messageBuffer: The buffer that L{encode} encodes messages into, it
+        is reused for every message sent on this channel.
     @ivar acquired: Whether this channel is acquired. See L{ChannelMuxer.
         acquireChannel}
     """
@@ -274,9 +283,11 @@ class ProducingChannel(BaseChannel):
     def __init__(self, channelId, stream, frameSize):
         BaseChannel.__init__(self, channelId, stream, frameSize)
 
-        self.buffer = BufferedByteStream()
+        self.payload = ''
+        self.offset = 0
         self.acquired = False
         self.callback = None
+        self.messageBuffer = None
 
 
     def setCallback(self, cb):
@@ -293,23 +304,65 @@ class ProducingChannel(BaseChannel):
         """
         BaseChannel.reset(self)
 
-        self.buffer.seek(0)
-        self.buffer.truncate()
+        if self.payload is self.messageBuffer:
+            self.messageBuffer.truncate()
+
+        self.payload = ''
+        self.offset = 0
         self.header = None
 
 
     def append(self, data):
         """
-        Appends data to the buffer in preparation of encoding in RTMP.
+        Appends data to the payload in preparation of encoding in RTMP.
+        """
+        if self.payload:
+            self.payload += data
+        else:
+            self.payload = data
+
+
+    def encode(self, msg):
         """
-        self.buffer.append(data)
+        Encodes the message C{msg} into L{messageBuffer} and makes it the
+        payload. The frames are read straight out of the buffer.
+
+        @return: The length of the encoded message.
+        """
+        buf = self.messageBuffer
+
+        if buf is None:
+            buf = self.messageBuffer = BufferedByteStream()
+
+        try:
+            msg.encode(buf)
+        except:
+            buf.truncate()
+
+            raise
+
+        buf.seek(0)
+        self.payload = buf
+
+        return len(buf)
 
 
     def marshallFrame(self, size):
         """
-        Writes a section of the buffer as part of the RTMP frame.
+        Writes a section of the payload as part of the RTMP frame. A payload
+        that fits in one frame is written as is.
         """
-        self.stream.write(self.buffer.read(size))
+        offset = self.offset
+        payload = self.payload
+
+        if payload is self.messageBuffer:
+            self.stream.write(payload.read(size))
+        elif offset == 0 and size == len(payload):
+            self.stream.write(payload)
+        else:
+            self.stream.write(payload[offset:offset + size])
+
+        self.offset = offset + size
 
 
 
@@ -322,11 +375,24 @@ class Codec(object):
     @ivar channels: A L{dict} of L{BaseChannel} objects that are handling data.
     @ivar frameSize: The maximum size for an individual frame. Read-only, use
         L{setFrameSize} instead.
+    @ivar structHeaders: Whether to use the C{struct} based header codec
+        (L{header.unpack_from}/L{header.pack}) rather than reading/writing each
+        header field from/to C{stream}.
+    @ivar buffer_class: The L{interfaces.IByteBuffer} implementation used to
+        create C{stream} if one is not supplied, e.g.
+        L{rtmpy.protocol.rtmp.buffer.ByteArrayBuffer}.
     """
 
 
+    structHeaders = False
+    buffer_class = BufferedByteStream
+
+
     def __init__(self, stream=None):
-        self.stream = stream or BufferedByteStream()
+        if stream is None:
+            stream = self.buffer_class()
+
+        self.stream = stream
 
         self.channels = {}
         self.frameSize = FRAME_SIZE
@@ -407,7 +473,17 @@ class FrameReader(Codec):
 
         @rtype: L{header.Header}
         """
-        return header.decode(self.stream)
+        if not self.structHeaders:
+            return header.decode(self.stream)
+
+        h, size = header.unpack_from(self.stream.peek(header.MAX_HEADER_SIZE))
+
+        if h is None:
+            raise IOError('Not enough data to decode header')
+
+        self.stream.seek(size, 1)
+
+        return h
 
 
     def send(self, data):
@@ -475,6 +551,45 @@ class FrameReader(Codec):
 
 
 
+class MessageBuffer(object):
+    """
+    Reassembles the frames of one RTMP message in place.
+
+    The buffer is preallocated to the body length of the message so that each
+    frame is copied exactly once, no matter how many frames the message spans.
+
+    @ivar data: The message body.
+    @type data: C{bytearray}
+    @ivar pos: The number of bytes of the body that have been written.
+    """
+
+    __slots__ = ('data', 'view', 'pos')
+
+
+    def __init__(self, size):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.pos = 0
+
+
+    def write(self, bytes):
+        """
+        Copies C{bytes} into the buffer, after any previously written data.
+
+        L{DecodeError} is raised if C{bytes} does not fit, the frames of the
+        message are longer than its header said.
+        """
+        end = self.pos + len(bytes)
+
+        if end > len(self.data):
+            raise DecodeError('Message body overran its length (%d > %d)' % (
+                end, len(self.data)))
+
+        self.view[self.pos:end] = bytes
+        self.pos = end
+
+
+
 class ChannelDemuxer(FrameReader):
     """
     The next layer up from reading raw RTMP frames. Reassembles the interleaved
@@ -486,7 +601,7 @@ class ChannelDemuxer(FrameReader):
     complete.
 
     @ivar bucket: Buffers any incomplete channel data.
-    @type bucket: channel -> buffered data.
+    @type bucket: channelId -> L{MessageBuffer}.
     """
 
 
@@ -511,14 +626,28 @@ class ChannelDemuxer(FrameReader):
         """
         data, complete, meta = FrameReader.readFrame(self)
 
-        if complete:
-            data = self.bucket.pop(meta.channelId, '') + data
+        channelId = meta.channelId
+        buf = self.bucket.get(channelId, None)
 
-            return data, meta
+        if buf is None:
+            if complete:
+                # the message fit in to a single frame
+                return data, meta
 
-        channelId = meta.channelId
+            buf = self.bucket[channelId] = MessageBuffer(meta.bodyLength)
+
+        try:
+            buf.write(data)
+        except DecodeError:
+            del self.bucket[channelId]
+
+            raise
+
+        if complete:
+            del self.bucket[channelId]
 
-        self.bucket[channelId] = self.bucket.get(channelId, '') + data
+            # consumers get an immutable str, the bytearray is not handed out
+            return str(buf.data), meta
 
         # nothing was available
         return None, None
@@ -596,16 +725,81 @@ class Decoder(ChannelDemuxer):
     __next__ = next
 
 
+    def decodeAll(self, dispatch=True):
+        """
+        Decodes every complete message that is currently buffered in one go,
+        rather than one frame per call to L{next}.
+
+        If C{dispatch} is C{False} the messages are not dispatched but returned
+        instead. As the peer can change its frame size part way through the
+        stream, decoding stops after a L{message.FRAME_SIZE} message so that the
+        caller can apply it before calling this method again.
+
+        @param dispatch: Whether to dispatch each message as it is decoded.
+        @return: A list of C{(stream, datatype, timestamp, data)} tuples, one for
+            each message that was decoded.
+        """
+        messages = []
+        readFrame = ChannelDemuxer.readFrame
+        getStream = self.stream_factory.getStream
+        dispatchMessage = self.dispatcher.dispatchMessage
+
+        while True:
+            try:
+                data, meta = readFrame(self)
+            except IOError:
+                self.stream.consume()
+
+                break
+
+            if self.bytesInterval and self.bytes >= self._nextInterval:
+                self.dispatcher.bytesInterval(self.bytes)
+                self._nextInterval += self.bytesInterval
+
+            if data is None:
+                continue
+
+            msg = (getStream(meta.streamId), meta.datatype, meta.timestamp,
+                data)
+
+            messages.append(msg)
+
+            if dispatch:
+                dispatchMessage(*msg)
+            elif meta.datatype == message.FRAME_SIZE:
+                break
+
+        return messages
+
+
 class ChannelMuxer(Codec):
     """
     Manages RTMP channels and marshalls the data so that the channels can be
     interleaved.
 
+    Active channels are encoded round robin, one frame at a time. Channels that
+    are sending a message with a type in C{priorityTypes} are drained before
+    any other channel is given a frame.
+
+    @ivar pending: A fifo queue of messages that are waiting to be assigned a
+        channel.
+    @type pending: C{collections.deque}
     @ivar releasedChannels: A list of channel ids that have been released.
     @type releasedChannels: C{collections.deque}
     @ivar channelsInUse: Number of RTMP channels currently in use.
-    @ivar activeChannels: A list of L{BaseChannel} objects that are active (and
-        therefore unavailable)
+    @ivar activeChannels: The L{BaseChannel} objects that are active (and
+        therefore unavailable), in the order that they will be given a frame.
+    @type activeChannels: C{collections.deque}
+    @ivar priorityChannels: As C{activeChannels} but for channels sending a
+        message with a type in C{priorityTypes}.
+    @type priorityChannels: C{collections.deque}
+    @ivar priorityTypes: The message types that take priority over all other
+        (bulk) data. Command types are always written immediately.
+    @ivar quota: The number of bytes that each call to L{next} may encode from
+        C{activeChannels}. The default of C{None} encodes one frame from each
+        active channel.
+    @ivar backlog: The total body length of the messages that have been
+        assigned a channel but not completely encoded.
     @ivar nextHeaders: A collection of L{header.Header}s to be applied to the
         channel the next time it is asked to marshall a frame.
     @ivar timestamps: A collection of last known timestamps for a given channel.
@@ -615,13 +809,19 @@ class ChannelMuxer(Codec):
     """
 
 
+    priorityTypes = frozenset([message.INVOKE, message.FLEX_MESSAGE])
+    quota = None
+
+
     def __init__(self, stream=None):
         Codec.__init__(self, stream=stream)
 
-        self.pending = []
+        self.pending = collections.deque()
 
         self.releasedChannels = collections.deque()
-        self.activeChannels = {}
+        self.activeChannels = collections.deque()
+        self.priorityChannels = collections.deque()
+        self.backlog = 0
         self.channelsInUse = 0
 
         self.nextHeaders = {}
@@ -692,7 +892,10 @@ class ChannelMuxer(Codec):
         else:
             h = channel.header
 
-        header.encode(self.stream, channel.header, h)
+        if self.structHeaders:
+            self.stream.write(header.pack(channel.header, h))
+        else:
+            header.encode(self.stream, channel.header, h)
 
 
     def flush(self):
@@ -717,6 +920,20 @@ class ChannelMuxer(Codec):
         return c
 
 
+    def _getChannel(self, datatype):
+        """
+        Returns the channel that a message of C{datatype} is sent on, or
+        C{None} if no channel is available.
+        """
+        if is_command_type(datatype):
+            # we have to special case command types because a channel only be
+            # busy with one message at a time. Command messages are always
+            # written right away
+            return self.getChannel(COMMAND_CHANNEL_ID)
+
+        return self.acquireChannel()
+
+
     def send(self, data, datatype, streamId, timestamp, whenDone=None):
         """
         Queues an RTMP message to be encoded. Call C{next} to do the encoding.
@@ -733,30 +950,66 @@ class ChannelMuxer(Codec):
             was sent.
         @type timestamp: C{int}
         """
-        if is_command_type(datatype):
-            # we have to special case command types because a channel only be
-            # busy with one message at a time. Command messages are always
-            # written right away
-            channel = self.getChannel(COMMAND_CHANNEL_ID)
-        else:
-            channel = self.acquireChannel()
+        channel = self._getChannel(datatype)
+
+        if not channel:
+            self.pending.append((data, datatype, streamId, timestamp, whenDone))
 
-            if not channel:
-                self.pending.append((data, datatype, streamId, timestamp, whenDone))
+            return
+
+        channel.append(data)
+
+        self._queue(channel, len(data), datatype, streamId, timestamp,
+            whenDone)
+
+
+    def sendMessage(self, msg, streamId, timestamp, whenDone=None):
+        """
+        Queues the L{message.IMessage} C{msg} to be encoded, like L{send}. The
+        message is encoded straight into the payload buffer of its channel
+        (see L{ProducingChannel.encode}) rather than into a C{str} first.
 
-                return
+        If no channel is available, the message is encoded and added to
+        C{pending}.
+        """
+        datatype = msg.__data_type__
+        channel = self._getChannel(datatype)
+
+        if not channel:
+            buf = BufferedByteStream()
+            msg.encode(buf)
+
+            self.pending.append((buf.getvalue(), datatype, streamId,
+                timestamp, whenDone))
+
+            return
+
+        try:
+            size = channel.encode(msg)
+        except:
+            if channel.channelId != COMMAND_CHANNEL_ID:
+                self.releaseChannel(channel.channelId)
 
+            raise
+
+        self._queue(channel, size, datatype, streamId, timestamp, whenDone)
+
+
+    def _queue(self, channel, size, datatype, streamId, timestamp, whenDone):
+        """
+        Schedules the message of C{size} bytes that has been added to
+        C{channel} to be encoded.
+        """
         h = header.Header(
             channel.channelId,
             timestamp - channel.timestamp,
             datatype,
-            len(data),
+            size,
             streamId)
 
         if whenDone is not None:
             channel.setCallback(whenDone)
 
-        channel.append(data)
         self.nextHeaders[channel] = h
 
         if channel.channelId == COMMAND_CHANNEL_ID:
@@ -768,29 +1021,63 @@ class ChannelMuxer(Codec):
 
             return
 
-        self.activeChannels[channel] = channel.channelId
+        self.backlog += size
+
+        if datatype in self.priorityTypes:
+            self.priorityChannels.append(channel)
+        else:
+            self.activeChannels.append(channel)
+
+
+    def _encodeNext(self, queue):
+        """
+        Encodes one frame from the channel at the head of C{queue}. The channel
+        is moved to the back of the queue, or released if its message is
+        complete.
+        """
+        channel = queue.popleft()
+
+        if self._encodeOneFrame(channel):
+            self.backlog -= channel.header.bodyLength
+
+            channel.reset()
+            self.releaseChannel(channel.channelId)
+        else:
+            queue.append(channel)
 
 
     def next(self):
         """
-        Encodes one RTMP frame from all the active channels.
+        Encodes all the frames of the priority channels, then one frame from
+        each active channel or, if C{quota} is set, frames from the active
+        channels in turn until C{quota} bytes have been encoded.
         """
-        while self.pending and self.channelsInUse <= MAX_CHANNELS:
-            self.send(*self.pending.pop(0))
+        pending = self.pending
+
+        while pending and self.channelsInUse < MAX_CHANNELS:
+            self.send(*pending.popleft())
 
-        if not bool(self.activeChannels):
+        queue = self.priorityChannels
+
+        if not queue and not self.activeChannels:
             raise StopIteration
 
-        to_release = []
+        while queue:
+            self._encodeNext(queue)
 
-        for channel in self.activeChannels:
-            if self._encodeOneFrame(channel):
-                channel.reset()
-                to_release.append(channel)
+        queue = self.activeChannels
 
-        for channel in to_release:
-            self.releaseChannel(channel.channelId)
-            del self.activeChannels[channel]
+        if self.quota is None:
+            for i in xrange(len(queue)):
+                self._encodeNext(queue)
+
+            return
+
+        stream = self.stream
+        limit = len(stream) + self.quota
+
+        while queue and len(stream) < limit:
+            self._encodeNext(queue)
 
 
 
@@ -808,39 +1095,282 @@ class Encoder(ChannelMuxer):
         channel.
     @ivar output: A C{write}able object that will receive the final encoded RTMP
         stream. The instance only needs to implement C{write} and accept 1 param
-        (the data).
+        (the data). If C{stream} provides L{interfaces.ISegmentBuffer} and
+        C{output} has a C{writeSequence} method, the encoded segments are passed
+        to that instead.
+    @ivar producerPaused: Whether C{output} has asked the encoder to stop
+        producing (see C{IPushProducer}). L{next} returns a C{Deferred} that
+        fires when production is resumed rather than encoding anything.
+    @ivar congested: Set when C{backlog} rises above C{highWatermark} and
+        cleared when it falls to C{lowWatermark}.
+    @ivar highWatermark: The number of backlogged bytes at which the encoder is
+        considered congested. C{None} disables the check.
+    @ivar lowWatermark: The number of backlogged bytes at which a congested
+        encoder is considered clear again.
+    @ivar bucket: The L{pacer.TokenBucket} that limits the rate at which data
+        is written to C{output}, see L{setBucket}. C{None} means no limit.
+    @ivar delayed: A fifo queue of C{(output, segments, size)} written by
+        L{StreamingChannel}s while C{output} was paused or C{bucket} was in
+        debt, see L{writeSegments}. The delayed bytes are counted in
+        C{backlog}, so the watermarks apply to the streams too.
+    @type delayed: C{collections.deque}
     """
 
+    implements(IPushProducer)
+
+    highWatermark = None
+    lowWatermark = 0
+    bucket = None
+
 
     def __init__(self, output, stream=None):
         ChannelMuxer.__init__(self, stream=stream)
 
         self.output = output
+        self.vectored = interfaces.ISegmentBuffer.providedBy(self.stream)
+
+        self.producerPaused = False
+        self.congested = False
+        self.delayed = collections.deque()
+
+        self._stopped = False
+        self._resumed = None
+        self._refilled = None
+        self._delayedCall = None
+
+
+    @property
+    def paused(self):
+        """
+        Whether anything that writes directly to C{output} (see
+        L{StreamingChannel}) should hold back. A C{bucket} in debt does not
+        count, its writes are delayed instead.
+        """
+        return self.producerPaused or self.congested
+
+
+    def setBucket(self, bucket):
+        """
+        Limits the rate at which data is written to C{output} with the
+        L{pacer.TokenBucket} C{bucket}, or lifts the limit if C{bucket} is
+        C{None}.
+        """
+        self.bucket = bucket
+
+        self._refill()
+
+        if self._delayedCall is not None:
+            self._delayedCall.cancel()
+            self._delayedCall = None
+
+        self._flushDelayed()
+
+
+    def _refill(self):
+        d, self._refilled = self._refilled, None
+
+        if d is None:
+            return
+
+        call, d.call = d.call, None
+
+        if call.active():
+            call.cancel()
+
+        d.callback(None)
+
+
+    def writeSegments(self, output, segments, size):
+        """
+        Writes C{segments} (C{size} bytes in total) to C{output} on behalf of a
+        L{StreamingChannel}. If C{output} has paused the encoder, C{bucket} is
+        in debt or earlier writes are still waiting, the segments are added to
+        C{delayed} and written once production is resumed and the bucket has
+        refilled.
+        """
+        bucket = self.bucket
+
+        if not self.delayed and not self.producerPaused and (
+                bucket is None or not bucket.limited):
+            write_segments(output, segments)
+
+            if bucket is not None:
+                bucket.consume(size)
+
+            return
+
+        self.delayed.append((output, segments, size))
+        self.backlog += size
+
+        self._checkBacklog()
+        self._scheduleDelayed()
+
+
+    def _scheduleDelayed(self):
+        """
+        Schedules L{_flushDelayed} for when C{bucket} has refilled. Nothing is
+        scheduled while C{output} has paused the encoder, L{resumeProducing}
+        flushes C{delayed} instead.
+        """
+        bucket = self.bucket
+
+        if self._delayedCall is not None or self.producerPaused:
+            return
+
+        if not self.delayed or bucket is None:
+            return
+
+        self._delayedCall = bucket.clock.callLater(bucket.getDelay(),
+            self._flushDelayed)
+
+
+    def _flushDelayed(self):
+        """
+        Writes as much of C{delayed} as C{output} and C{bucket} allow and, if
+        anything is left, schedules another attempt for when it has refilled.
+        """
+        self._delayedCall = None
+
+        bucket = self.bucket
+        delayed = self.delayed
+
+        while delayed and not self.producerPaused and (
+                bucket is None or not bucket.limited):
+            output, segments, size = delayed.popleft()
+            self.backlog -= size
+
+            write_segments(output, segments)
+
+            if bucket is not None:
+                bucket.consume(size)
+
+        self._scheduleDelayed()
+
+        if self.congested and self.backlog <= self.lowWatermark:
+            self.congested = False
+
+
+    def pauseProducing(self):
+        """
+        Called by C{output} when its buffer is full.
+        """
+        self.producerPaused = True
+
+
+    def resumeProducing(self):
+        """
+        Called by C{output} when its buffer has been drained.
+        """
+        self.producerPaused = False
+
+        if self._delayedCall is None:
+            self._flushDelayed()
+
+        d, self._resumed = self._resumed, None
+
+        if d is not None:
+            d.callback(None)
+
+
+    def stopProducing(self):
+        """
+        Called by C{output} when it has gone away. The encoder will not produce
+        anything else.
+        """
+        self._stopped = True
+
+        if self._delayedCall is not None:
+            self._delayedCall.cancel()
+            self._delayedCall = None
+
+        while self.delayed:
+            self.backlog -= self.delayed.popleft()[2]
+
+        self._refill()
+        self.resumeProducing()
+
+
+    def send(self, data, datatype, streamId, timestamp, whenDone=None):
+        """
+        See L{ChannelMuxer.send}. Checks C{highWatermark}.
+        """
+        ChannelMuxer.send(self, data, datatype, streamId, timestamp, whenDone)
+
+        self._checkBacklog()
+
+
+    def sendMessage(self, msg, streamId, timestamp, whenDone=None):
+        """
+        See L{ChannelMuxer.sendMessage}. Checks C{highWatermark}.
+        """
+        ChannelMuxer.sendMessage(self, msg, streamId, timestamp, whenDone)
+
+        self._checkBacklog()
+
+
+    def _checkBacklog(self):
+        high = self.highWatermark
+
+        if high is not None and self.backlog > high:
+            self.congested = True
 
 
     def next(self):
         """
         Called iteratively to produce an RTMP encoded stream.
         """
+        if self._stopped:
+            raise StopIteration
+
+        if self.producerPaused:
+            if self._resumed is None:
+                self._resumed = defer.Deferred()
+
+            return self._resumed
+
+        bucket = self.bucket
+
+        if bucket is not None and bucket.limited:
+            if self._refilled is None:
+                d = self._refilled = defer.Deferred()
+                d.call = bucket.clock.callLater(bucket.getDelay(),
+                    self._refill)
+
+            return self._refilled
+
         ChannelMuxer.next(self)
 
         self.flush()
 
+        if self.congested and self.backlog <= self.lowWatermark:
+            self.congested = False
+
 
     def flush(self):
         """
         Flushes the internal buffer to C{output}.
         """
-        s = self.stream.getvalue()
+        if self.vectored:
+            size = len(self.stream)
 
-        self.output.write(s)
-        self.stream.consume()
+            write_segments(self.output, self.stream.getSegments())
+            self.stream.consume()
+        else:
+            s = self.stream.getvalue()
+
+            self.output.write(s)
+            self.stream.consume()
+
+            size = len(s)
+
+        self.bytes += size
 
-        self.bytes += len(s)
+        if self.bucket is not None:
+            self.bucket.consume(size)
 
     @property
     def active(self):
-        return bool(self.activeChannels)
+        return bool(self.activeChannels or self.priorityChannels)
 
     def __iter__(self):
         return self
@@ -850,17 +1380,78 @@ class Encoder(ChannelMuxer):
 
 
 
+class PreparedMessage(str):
+    """
+    An audio/video payload that is about to be sent to many
+    L{StreamingChannel}s, e.g. by a publisher fanning out to its subscribers.
+
+    Behaves exactly like the C{str} payload but remembers how it was split into
+    RTMP frames, so the chunking and the continuation headers are only done
+    once for every combination of frame size and channel id, rather than once
+    per subscriber.
+
+    @ivar frames: A C{dict} of C{(frameSize, channelId)} -> C{list} of frames.
+        The first frame is the start of the payload (its header depends on the
+        subscriber) and every other frame includes its continuation header.
+    """
+
+
+    def __new__(cls, data):
+        inst = str.__new__(cls, data)
+        inst.frames = {}
+
+        return inst
+
+
+    def getFrames(self, frameSize, channelId):
+        """
+        Returns the frames of this payload for the supplied channel parameters.
+        The returned C{list} is shared and must not be modified.
+        """
+        key = (frameSize, channelId)
+
+        try:
+            return self.frames[key]
+        except KeyError:
+            pass
+
+        size = len(self)
+
+        if size <= frameSize:
+            frames = [str(self)]
+        else:
+            h = header.Header(channelId)
+            continuation = header.pack(h, h)
+
+            frames = [self[:frameSize]]
+
+            for i in xrange(frameSize, size, frameSize):
+                frames.append(continuation + self[i:i + frameSize])
+
+        self.frames[key] = frames
+
+        return frames
+
+
+
 class StreamingChannel(object):
     """
+    Writes the audio/video data of a stream straight to C{output}, bypassing
+    the scheduling done by the L{Encoder}.
+
+    @ivar producer: The L{Encoder} that C{channel} was acquired from. Used to
+        tell whether C{output} is congested and to pace the writes, see
+        L{Encoder.writeSegments}.
     """
 
 
-    def __init__(self, channel, streamId, output):
+    def __init__(self, channel, streamId, output, producer=None):
         self.type = None
         self.channel = channel
         self.streamId = streamId
         self.output = output
-        self.stream = BufferedByteStream()
+        self.producer = producer
+        self.stream = SegmentBuffer()
 
         self._lastHeader = None
         self._oldStream = channel.stream
@@ -886,6 +1477,15 @@ class StreamingChannel(object):
         self.type = type
 
 
+    @property
+    def paused(self):
+        """
+        Whether the connection that this channel writes to is congested, see
+        L{Encoder.paused}.
+        """
+        return self.producer is not None and self.producer.paused
+
+
     def sendData(self, data, timestamp):
         c = self.channel
 
@@ -900,21 +1500,51 @@ class StreamingChannel(object):
             h.full = True
 
         c.setHeader(h)
-        c.append(data)
 
         header.encode(self.stream, h, self._lastHeader)
         self._lastHeader = h
 
-        c.marshallOneFrame()
+        if isinstance(data, PreparedMessage):
+            c.reset()
 
-        while not c.complete():
-            self.stream.write(self._continuationHeader)
+            segments = self.stream.getSegments() + data.getFrames(
+                c.frameSize, c.channelId)
+        else:
+            c.append(data)
             c.marshallOneFrame()
 
-        c.reset()
-        self.output.write(self.stream.getvalue())
+            while not c.complete():
+                self.stream.write(self._continuationHeader)
+                c.marshallOneFrame()
+
+            c.reset()
+
+            segments = self.stream.getSegments()
+
         self.stream.consume()
 
+        if self.producer is None:
+            write_segments(self.output, segments)
+        else:
+            self.producer.writeSegments(self.output, segments,
+                sum(map(len, segments)))
+
+
+
+def write_segments(output, segments):
+    """
+    Writes C{segments} to C{output}, using C{writeSequence} if it is available
+    so that the segments are not joined together first.
+
+    @param segments: A C{list} of C{str}.
+    """
+    writeSequence = getattr(output, 'writeSequence', None)
+
+    if writeSequence is not None:
+        writeSequence(segments)
+    else:
+        output.write(''.join(segments))
+
 
 
 def is_command_type(datatype):
@@ -923,3 +1553,13 @@ def is_command_type(datatype):
     related RTMP message must be marshalled on channel id = 2.
     """
     return datatype <= message.UPSTREAM_BANDWIDTH
+
+
+
+try:
+    from rtmpy.protocol.rtmp import _codec
+except ImportError:
+    pass
+else:
+    BaseChannel.marshallOneFrame = _codec.marshall_one_frame
+    Codec.structHeaders = True
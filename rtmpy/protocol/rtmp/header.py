@@ -20,14 +20,38 @@ Utility/helper functions for encoding and decoding RTMP headers.
     #rtmp_packet_structure>}
 """
 
+import struct
+
+
 __all__ = [
     'Header',
     'encode',
     'decode',
+    'pack',
+    'unpack_from',
     'merge'
 ]
 
 
+#: The maximum number of bytes an encoded header can occupy: a 3 byte channel
+#  id, an 11 byte message header and a 4 byte extended timestamp.
+MAX_HEADER_SIZE = 18
+
+# Precompiled layouts used by L{pack} and L{unpack_from}. The 24 bit fields of
+# the message header are not supported by C{struct} so the layouts start one
+# byte early, at the last byte of the channel id, and that byte is masked off
+# (or or'd in when packing). The streamId is the only little endian field.
+_UCHAR = struct.Struct('B')
+_USHORT_LE = struct.Struct('<H')
+_ULONG = struct.Struct('!L')
+_TIMESTAMP_LENGTH_TYPE = struct.Struct('!LL')
+_STREAM_ID = struct.Struct('<L')
+
+#: Number of bytes in the message header for each header type (the top 2 bits
+#  of the first byte).
+_MESSAGE_HEADER_SIZES = (11, 7, 3, 0)
+
+
 class HeaderError(Exception):
     """
     Raised if a header related operation failed.
@@ -184,6 +208,134 @@ def decode(stream):
     return header
 
 
+def pack(header, previous=None):
+    """
+    Returns the encoded bytes for C{header}. Behaves exactly like L{encode} but
+    builds the header using precompiled C{struct} layouts rather than writing
+    each field to a stream.
+
+    @param header: The L{Header} to encode.
+    @param previous: The previous header (if any).
+    @rtype: C{str}
+    """
+    if previous is None:
+        mask = 0
+    else:
+        if header.continuation:
+            mask = 0xc0
+        else:
+            mask = get_size_mask(header, previous)
+
+    channelId = header.channelId + 2
+
+    if channelId < 64:
+        prefix = ''
+        last = mask | channelId
+    elif channelId < 320:
+        prefix = chr(mask)
+        last = channelId - 64
+    else:
+        channelId -= 64
+
+        prefix = chr(mask + 1) + chr(channelId & 0xff)
+        last = channelId >> 0x08
+
+    if mask == 0xc0:
+        return prefix + chr(last)
+
+    timestamp = header.timestamp
+    extended = ''
+
+    if timestamp >= 0xffffff:
+        extended = _ULONG.pack(timestamp)
+        timestamp = 0xffffff
+
+    if mask == 0x80:
+        return prefix + _ULONG.pack((last << 24) | timestamp) + extended
+
+    s = _TIMESTAMP_LENGTH_TYPE.pack((last << 24) | timestamp,
+        (header.bodyLength << 8) | header.datatype)
+
+    if mask == 0:
+        s += _STREAM_ID.pack(header.streamId)
+
+    return prefix + s + extended
+
+
+def unpack_from(data, offset=0):
+    """
+    Decodes a header from C{data}, starting at C{offset}.
+
+    Unlike L{decode}, C{data} is any object supporting the buffer interface
+    (C{str}, C{buffer}, C{bytearray}, C{memoryview}) and C{IOError} is never
+    raised if the header is incomplete.
+
+    @param data: The raw bytes to read the header from.
+    @param offset: The position in C{data} at which the header starts.
+    @return: A tuple containing the decoded L{Header} and the number of bytes
+        it occupied. If C{data} does not hold a complete header then
+        C{(None, 0)} is returned.
+    """
+    end = len(data)
+    pos = offset + 1
+
+    if pos > end:
+        return None, 0
+
+    channelId, = _UCHAR.unpack_from(data, offset)
+    bits = channelId >> 6
+    channelId &= 0x3f
+
+    if channelId == 0:
+        if pos + 1 > end:
+            return None, 0
+
+        channelId = _UCHAR.unpack_from(data, pos)[0] + 64
+        pos += 1
+    elif channelId == 1:
+        if pos + 2 > end:
+            return None, 0
+
+        channelId = _USHORT_LE.unpack_from(data, pos)[0] + 64
+        pos += 2
+
+    if bits == 3:
+        header = Header(channelId - 2)
+        header.continuation = True
+
+        return header, pos - offset
+
+    size = _MESSAGE_HEADER_SIZES[bits]
+
+    if pos + size > end:
+        return None, 0
+
+    if bits == 2:
+        timestamp, = _ULONG.unpack_from(data, pos - 1)
+
+        header = Header(channelId - 2, timestamp & 0xffffff)
+    else:
+        timestamp, info = _TIMESTAMP_LENGTH_TYPE.unpack_from(data, pos - 1)
+
+        header = Header(channelId - 2, timestamp & 0xffffff, info & 0xff,
+            info >> 8)
+
+        if bits == 0:
+            header.streamId, = _STREAM_ID.unpack_from(data, pos + 7)
+            header.full = True
+
+    pos += size
+
+    if header.timestamp == 0xffffff:
+        if pos + 4 > end:
+            return None, 0
+
+        header.timestamp, = _ULONG.unpack_from(data, pos)
+        pos += 4
+
+    return header, pos - offset
+
+
 def merge(old, new):
     """
     Merge the values of C{new} and C{old} together, returning the result.
@@ -249,3 +401,9 @@ def get_size_mask(old, new):
         return 0x80
 
     return 0x40
+
+
+try:
+    from rtmpy.protocol.rtmp._codec import pack, unpack_from
+except ImportError:
+    pass
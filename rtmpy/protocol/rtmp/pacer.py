@@ -0,0 +1,105 @@
+# -*- test-case-name: rtmpy.tests.rtmp.test_pacer -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Limits the rate that RTMP data is sent at.
+
+Every byte written to the peer takes a token from a L{TokenBucket}, which is
+refilled at the send rate up to the burst allowance. Writes are never split
+once they have been made, the bucket goes into debt instead. While it is in
+debt the L{codec.Encoder} waits for it to refill and delays the writes of the
+streaming channels until it has. Debt alone is not congestion, publishers only
+drop video frames once the delayed data passes the encoder's high watermark.
+"""
+
+
+__all__ = [
+    'TokenBucket',
+]
+
+
+class TokenBucket(object):
+    """
+    @ivar rate: The number of bytes per second that the bucket is refilled at.
+    @ivar burst: The number of bytes that the bucket holds when full, i.e. the
+        most that can be sent at once after a quiet period.
+    @ivar clock: Provides C{seconds} and C{callLater}, usually the reactor.
+    @ivar tokens: The number of bytes that can be sent right now, negative while
+        the bucket is in debt.
+    """
+
+    def __init__(self, rate, burst, clock):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+
+        self.tokens = burst
+        self.updated = clock.seconds()
+
+
+    def setRate(self, rate, burst):
+        """
+        Changes the rate and the burst allowance, the tokens accrued so far at
+        the old rate are kept (up to the new burst allowance).
+        """
+        self.refill()
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+
+    def refill(self):
+        now = self.clock.seconds()
+        tokens = self.tokens + (now - self.updated) * self.rate
+
+        self.tokens = min(tokens, self.burst)
+        self.updated = now
+
+
+    def consume(self, size):
+        """
+        C{size} bytes have been sent.
+        """
+        self.refill()
+
+        self.tokens -= size
+
+
+    @property
+    def limited(self):
+        """
+        Whether the bucket is in debt, nothing else should be sent.
+        """
+        if self.tokens >= 0:
+            return False
+
+        self.refill()
+
+        return self.tokens < 0
+
+
+    def getDelay(self):
+        """
+        Returns the number of seconds until the bucket is out of debt.
+        """
+        self.refill()
+
+        if self.tokens >= 0:
+            return 0
+
+        return -self.tokens / float(self.rate)
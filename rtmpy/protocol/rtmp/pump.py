@@ -0,0 +1,152 @@
+# -*- test-case-name: rtmpy.tests.rtmp.test_pump -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Drives the RTMP encoder and decoder.
+
+A L{Pump} calls C{next} on its iterator in a tight loop, there and then, until
+the iterator is exhausted. Only when the loop has used up its time or byte
+slice does it yield to the reactor, with C{callLater(0)}, to carry on where it
+left off. A busy connection can then not starve the others.
+"""
+
+from twisted.internet import defer
+from twisted.python import failure
+
+
+__all__ = [
+    'Pump',
+]
+
+
+class Pump(object):
+    """
+    Runs an iterator to completion, a slice at a time.
+
+    If C{next} returns a C{Deferred} (the encoder does while the transport is
+    paused) the pump waits for it to fire before carrying on.
+
+    @ivar iterator: The iterator being driven, L{codec.Decoder} or
+        L{codec.Encoder}.
+    @ivar clock: Provides C{seconds} and C{callLater}, usually the reactor.
+    @ivar errback: Called with a L{failure.Failure} if the iterator raises
+        anything other than C{StopIteration}. The pump is stopped.
+    @ivar timeSlice: The number of seconds the pump may run for before it yields
+        to the reactor. C{None} disables the check.
+    @ivar byteSlice: The number of bytes (as counted by C{iterator.bytes}) that
+        may be processed before the pump yields to the reactor. C{None}
+        disables the check.
+    @ivar running: Whether the iterator is being driven, including while the
+        pump is waiting for the reactor or for a C{Deferred}.
+    """
+
+    timeSlice = 0.01
+    byteSlice = 0x40000
+
+    def __init__(self, iterator, clock, errback):
+        self.iterator = iterator
+        self.clock = clock
+        self.errback = errback
+
+        self.running = False
+        self.call = None
+
+        self._waiting = None
+
+
+    def run(self):
+        """
+        Starts driving the iterator, unless it is already being driven.
+        """
+        if self.running:
+            return
+
+        self.running = True
+
+        self._iterate()
+
+
+    def stop(self):
+        """
+        Stops driving the iterator.
+        """
+        self.running = False
+
+        if self.call is not None:
+            self.call.cancel()
+            self.call = None
+
+        self._waiting = None
+
+
+    def _iterate(self):
+        self.call = None
+
+        it = self.iterator
+        timeSlice = self.timeSlice
+        byteSlice = self.byteSlice
+
+        if timeSlice is not None:
+            seconds = self.clock.seconds
+            deadline = seconds() + timeSlice
+
+        if byteSlice is not None:
+            limit = it.bytes + byteSlice
+
+        try:
+            while self.running:
+                result = it.next()
+
+                if isinstance(result, defer.Deferred):
+                    self._wait(result)
+
+                    return
+
+                if timeSlice is not None and seconds() >= deadline:
+                    break
+
+                if byteSlice is not None and it.bytes >= limit:
+                    break
+            else:
+                return
+        except StopIteration:
+            self.running = False
+
+            return
+        except:
+            self.stop()
+            self.errback(failure.Failure())
+
+            return
+
+        self.call = self.clock.callLater(0, self._iterate)
+
+
+    def _wait(self, d):
+        self._waiting = d
+
+        def resume(result):
+            if self._waiting is d:
+                self._waiting = None
+                self._iterate()
+
+        def eb(fail):
+            if self._waiting is d:
+                self.stop()
+                self.errback(fail)
+
+        d.addCallbacks(resume, eb)
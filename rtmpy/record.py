@@ -0,0 +1,360 @@
+# -*- test-case-name: rtmpy.tests.test_record -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Records published streams to FLV files.
+
+A L{Recorder} is added to the L{server.StreamPublisher} of the stream like any
+other subscriber. The packets are queued in memory and written to disk by the
+reactor's thread pool, one batch at a time, so the reactor never waits for the
+disk::
+
+    app = server.Application()
+    app.recordPath = '/var/lib/rtmpy/live'
+
+Streams published with the type C{record} are then written to
+C{/var/lib/rtmpy/live/<name>.flv} and C{append} adds to the end of an existing
+file.
+"""
+
+import os
+import time
+
+from zope.interface import implements
+from twisted.internet import defer, threads
+from twisted.python import log
+
+from rtmpy import flv, message, server
+
+
+__all__ = [
+    'Recorder',
+]
+
+
+class Recorder(object):
+    """
+    Writes the packets of the stream it is subscribed to to an FLV file.
+
+    The methods called by the publisher only append to L{pending}. Whenever
+    there is no write in progress, everything that is pending is handed to the
+    thread pool as one batch. If the disk falls behind by more than
+    L{maxPending} bytes, packets are dropped (and counted) rather than queued,
+    see L{dropTag}.
+
+    @ivar path: The path of the file.
+    @ivar append: Whether to add to the end of an existing file.
+    @ivar maxPending: The maximum number of bytes waiting to be written.
+    @ivar fsyncInterval: The minimum number of seconds between calls to
+        C{fsync}. C{None} disables C{fsync} until the file is closed.
+    @ivar pending: The C{(tagType, timestamp, data)} of the tags waiting to be
+        written.
+    @ivar pendingBytes: The size of the data in L{pending}.
+    @ivar dropped: The number of tags that were dropped.
+    @ivar dropping: Whether video frames are being dropped until the next
+        keyframe.
+    @ivar busy: Whether the thread pool is working on the file.
+    @ivar closed: Whether L{close} has been called, no more tags are accepted.
+    @ivar finished: Whether the file has been closed.
+    """
+
+    implements(server.IPublishingStream)
+
+    maxPending = 0x800000
+    fsyncInterval = 5.0
+
+    def __init__(self, path, append=False, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.path = path
+        self.append = append
+        self.reactor = reactor
+
+        self.pending = []
+        self.pendingBytes = 0
+        self.dropped = 0
+        self.dropping = False
+        self.busy = False
+        self.closed = False
+
+        self.file = None
+        self.offset = 0
+        self.lastSync = 0
+        self.finished = False
+        self._whenClosed = []
+
+
+    def deferToThread(self, f, *args):
+        return threads.deferToThreadPool(self.reactor,
+            self.reactor.getThreadPool(), f, *args)
+
+
+    def start(self):
+        """
+        Opens the file.
+        """
+        self._run(self.openFile)
+
+
+    def close(self):
+        """
+        Stops accepting tags. Whatever is pending is written and the file is
+        closed.
+
+        @return: A L{defer.Deferred} that fires once the file is closed.
+        """
+        d = defer.Deferred()
+
+        if self.finished:
+            d.callback(None)
+
+            return d
+
+        self._whenClosed.append(d)
+
+        if not self.closed:
+            self.closed = True
+
+            if not self.busy:
+                self._next()
+
+        return d
+
+
+    def dropTag(self, tagType, data):
+        """
+        The drop policy. Decides whether a tag is dropped rather than queued.
+
+        Meta data and sequence headers are never dropped. Audio frames are
+        dropped while L{maxPending} would be exceeded. Once a video frame has
+        been dropped, every video frame up to the next keyframe that fits is
+        dropped too, as they cannot be decoded without it.
+
+        @rtype: C{bool}
+        """
+        if tagType == flv.TAG_SCRIPT:
+            return False
+
+        audio = tagType == flv.TAG_AUDIO
+
+        if flv.is_sequence_header(data, audio=audio):
+            return False
+
+        full = self.pendingBytes + len(data) > self.maxPending
+
+        if audio:
+            return full
+
+        if flv.is_keyframe(data):
+            self.dropping = full
+        elif full:
+            self.dropping = True
+
+        return self.dropping
+
+
+    def write(self, tagType, timestamp, data):
+        """
+        Queues a tag to be written.
+        """
+        if self.closed:
+            return
+
+        if type(data) is not str:
+            # don't keep a prepared payload (and its frames) alive
+            data = str(data)
+
+        if self.dropTag(tagType, data):
+            self.dropped += 1
+
+            return
+
+        self.pending.append((tagType, timestamp, data))
+        self.pendingBytes += len(data)
+
+        if not self.busy:
+            self._next()
+
+
+    def _run(self, f, *args):
+        self.busy = True
+
+        d = self.deferToThread(f, *args)
+        d.addCallbacks(self._done, self._failed)
+
+
+    def _done(self, result):
+        self.busy = False
+
+        self._next()
+
+
+    def _failed(self, fail):
+        log.msg('Unable to record to %r' % (self.path,))
+        log.err(fail)
+
+        self.busy = False
+        self.closed = True
+        self.pending = []
+        self.pendingBytes = 0
+
+        if self.file is not None:
+            try:
+                self.file.close()
+            except:
+                log.err()
+
+            self.file = None
+
+        self._closed()
+
+
+    def _next(self):
+        if self.pending:
+            batch, self.pending = self.pending, []
+            self.pendingBytes = 0
+
+            self._run(self.writeTags, batch)
+        elif not self.closed:
+            return
+        elif self.file is None:
+            self._closed()
+        else:
+            self.busy = True
+
+            d = self.deferToThread(self.closeFile)
+            d.addCallbacks(lambda result: self._closed(), self._failed)
+
+
+    def _closed(self):
+        self.busy = False
+        self.file = None
+        self.finished = True
+
+        waiting, self._whenClosed = self._whenClosed, []
+
+        for d in waiting:
+            d.callback(None)
+
+
+    # called in the thread pool
+
+    def openFile(self):
+        """
+        Opens L{path} and writes the file header. When appending, the
+        timestamps carry on 1ms after the last tag in the file, so the first
+        appended tag does not repeat its timestamp.
+        """
+        path = self.path
+
+        if (self.append and os.path.exists(path) and
+                os.path.getsize(path) >= len(flv.FILE_HEADER)):
+            self.file = open(path, 'r+b')
+            last = self.getLastTimestamp()
+
+            if last is not None:
+                self.offset = last + 1
+
+            self.file.seek(0, 2)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(flv.FILE_HEADER)
+
+        self.lastSync = time.time()
+
+
+    def getLastTimestamp(self):
+        """
+        Returns the timestamp of the last tag in L{file}, C{None} if there are
+        no tags.
+        """
+        f = self.file
+
+        f.seek(0, 2)
+        end = f.tell()
+
+        if end <= len(flv.FILE_HEADER):
+            return None
+
+        f.seek(end - 4)
+        size, = flv.previous_tag_size.unpack(f.read(4))
+
+        if size < flv.TAG_HEADER_SIZE or size > end - 4:
+            return None
+
+        f.seek(end - 4 - size)
+
+        return flv.unpack_tag_header(f.read(flv.TAG_HEADER_SIZE))[2]
+
+
+    def writeTags(self, tags):
+        """
+        Writes a batch of tags, with one call to C{write}.
+        """
+        pack_header = flv.pack_tag_header
+        pack_size = flv.previous_tag_size.pack
+        offset = self.offset
+        parts = []
+
+        for tagType, timestamp, data in tags:
+            size = len(data)
+
+            parts.append(pack_header(tagType, size, timestamp + offset))
+            parts.append(data)
+            parts.append(pack_size(size + flv.TAG_HEADER_SIZE))
+
+        self.file.write(''.join(parts))
+
+        interval = self.fsyncInterval
+
+        if interval is None:
+            return
+
+        now = time.time()
+
+        if now - self.lastSync >= interval:
+            self.sync()
+            self.lastSync = now
+
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+    def closeFile(self):
+        self.sync()
+        self.file.close()
+
+
+    # events called by the publisher
+
+    def videoDataReceived(self, data, timestamp):
+        self.write(flv.TAG_VIDEO, timestamp, data)
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.write(flv.TAG_AUDIO, timestamp, data)
+
+
+    def onMetaData(self, data):
+        self.write(flv.TAG_SCRIPT, 0, message.encode_amf0('onMetaData', data))
+
+
+    def unpublish(self):
+        self.close()
@@ -0,0 +1,359 @@
+# -*- test-case-name: rtmpy.tests.test_ring -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shares a published stream between processes on the same host through a
+memory mapped ring buffer.
+
+One process writes the packets of a stream to the ring with a L{RingWriter},
+which is added to the L{server.StreamPublisher} of the stream like any other
+subscriber. Any number of processes map the same file and read the packets
+back with a L{RingReader}, which feeds them to a local
+L{server.StreamPublisher}::
+
+    # the process the stream is published to
+    ring = RingBuffer('/dev/shm/live-foo', capacity=0x1000000)
+    app.streams['foo'].addSubscriber(RingWriter(ring))
+
+    # the other processes
+    publisher = server.StreamPublisher(None, server.Client(None))
+    RingReader(RingBuffer('/dev/shm/live-foo'), publisher).start()
+
+The file starts with a header (magic, capacity and the write position) that is
+followed by the records. Each record is a fixed header (datatype, timestamp,
+length) and the payload. The writer never waits for the readers, a reader that
+falls more than a lap behind skips ahead to the newest packet.
+"""
+
+import os
+import mmap
+import struct
+
+from zope.interface import implements
+from twisted.internet import task
+from twisted.python import log
+import pyamf
+
+from rtmpy import message, server
+
+
+__all__ = [
+    'RingBuffer',
+    'RingWriter',
+    'RingReader',
+]
+
+
+#: Identifies a ring buffer file.
+MAGIC = 'RTMPYRNG'
+
+#: The number of bytes reserved for the header of the file.
+HEADER_SIZE = 64
+
+#: The default capacity of a ring (in bytes).
+CAPACITY = 0x1000000
+
+#: Fills the end of the ring when a record does not fit before it wraps.
+PADDING = 0x00
+
+#: Written when the stream is unpublished.
+END_OF_STREAM = 0xff
+
+#: magic, capacity
+_fileHeader = struct.Struct('!8sL')
+#: The write position, the total number of bytes ever written. It is 8 byte
+#  aligned so that it is updated with a single store.
+_head = struct.Struct('!Q')
+_HEAD_OFFSET = 16
+#: datatype, timestamp, length
+_record = struct.Struct('!BLL')
+
+
+class RingBuffer(object):
+    """
+    A single producer, multiple consumer ring of records backed by a memory
+    mapped file.
+
+    Positions in the ring are absolute, they count every byte that was ever
+    written and are mapped to an offset with C{pos % capacity}.
+
+    @ivar capacity: The size of the record area in bytes.
+    @ivar maxRecordSize: The largest record that can be written. A write that
+        does not fit before the end of the ring first skips up to this many
+        bytes, so a reader considers a record to be overwritten as soon as the
+        writer is within twice this many bytes of it.
+    """
+
+    def __init__(self, path, capacity=None):
+        """
+        Opens the ring stored in C{path}. If C{capacity} is given then the file
+        is (re)created, this must only be done by the writer.
+        """
+        if capacity is not None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0600)
+            os.ftruncate(fd, HEADER_SIZE + capacity)
+        else:
+            fd = os.open(path, os.O_RDWR)
+
+        try:
+            size = os.fstat(fd).st_size
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        if capacity is not None:
+            _fileHeader.pack_into(self.map, 0, MAGIC, capacity)
+        else:
+            magic, capacity = _fileHeader.unpack_from(self.map)
+
+            if magic != MAGIC or HEADER_SIZE + capacity > size:
+                self.map.close()
+
+                raise ValueError('%r is not a ring buffer' % (path,))
+
+        self.path = path
+        self.capacity = capacity
+        self.maxRecordSize = capacity // 4
+
+
+    def getHead(self):
+        """
+        Returns the position that the next record will be written at.
+        """
+        return _head.unpack_from(self.map, _HEAD_OFFSET)[0]
+
+
+    def write(self, datatype, timestamp, data):
+        """
+        Appends a record to the ring. Only one process may write to a ring.
+        """
+        size = _record.size + len(data)
+
+        if size > self.maxRecordSize:
+            raise ValueError('Record of %d bytes is too large for the ring '
+                '(max %d)' % (size, self.maxRecordSize))
+
+        head = self.getHead()
+        offset = head % self.capacity
+        left = self.capacity - offset
+
+        if size > left:
+            if left >= _record.size:
+                _record.pack_into(self.map, HEADER_SIZE + offset, PADDING, 0,
+                    left - _record.size)
+
+            head += left
+            offset = 0
+
+        pos = HEADER_SIZE + offset
+
+        _record.pack_into(self.map, pos, datatype, timestamp, len(data))
+        pos += _record.size
+        self.map[pos:pos + len(data)] = data
+
+        # publish the record only once it is complete
+        _head.pack_into(self.map, _HEAD_OFFSET, head + size)
+
+
+    def read(self, pos):
+        """
+        Reads the record at C{pos}, skipping any padding.
+
+        The payload is a C{buffer} into the map, it is not copied. The writer
+        may overwrite it at any time so it must be checked with L{isValid}
+        after it has been used.
+
+        @return: C{(datatype, timestamp, payload, nextPos)} or C{None} if there
+            is no record at C{pos} yet.
+        """
+        if pos >= self.getHead():
+            return None
+
+        offset = pos % self.capacity
+        left = self.capacity - offset
+
+        if left < _record.size:
+            return self.read(pos + left)
+
+        datatype, timestamp, length = _record.unpack_from(self.map,
+            HEADER_SIZE + offset)
+
+        if datatype == PADDING:
+            return self.read(pos + left)
+
+        start = HEADER_SIZE + offset + _record.size
+        payload = buffer(self.map, start, length)
+
+        return datatype, timestamp, payload, pos + _record.size + length
+
+
+    def isValid(self, pos):
+        """
+        Whether the record at C{pos} is certainly intact.
+
+        The write in progress at the head may pad to the end of the ring and
+        then write a whole record, touching up to C{2 * maxRecordSize} bytes
+        past the head.
+        """
+        return self.getHead() + 2 * self.maxRecordSize <= pos + self.capacity
+
+
+    def close(self):
+        self.map.close()
+
+
+
+class RingWriter(object):
+    """
+    Writes the packets of the stream it is subscribed to to a L{RingBuffer}.
+
+    @ivar ring: The L{RingBuffer} to write to.
+    @ivar dropped: The number of packets that were too large for the ring.
+    """
+
+    implements(server.IPublishingStream)
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.dropped = 0
+
+
+    def write(self, datatype, timestamp, data):
+        try:
+            self.ring.write(datatype, timestamp, data)
+        except ValueError:
+            self.dropped += 1
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.write(message.VIDEO_DATA, timestamp, data)
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.write(message.AUDIO_DATA, timestamp, data)
+
+
+    def onMetaData(self, data):
+        meta = pyamf.encode(data, encoding=pyamf.AMF0).getvalue()
+
+        self.write(message.NOTIFY, 0, meta)
+
+
+    def unpublish(self):
+        self.write(END_OF_STREAM, 0, '')
+
+
+
+class RingReader(object):
+    """
+    Polls a L{RingBuffer} and passes the records to a publisher.
+
+    Each payload is copied out of the map once, the publisher then hands the
+    same C{str} to all of the subscribers in this process.
+
+    @ivar ring: The L{RingBuffer} to read from.
+    @ivar publisher: Receives the packets, usually a L{server.StreamPublisher}.
+    @ivar pos: The position of the next record to read.
+    @ivar interval: The number of seconds between polls.
+    @ivar overruns: The number of times the writer lapped this reader.
+    """
+
+    interval = 0.01
+
+    def __init__(self, ring, publisher, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.ring = ring
+        self.publisher = publisher
+        self.clock = clock
+
+        self.pos = ring.getHead()
+        self.overruns = 0
+        self.call = None
+
+
+    def start(self):
+        """
+        Starts polling the ring, only packets written from now on are read.
+        """
+        self.call = task.LoopingCall(self.poll)
+        self.call.clock = self.clock
+
+        self.call.start(self.interval)
+
+
+    def stop(self):
+        if self.call is not None and self.call.running:
+            self.call.stop()
+
+        self.call = None
+
+
+    def poll(self):
+        """
+        Reads all of the records that are available.
+        """
+        ring = self.ring
+
+        while True:
+            pos = self.pos
+
+            if not ring.isValid(pos):
+                self.overruns += 1
+                self.pos = ring.getHead()
+
+                return
+
+            record = ring.read(pos)
+
+            if record is None:
+                return
+
+            datatype, timestamp, payload, self.pos = record
+            data = str(payload)
+
+            if not ring.isValid(pos):
+                # overwritten while it was being copied
+                continue
+
+            try:
+                if not self.dispatch(datatype, timestamp, data):
+                    return
+            except:
+                log.err()
+
+
+    def dispatch(self, datatype, timestamp, data):
+        """
+        Passes a packet to the publisher. Returns C{False} once the end of the
+        stream has been reached.
+        """
+        if datatype == message.VIDEO_DATA:
+            self.publisher.videoDataReceived(data, timestamp)
+        elif datatype == message.AUDIO_DATA:
+            self.publisher.audioDataReceived(data, timestamp)
+        elif datatype == message.NOTIFY:
+            self.publisher.onMetaData(pyamf.decode(data,
+                encoding=pyamf.AMF0).next())
+        elif datatype == END_OF_STREAM:
+            self.stop()
+            self.publisher.unpublish()
+
+            return False
+
+        return True
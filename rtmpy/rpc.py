@@ -170,17 +170,50 @@ def getExposedMethods(cls):
 
 
 
-def callExposedMethod(obj, name, *args, **kwargs):
+def getExposedFunction(cls, name):
     """
-    Calls an exposed methood on C{obj}. If the method is not exposed,
-    L{exc.CallFailed} will be raised.
+    Returns the function of C{cls} that is exposed as C{name}, to be called
+    with an instance of C{cls} as the first argument. If the function is not
+    exposed, L{exc.CallFailed} will be raised.
 
-    @return: The result of the called method.
+    The functions are looked up once and stored on the class in the
+    C{__exposed_functions__} slot.
     """
-    cls = obj.__class__
+    functions = cls.__dict__.get('__exposed_functions__', None)
+
+    if functions is None:
+        functions = cls.__exposed_functions__ = {}
+
+    try:
+        return functions[name]
+    except KeyError:
+        pass
 
     methods = getExposedMethods(cls)
 
+    try:
+        methodName = methods[name]
+        func = getattr(cls, methodName)
+    except Exception, e:
+        if isinstance(e, AttributeError):
+            log.err("'%s' is exposed but %r does not exist on %r " % (
+                name, methodName, cls))
+
+        raise exc.CallFailed("Method not found (%s)" % (name,))
+
+    func = functions[name] = getattr(func, 'im_func', func)
+
+    return func
+
+
+
+def getExposedMethod(obj, name):
+    """
+    Returns the bound method of C{obj} that is exposed as C{name}. If the
+    method is not exposed, L{exc.CallFailed} will be raised.
+    """
+    methods = getExposedMethods(obj.__class__)
+
     try:
         methodName = methods[name]
         method = getattr(obj, methodName)
@@ -191,7 +224,18 @@ def callExposedMethod(obj, name, *args, **kwargs):
 
         raise exc.CallFailed("Method not found (%s)" % (name,))
 
-    return method(*args, **kwargs)
+    return method
+
+
+
+def callExposedMethod(obj, name, *args, **kwargs):
+    """
+    Calls an exposed methood on C{obj}. If the method is not exposed,
+    L{exc.CallFailed} will be raised.
+
+    @return: The result of the called method.
+    """
+    return getExposedMethod(obj, name)(*args, **kwargs)
 
 
 
@@ -429,7 +473,10 @@ class AbstractCallHandler(BaseCallHandler):
         @param callId: The callId for the RPC request.
         @type callId: C{int}
         @param args: The args to be called on the exposed method.
-        @return: A L{defer.Deferred} containing the result of the call.
+        @return: The result of the call. If the method returns a
+            L{defer.Deferred}, it is returned with the response chained to it.
+            A plain value is answered straight away and returned as is. A
+            failed call is returned as a failed L{defer.Deferred}.
         """
         def cb(result):
             if callId == NO_RESULT:
@@ -474,26 +521,50 @@ class AbstractCallHandler(BaseCallHandler):
             return fail
 
 
+        if callId != NO_RESULT:
+            try:
+                self.initiateCall(name, callId=callId, *args)
+            except:
+                return defer.fail().addErrback(eb)
+
         try:
-            self.initiateCall(name, callId=callId, *args)
+            result = self.callExposedMethod(name, *args)
         except:
             return defer.fail().addErrback(eb)
 
-        d = self.callExposedMethod(name, *args)
+        if isinstance(result, defer.Deferred):
+            return result.addCallbacks(cb, eb)
 
-        d.addCallbacks(cb, eb)
+        try:
+            return cb(result)
+        except:
+            return defer.fail()
 
-        return d
+
+    def isExposed(self, name):
+        """
+        Whether a call to C{name} from the peer will find a method to call.
+        Calls that do not are rejected before their arguments are decoded (see
+        L{message.Arguments}).
+
+        Subclasses that override L{callExposedMethod} to find methods
+        elsewhere should override this as well.
+        """
+        return name in getExposedMethods(self.__class__)
 
 
     def callExposedMethod(self, name, *args):
         """
-        Returns a L{defer.Deferred} that will hold the result of the called
-        method.
+        Calls the method exposed as C{name} and returns its result, which may
+        be a L{defer.Deferred}. L{exc.CallFailed} is raised if the method is not
+        exposed.
+
+        The function is looked up once per class (see L{getExposedFunction}),
+        nothing is cached on the instance.
 
         This api allows subclasses to hook into the calling process.
 
         @param name: The name of the method to call
         @param args: The supplied args from the invoke/notify call.
         """
-        return defer.maybeDeferred(callExposedMethod, self, name, *args)
+        return getExposedFunction(self.__class__, name)(self, *args)
@@ -16,6 +16,7 @@
 """
 Server implementation.
 """
+import os
 import urlparse
 
 from zope.interface import Interface, Attribute, implements
@@ -23,12 +24,23 @@ from twisted.internet import protocol, defer
 from twisted.python import failure, log
 import pyamf
 
-from rtmpy import util, exc, versions
-from rtmpy import message, rpc, status, core
+from rtmpy import util, exc, versions, flv
+from rtmpy import message, rpc, status, core, vod
 from rtmpy.protocol import rtmp, handshake, version
+from rtmpy.protocol.rtmp import codec
 from rtmpy.status import codes
 
 
+#: The messages sent to every peer that starts playing a stream. Only the
+#: description and the client id of the status objects change.
+ON_STATUS = message.Template(message.Invoke, 'onStatus', rpc.NO_RESULT, None)
+PLAY_RESET = status.Template(status.STATUS_STATUS, 'NetStream.Play.Reset')
+PLAY_START = status.Template(status.STATUS_STATUS, 'NetStream.Play.Start')
+STREAM_IS_RECORDED = message.prepare(message.ControlMessage(4, 1))
+STREAM_BEGIN = message.prepare(message.ControlMessage(0, 1))
+DATA_START = ON_STATUS.build({'code': 'NetStream.Data.Start'})
+
+
 class IApplication(Interface):
     """
     An application provides business logic for connected clients and streams.
@@ -215,6 +227,8 @@ class NetStream(core.NetStream):
         receive the audio/video/meta data events from the peer. See
         L{StreamPublisher} for now.
     @type publisher: L{IPublishingStream}
+    @param source: When playing, the L{StreamPublisher} that this NetStream is
+        subscribed to.
     """
 
     def __init__(self, nc, streamId):
@@ -223,6 +237,9 @@ class NetStream(core.NetStream):
         self.state = None
         self.name = None
         self.publisher = None
+        self.source = None
+
+        self._pendingPlay = None
 
     def publishingStarted(self, publisher, name):
         """
@@ -233,6 +250,16 @@ class NetStream(core.NetStream):
         self.name = name
         self.state = 'publishing'
 
+    def publishingStopped(self, s):
+        """
+        Called when the stream that this NetStream was publishing has been
+        taken away from it. The peer is informed with the status C{s}.
+        """
+        self.publisher = None
+        self.state = None
+
+        self.sendStatus(s)
+
     @rpc.expose
     def receiveAudio(self, audio):
         """
@@ -283,6 +310,13 @@ class NetStream(core.NetStream):
         """
         d = defer.succeed(None)
 
+        pending, self._pendingPlay = self._pendingPlay, None
+
+        if pending is not None:
+            # the stream or file is not playing yet, the player (if any) is
+            # released as soon as it has been built
+            pending.cancel()
+
         if self.state == 'publishing':
             d = defer.maybeDeferred(self.nc.unpublishStream, self, self.name)
 
@@ -294,6 +328,11 @@ class NetStream(core.NetStream):
                 return res
 
             d.addBoth(send_status)
+        elif self.state == 'playing':
+            source, self.source = self.source, None
+
+            if self in source.subscribers:
+                source.removeSubscriber(self)
 
         def clear_state(res):
             self.state = None
@@ -337,6 +376,16 @@ class NetStream(core.NetStream):
         if self.publisher:
             self.publisher.audioDataReceived(data, timestamp)
 
+    def isExposed(self, name):
+        """
+        Meta data sent to a stream that is not publishing is ignored without
+        being decoded.
+        """
+        if name == '@setDataFrame' and self.publisher is None:
+            return False
+
+        return core.NetStream.isExposed(self, name)
+
     @rpc.expose('@setDataFrame')
     def setDataFrame(self, name, meta):
         """
@@ -375,35 +424,19 @@ class NetStream(core.NetStream):
     def play(self, name, *args):
         d = defer.maybeDeferred(self.nc.playStream, name, self, *args)
 
-        def cb(res):
-            """
-            The stream has started playing
-            """
-            self._audioChannel = self.nc.getStreamingChannel(self)
-            self._audioChannel.setType(message.AUDIO_DATA)
-
-            self._videoChannel = self.nc.getStreamingChannel(self)
-            self._videoChannel.setType(message.VIDEO_DATA)
-
-            self.state = 'playing'
-
-            # wtf
-            self.sendMessage(message.ControlMessage(4, 1))
-            self.sendMessage(message.ControlMessage(0, 1))
-
-            self.sendStatus('NetStream.Play.Reset',
-                description='Playing and resetting %s' % (name,),
-                clientid=self.nc.clientId)
-
-            self.sendStatus('NetStream.Play.Start',
-                description='Started playing %s' % (name,),
-                clientid=self.nc.clientId)
+        if not d.called:
+            self._pendingPlay = d
 
-            self.nc.call('onStatus', {'code': 'NetStream.Data.Start'})
+        def started(result):
+            if self._pendingPlay is d:
+                self._pendingPlay = None
 
-            return res
+            return result
 
         def eb(fail):
+            if fail.check(defer.CancelledError):
+                return
+
             code = getattr(fail.value, 'code', 'NetStream.Play.Failed')
             description = util.getFailureMessage(fail) or 'Internal Server Error'
 
@@ -411,16 +444,78 @@ class NetStream(core.NetStream):
 
             return fail
 
+        d.addBoth(started)
         d.addErrback(eb)
-        d.addCallback(cb)
 
         return d
 
+    @rpc.expose
+    def seek(self, offset):
+        """
+        Called by the peer to move the play head of the file being played to
+        C{offset} milliseconds. Live streams cannot be seeked.
+        """
+        seek = getattr(self.source, 'seek', None)
+        timestamp = None
+
+        if self.state == 'playing' and seek is not None:
+            timestamp = seek(int(offset))
+
+        if timestamp is None:
+            self.sendStatus(status.error(codes.NS_SEEK_FAILED,
+                'Unable to seek %s' % (self.name,)))
+
+            return
+
+        self.sendStatus(status.status(codes.NS_SEEK_NOTIFY,
+            description='Seeking %d (stream ID: %d).' % (timestamp,
+                self.streamId),
+            clientid=self.nc.clientId))
+
+    def playingStarted(self, publisher, name):
+        """
+        Called when the stream C{name} that this NetStream asked to play has
+        been published, before this NetStream is added as a subscriber.
+        """
+        self._audioChannel = self.nc.getStreamingChannel(self)
+        self._audioChannel.setType(message.AUDIO_DATA)
+
+        self._videoChannel = self.nc.getStreamingChannel(self)
+        self._videoChannel.setType(message.VIDEO_DATA)
+
+        self.source = publisher
+        self.name = name
+        self.state = 'playing'
+
+        clientId = self.nc.clientId
+
+        # wtf
+        self.sendMessage(STREAM_IS_RECORDED)
+        self.sendMessage(STREAM_BEGIN)
+
+        self.sendMessage(ON_STATUS.build(PLAY_RESET.encode(
+            'Playing and resetting %s' % (name,), clientid=clientId)))
+
+        self.sendMessage(ON_STATUS.build(PLAY_START.encode(
+            'Started playing %s' % (name,), clientid=clientId)))
+
+        self.nc.sendMessage(DATA_START)
+
     def onMetaData(self, data):
         """
         """
         self.call('onMetaData', data)
 
+    @property
+    def paused(self):
+        """
+        Whether the connection to the peer is too congested to accept any more
+        audio/video data. Only meaningful once the stream is playing.
+        """
+        channel = getattr(self, '_videoChannel', None)
+
+        return channel is not None and channel.paused
+
     def videoDataReceived(self, data, timestamp):
         self._videoChannel.sendData(data, timestamp)
 
@@ -457,8 +552,8 @@ class NetConnection(core.NetConnection):
 
         @param stream: The L{NetStream} instance requesting the publication.
         @param streamName: The name of the stream to be published.
-        @param type_: Not quite sure of the significance of this yet - valid
-            values appear to be 'live', 'append', 'record'.
+        @param type_: C{live}, C{record} or C{append}, see
+            L{Application.publishStream}.
         """
         streamName = util.ParamedString(streamName)
 
@@ -520,15 +615,70 @@ class NetConnection(core.NetConnection):
 
     def playStream(self, name, subscriber, *args):
         """
+        Called when C{subscriber} wants to play the stream C{name}. If the
+        stream is not published to the application, the file of the same name
+        is played (see L{Application.vodPath}). Failing that, if the factory
+        has an C{edge}, the stream is pulled from the origin.
+
+        The returned L{defer.Deferred} can be cancelled (e.g. when
+        C{subscriber} is closed) while the file is opened or the stream is
+        waited for. A player built after that is stopped, which releases its
+        file.
         """
         d = defer.Deferred()
 
         def whenPublished(publisher):
+            subscriber.playingStarted(publisher, name)
             publisher.addSubscriber(subscriber)
 
             return publisher
 
-        self.application.whenPublished(name, d.callback)
+        def waitForStream():
+            edge = self.protocol.factory.edge
+
+            if edge is not None and name not in self.application.streams:
+                pull = edge.pull(self.application, name)
+                pull.addWaiter()
+
+                def stopWaiting(result):
+                    pull.removeWaiter()
+
+                    return result
+
+                d.addBoth(stopWaiting)
+
+            self.application.whenPublished(name, d.callback)
+
+        def playerBuilt(player):
+            if d.called:
+                # cancelled while the file was being opened
+                player.stop()
+
+                return
+
+            d.callback(player)
+
+        def fileMissing(fail):
+            fail.trap(IOError)
+
+            if not d.called:
+                waitForStream()
+
+        def playerFailed(fail):
+            if not d.called:
+                d.errback(fail)
+
+        path = None
+
+        if name not in self.application.streams:
+            path = self.application.getPlaybackPath(name)
+
+        if path is None:
+            waitForStream()
+        else:
+            p = self.application.buildPlayer(path)
+            p.addCallbacks(playerBuilt, fileMissing)
+            p.addErrback(playerFailed)
 
         d.addCallback(whenPublished)
 
@@ -555,11 +705,23 @@ class NetConnection(core.NetConnection):
             target = util.get_callable_target(client, name)
 
             if target:
-                return defer.maybeDeferred(target, *args)
+                return target(*args)
 
         return core.NetConnection.callExposedMethod(self, name, *args)
 
 
+    def isExposed(self, name):
+        """
+        See L{callExposedMethod}, all of the client's methods are exposed.
+        """
+        client = getattr(self, 'client', None)
+
+        if client and util.get_callable_target(client, name):
+            return True
+
+        return core.NetConnection.isExposed(self, name)
+
+
     @rpc.expose('connect')
     def onConnect(self, params, *args):
         """
@@ -588,7 +750,8 @@ class NetConnection(core.NetConnection):
 
             # begin negotiating bandwidth
             self.sendMessage(message.DownstreamBandwidth(f.downstreamBandwidth))
-            self.sendMessage(message.UpstreamBandwidth(f.upstreamBandwidth, 2))
+            self.sendMessage(message.UpstreamBandwidth(f.upstreamBandwidth,
+                message.LIMIT_DYNAMIC))
 
             return res
 
@@ -657,6 +820,11 @@ class NetConnection(core.NetConnection):
 
         self.client = self.application.buildClient(self, params, *args)
 
+        rate = getattr(self.application, 'sendRate', None)
+
+        if rate is not None:
+            self.protocol.setSendRate(rate, self.application.sendBurst)
+
         def cb(res):
             """
             Called with the result of the connection attempt, either C{True} or
@@ -753,6 +921,87 @@ class ServerProtocol(rtmp.RTMPProtocol):
 
 
 
+class GOPCache(object):
+    """
+    Holds the most recent group of pictures (GOP) of a published stream: every
+    audio/video packet since the last keyframe. Replaying it to a subscriber
+    that joins mid-stream means that the player can start rendering straight
+    away rather than waiting for the next keyframe. Sequence headers are not
+    cached here, see L{StreamPublisher.videoHeader}.
+
+    The cache is discarded (until the next keyframe) if it grows larger than
+    C{maxBytes} or spans more than C{maxDuration}. A keyframe without the
+    packets that follow it is not worth replaying.
+
+    @ivar maxBytes: The maximum number of bytes of audio/video data to cache.
+        C{0} disables the cache.
+    @ivar maxDuration: The maximum time span of the cache in milliseconds.
+    @ivar packets: A list of C{(isVideo, data, timestamp)} tuples, the first
+        of which is always a keyframe.
+    @ivar size: The number of bytes of data in C{packets}.
+    """
+
+    maxBytes = 0x400000
+    maxDuration = 10000
+
+    def __init__(self):
+        self.packets = []
+        self.size = 0
+
+    @property
+    def start(self):
+        """
+        The timestamp of the first packet in the cache, or C{None} if it is
+        empty.
+        """
+        if not self.packets:
+            return None
+
+        return self.packets[0][2]
+
+    def clear(self):
+        """
+        Discards the cached packets.
+        """
+        self.packets = []
+        self.size = 0
+
+    def _add(self, packet):
+        self.packets.append(packet)
+        self.size += len(packet[1])
+
+        if self.size > self.maxBytes or \
+                packet[2] - self.packets[0][2] > self.maxDuration:
+            self.clear()
+
+    def addVideo(self, data, timestamp):
+        """
+        Caches a video packet.
+        """
+        if flv.is_sequence_header(data):
+            return
+
+        if flv.is_keyframe(data):
+            self.clear()
+        elif not self.packets:
+            return
+
+        self._add((True, data, timestamp))
+
+    def addAudio(self, data, timestamp):
+        """
+        Caches an audio packet.
+        """
+        if self.packets and not flv.is_sequence_header(data, audio=True):
+            self._add((False, data, timestamp))
+
+    def getPackets(self):
+        """
+        Returns the packets to replay to a new subscriber.
+        """
+        return self.packets
+
+
 class StreamPublisher(object):
     """
     Linked to a L{NetStream} when it makes a publish request. Manages a list of
@@ -762,11 +1011,21 @@ class StreamPublisher(object):
     @ivar stream: The publishing L{NetStream}
     @ivar client: The linked L{Client} object. Not used right now.
     @ivar subscribers: A list of subscribers that are listening to the stream.
-    @ivar
+        If there is more than one, the audio/video data is passed to them as a
+        L{codec.PreparedMessage} so that it is only split into RTMP frames
+        once. Video frames are dropped for subscribers that cannot keep up, see
+        L{dropVideo}.
+    @ivar cache: The L{GOPCache} that is replayed to new subscribers.
+    @ivar videoHeader: The last AVC sequence header (decoder configuration
+        record) received from the stream.
+    @ivar audioHeader: The last AAC sequence header (AudioSpecificConfig)
+        received from the stream.
     """
 
     implements(IPublishingStream)
 
+    cache_class = GOPCache
+
     def __init__(self, stream, client):
         self.stream = stream
         self.client = client
@@ -774,6 +1033,9 @@ class StreamPublisher(object):
         self.subscribers = {}
         self.meta = {}
         self.timestamp = self.baseTimestamp = 0
+        self.cache = self.cache_class()
+        self.videoHeader = None
+        self.audioHeader = None
 
     def _updateTimestamp(self, timestamp):
         """
@@ -789,21 +1051,91 @@ class StreamPublisher(object):
 
     def addSubscriber(self, subscriber):
         """
-        Adds a subscriber to this publisher.
+        Adds a subscriber to this publisher. The meta data, the sequence
+        headers and the contents of the L{GOPCache} are sent to the subscriber
+        straight away. The timestamps of the subscriber are rebased to the start
+        of the cached GOP.
         """
-        self.subscribers[subscriber] = {
-            'timestamp': self.timestamp
+        context = self.subscribers[subscriber] = {
+            'timestamp': self.timestamp,
+            'dropping': False,
+            'dropped': 0
         }
 
         if self.meta:
             subscriber.onMetaData(self.meta)
 
+        start = self.cache.start
+
+        if start is not None:
+            context['timestamp'] = start
+
+        packets = []
+
+        if self.videoHeader is not None:
+            packets.append((True, self.videoHeader, 0))
+
+        if self.audioHeader is not None:
+            packets.append((False, self.audioHeader, 0))
+
+        packets.extend(self.cache.getPackets())
+
+        for isVideo, data, timestamp in packets:
+            timestamp = max(timestamp - context['timestamp'], 0)
+
+            try:
+                if isVideo:
+                    subscriber.videoDataReceived(data, timestamp)
+                else:
+                    subscriber.audioDataReceived(data, timestamp)
+            except:
+                log.err()
+                self.removeSubscriber(subscriber)
+
+                return
+
     def removeSubscriber(self, subscriber):
         """
         Removes the subscriber from this publisher.
         """
         self.subscribers.pop(subscriber)
 
+    def isCongested(self, subscriber):
+        """
+        Whether C{subscriber} cannot currently keep up with the stream (see
+        L{NetStream.paused}).
+        """
+        return getattr(subscriber, 'paused', False)
+
+    def dropVideo(self, subscriber, context, data):
+        """
+        The frame dropping policy. Decides whether the video frame C{data}
+        should be withheld from C{subscriber}.
+
+        Once a subscriber is congested, inter frames are dropped until the next
+        keyframe (even if the congestion clears in the meantime, as they depend
+        on the frames that were dropped). Keyframes, sequence headers and info
+        frames are always sent. Audio is never dropped.
+
+        @param context: The state kept for C{subscriber}.
+        @rtype: C{bool}
+        """
+        if flv.is_keyframe(data):
+            context['dropping'] = False
+
+            return False
+
+        if not flv.is_disposable(data):
+            return False
+
+        if context['dropping'] or self.isCongested(subscriber):
+            context['dropping'] = True
+            context['dropped'] += 1
+
+            return True
+
+        return False
+
     # events called by the stream
 
     def videoDataReceived(self, data, timestamp):
@@ -816,9 +1148,20 @@ class StreamPublisher(object):
         """
         timestamp = self._updateTimestamp(timestamp)
 
+        if flv.is_sequence_header(data):
+            self.videoHeader = data
+
+        self.cache.addVideo(data, timestamp)
+
+        if len(self.subscribers) > 1:
+            data = codec.PreparedMessage(data)
+
         to_remove = []
 
         for subscriber, context in self.subscribers.iteritems():
+            if self.dropVideo(subscriber, context, data):
+                continue
+
             relTimestamp = timestamp - context['timestamp']
 
             try:
@@ -840,8 +1183,16 @@ class StreamPublisher(object):
         @param timestamp: The timestamp at which this data was received.
         """
         timestamp = self._updateTimestamp(timestamp)
+
+        if flv.is_sequence_header(data, audio=True):
+            self.audioHeader = data
+
+        self.cache.addAudio(data, timestamp)
         to_remove = []
 
+        if len(self.subscribers) > 1:
+            data = codec.PreparedMessage(data)
+
         for subscriber, context in self.subscribers.iteritems():
             try:
                 subscriber.audioDataReceived(data, timestamp - context['timestamp'])
@@ -883,12 +1234,31 @@ class Application(object):
     implements(IApplication)
 
     client = Client
+    factory = None
+
+    #: The directory that streams published with the type C{record} or
+    #: C{append} are written to. C{None} disables recording.
+    recordPath = None
+
+    #: The directory that FLV files are played from, when nothing is published
+    #: under the name being played. C{None} disables playing files.
+    vodPath = None
+
+    #: The number of bytes per second that may be sent to each client,
+    #: C{None} means no limit. Set before L{onConnect} is called, which can
+    #: set a different limit for the client with
+    #: C{client.nc.protocol.setSendRate}.
+    sendRate = None
+    #: The number of bytes that may be sent to a client at once after a quiet
+    #: period. C{None} allows a tenth of a second's worth of L{sendRate}.
+    sendBurst = None
 
     def __init__(self):
         self.clients = {}
         self.streams = {}
         self._streamingClients = {}
         self._pendingPublishedCallbacks = {}
+        self.fileCache = vod.FileCache()
 
 
     def startup(self):
@@ -1040,15 +1410,29 @@ class Application(object):
         @param client: The L{Client} requesting the publishing the stream.
         @param stream: The L{NetStream} that will receive the a/v data.
         @param name: The name of the stream that will be published.
-        @param type_: Ignored for now.
+        @param type_: C{live}, C{record} or C{append}. The last two write the
+            stream to a file, see L{recordPath}.
         """
         stream = self.streams.get(name, None)
 
         if stream is None:
             # brand new publish
+            path = None
+
+            if type_ in ('record', 'append'):
+                path = self.getRecordingPath(name)
+
             stream = self.streams[name] = StreamPublisher(requestor, client)
             self._streamingClients[client] = stream
 
+            if path is not None:
+                self.startRecording(stream, path, type_ == 'append')
+
+            relay = getattr(self.factory, 'relay', None)
+
+            if relay is not None:
+                relay.publishStarted(self, name, stream)
+
         if client.id != stream.client.id:
             raise exc.BadNameError("'%s' is already used" % (name,))
 
@@ -1057,6 +1441,102 @@ class Application(object):
         return stream
 
 
+    def addPublisher(self, name, publisher):
+        """
+        Publishes C{publisher} under C{name}. For streams that are fed from
+        somewhere other than a peer of this application, e.g. another worker
+        process or an origin server. See L{removePublisher}.
+
+        @type publisher: L{StreamPublisher}
+        @raise exc.BadNameError: C{name} is already published.
+        """
+        if name in self.streams:
+            raise exc.BadNameError("'%s' is already used" % (name,))
+
+        self.streams[name] = publisher
+
+        self._runCallbacksForPublishedStream(name, publisher)
+
+
+    def removePublisher(self, name, publisher):
+        """
+        The reverse of L{addPublisher}. Does nothing if C{publisher} is not
+        (or no longer) published under C{name}.
+        """
+        if self.streams.get(name, None) is publisher:
+            del self.streams[name]
+
+
+    def _getFilePath(self, directory, name):
+        """
+        Returns the path of the FLV file for the stream C{name} in
+        C{directory}, or C{None} if C{name} could refer to a file outside of
+        it.
+        """
+        if not name or name.startswith('.') or '/' in name or os.sep in name:
+            return None
+
+        return os.path.join(directory, name + '.flv')
+
+
+    def getRecordingPath(self, name):
+        """
+        Returns the path of the file that the stream C{name} is recorded to, or
+        C{None} if recording is disabled.
+        """
+        if self.recordPath is None:
+            return None
+
+        path = self._getFilePath(self.recordPath, name)
+
+        if path is None:
+            raise exc.BadNameError('Cannot record %r' % (name,))
+
+        return path
+
+
+    def getPlaybackPath(self, name):
+        """
+        Returns the path of the file that is played when the stream C{name}
+        is not published, or C{None} if files are not played. The file is not
+        looked up here, as this is called from the reactor thread;
+        L{buildPlayer} fails with C{IOError} if it does not exist.
+        """
+        if self.vodPath is None:
+            return None
+
+        return self._getFilePath(self.vodPath, name)
+
+
+    def buildPlayer(self, path):
+        """
+        Returns a L{defer.Deferred} that fires with a L{vod.Player} of the FLV
+        file C{path}. The file is shared with the other players of the same
+        file through L{fileCache}. C{IOError} is raised (in the thread pool)
+        if the file does not exist.
+        """
+        d = self.fileCache.acquire(path)
+
+        return d.addCallback(vod.Player, cache=self.fileCache)
+
+
+    def startRecording(self, publisher, path, append=False):
+        """
+        Writes everything that C{publisher} receives to the FLV file C{path}.
+
+        @rtype: L{rtmpy.record.Recorder}
+        """
+        # prevent circular import
+        from rtmpy import record
+
+        recorder = record.Recorder(path, append)
+        recorder.start()
+
+        publisher.addSubscriber(recorder)
+
+        return recorder
+
+
     def unpublishStream(self, name, stream):
         try:
             source = self.streams[name]
@@ -1158,6 +1638,11 @@ class ServerFactory(protocol.ServerFactory):
     @ivar _pendingApplications: A collection of applications that are pending
         activation.
     @type _pendingApplications: C{dict} of C{name} -> L{IApplication}
+    @ivar relay: Set when the factory is served by several worker processes
+        (see L{rtmpy.worker}). Streams published to the applications are
+        relayed to the other workers through it.
+    @ivar edge: An L{rtmpy.edge.Edge} that pulls the streams that are played
+        but not published here from an origin server, or C{None}.
     """
 
     protocol = ServerProtocol
@@ -1166,6 +1651,8 @@ class ServerFactory(protocol.ServerFactory):
     upstreamBandwidth = 2500000L
     downstreamBandwidth = 2500000L
     fmsVer = versions.FMS_MIN_H264
+    relay = None
+    edge = None
 
     def __init__(self, applications=None):
         self.applications = {}
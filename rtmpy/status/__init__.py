@@ -18,10 +18,14 @@ RTMP status response objects require guaranteed attribute order otherwise the
 Flash Player throws a fit.
 """
 
+import struct
+
 from zope.interface import Interface, Attribute, implements
 
+from rtmpy import message
+
 
-__all__ = ['IStatus', 'status', 'error', 'fromFailure']
+__all__ = ['IStatus', 'status', 'error', 'fromFailure', 'Template']
 
 
 STATUS_STATUS = 'status'
@@ -173,3 +177,59 @@ class Status(object):
         d.pop('description', None)
 
         return d
+
+
+
+def _encode_key(key):
+    key = key.encode('utf-8')
+
+    return struct.pack('>H', len(key)) + key
+
+
+
+class Template(object):
+    """
+    The AMF0 encoding of a status object of which only the description and the
+    extra context change. The level and the code are encoded once, in the
+    order that the Flash Player expects (see L{Status}).
+
+    @ivar prefix: The encoding of the start of the object, up to the value of
+        the description.
+    """
+
+    #: Marks the end of an AMF0 object.
+    END = '\x00\x00\x09'
+
+
+    def __init__(self, level, code):
+        # prevent circular import
+        from rtmpy import exc
+
+        code = exc.codeByClass(code) or code
+
+        self.level = level
+        self.code = code
+        self.prefix = ''.join([
+            '\x03',
+            _encode_key('level'), message.encode_amf0(level),
+            _encode_key('code'), message.encode_amf0(code),
+            _encode_key('description')
+        ])
+
+
+    def encode(self, description, **kwargs):
+        """
+        Returns the encoded status object. The extra context in C{kwargs} is
+        encoded in key order.
+
+        @rtype: L{message.Fragment}
+        """
+        parts = [self.prefix, message.encode_amf0(description)]
+
+        for key in sorted(kwargs):
+            parts.append(_encode_key(key))
+            parts.append(message.encode_amf0(kwargs[key]))
+
+        parts.append(self.END)
+
+        return message.Fragment(''.join(parts))
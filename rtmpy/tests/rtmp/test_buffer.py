@@ -0,0 +1,226 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.protocol.rtmp.buffer}.
+"""
+
+from twisted.trial import unittest
+from zope.interface.verify import verifyObject
+
+from rtmpy.protocol import interfaces
+from rtmpy.protocol.rtmp import buffer, codec
+
+
+class ByteArrayBufferTestCase(unittest.TestCase):
+    """
+    Tests for L{buffer.ByteArrayBuffer}.
+    """
+
+    def setUp(self):
+        self.buf = buffer.ByteArrayBuffer(compactThreshold=4)
+
+    def test_interface(self):
+        self.assertTrue(verifyObject(interfaces.IByteBuffer, self.buf))
+
+    def test_init(self):
+        buf = buffer.ByteArrayBuffer('foo')
+
+        self.assertEqual(buf.getvalue(), 'foo')
+        self.assertEqual(buf.tell(), 0)
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(buf.compactThreshold, buffer.COMPACT_THRESHOLD)
+
+    def test_read(self):
+        self.buf.append('foobar')
+
+        self.assertEqual(self.buf.read(3), 'foo')
+        self.assertEqual(self.buf.tell(), 3)
+        self.assertEqual(self.buf.remaining(), 3)
+        self.assertRaises(IOError, self.buf.read, 4)
+        self.assertEqual(self.buf.tell(), 3)
+        self.assertEqual(self.buf.read(), 'bar')
+        self.assertTrue(self.buf.at_eof())
+        self.assertRaises(IOError, self.buf.read)
+
+    def test_peek(self):
+        self.buf.append('foo')
+
+        self.assertEqual(self.buf.peek(2), 'fo')
+        self.assertEqual(self.buf.peek(10), 'foo')
+        self.assertEqual(self.buf.peek(-1), 'foo')
+        self.assertEqual(self.buf.tell(), 0)
+
+    def test_seek(self):
+        self.buf.append('foobar')
+
+        self.buf.seek(2)
+        self.assertEqual(self.buf.tell(), 2)
+
+        self.buf.seek(1, 1)
+        self.assertEqual(self.buf.tell(), 3)
+
+        self.buf.seek(-1, 2)
+        self.assertEqual(self.buf.read(), 'r')
+
+        self.assertRaises(IOError, self.buf.seek, -1)
+
+    def test_write(self):
+        self.buf.write('foobar')
+        self.assertEqual(self.buf.tell(), 6)
+
+        self.buf.seek(3)
+        self.buf.write('BA')
+        self.assertEqual(self.buf.getvalue(), 'fooBAr')
+
+        self.buf.write('ZZZ')
+        self.assertEqual(self.buf.getvalue(), 'fooBAZZZ')
+
+        self.buf.seek(10)
+        self.buf.write('x')
+        self.assertEqual(self.buf.getvalue(), 'fooBAZZZ\x00\x00x')
+
+    def test_append(self):
+        self.buf.append('foo')
+        self.buf.read(1)
+        self.buf.append(bytearray('bar'))
+        self.buf.append(buffer.ByteArrayBuffer('baz'))
+
+        self.assertEqual(self.buf.tell(), 1)
+        self.assertEqual(self.buf.getvalue(), 'foobarbaz')
+
+    def test_consume(self):
+        self.buf.append('foobar')
+        self.buf.read(2)
+        self.buf.consume()
+
+        # below the threshold, only the offset moves
+        self.assertEqual(self.buf.start, 2)
+        self.assertEqual(self.buf.tell(), 0)
+        self.assertEqual(self.buf.getvalue(), 'obar')
+        self.assertEqual(len(self.buf), 4)
+
+        self.buf.read(3)
+        self.buf.consume()
+
+        self.assertEqual(self.buf.start, 0)
+        self.assertEqual(self.buf.buf, bytearray('r'))
+        self.assertEqual(self.buf.getvalue(), 'r')
+
+        self.assertRaises(IOError, self.buf.seek, -1, 1)
+
+    def test_consume_all(self):
+        self.buf.append('foo')
+        self.buf.read(2)
+        self.buf.consume()
+        self.buf.read()
+        self.buf.consume()
+
+        self.assertEqual(self.buf.buf, bytearray())
+        self.assertEqual(self.buf.start, 0)
+        self.assertEqual(self.buf.tell(), 0)
+
+    def test_truncate(self):
+        self.buf.append('foobar')
+        self.buf.read(1)
+        self.buf.consume()
+        self.buf.seek(4)
+        self.buf.truncate(2)
+
+        self.assertEqual(self.buf.getvalue(), 'oo')
+        self.assertEqual(self.buf.tell(), 2)
+
+        self.buf.truncate()
+
+        self.assertEqual(self.buf.getvalue(), '')
+        self.assertEqual(self.buf.tell(), 0)
+
+    def test_typed(self):
+        self.buf.write_uchar(3)
+        self.buf.write_24bit_uint(0x123456)
+        self.buf.endian = '<'
+        self.buf.write_ulong(1)
+        self.buf.endian = '!'
+
+        self.assertEqual(self.buf.getvalue(),
+            '\x03\x12\x34\x56\x01\x00\x00\x00')
+
+        self.buf.seek(0)
+
+        self.assertEqual(self.buf.read_uchar(), 3)
+        self.assertEqual(self.buf.read_24bit_uint(), 0x123456)
+        self.assertRaises(IOError, self.buf.read_double)
+
+
+class SegmentBufferTestCase(unittest.TestCase):
+    """
+    Tests for L{buffer.SegmentBuffer}.
+    """
+
+    def setUp(self):
+        self.buf = buffer.SegmentBuffer()
+
+    def test_interface(self):
+        self.assertTrue(verifyObject(interfaces.ISegmentBuffer, self.buf))
+
+    def test_write(self):
+        payload = 'a' * 128
+
+        self.buf.write_uchar(3)
+        self.buf.write_24bit_uint(0)
+        self.buf.write('')
+        self.buf.write(payload)
+        self.buf.write('\xc3')
+
+        self.assertEqual(self.buf.getSegments(), ['\x03\x00\x00\x00', payload,
+            '\xc3'])
+        self.assertIdentical(self.buf.getSegments()[1], payload)
+        self.assertEqual(len(self.buf), 133)
+        self.assertEqual(self.buf.tell(), 133)
+        self.assertEqual(self.buf.getvalue(), '\x03\x00\x00\x00' + payload +
+            '\xc3')
+
+    def test_consume(self):
+        self.buf.write('foo')
+        self.buf.consume()
+
+        self.assertEqual(self.buf.getSegments(), [])
+        self.assertEqual(len(self.buf), 0)
+
+    def test_truncate(self):
+        self.buf.write('foo')
+
+        self.assertRaises(IOError, self.buf.truncate, 1)
+
+        self.buf.truncate()
+
+        self.assertEqual(self.buf.getvalue(), '')
+
+
+class CodecTestCase(unittest.TestCase):
+    """
+    Tests for selecting the buffer used by L{codec.Codec}.
+    """
+
+    def test_buffer_class(self):
+        class ByteArrayCodec(codec.Codec):
+            buffer_class = buffer.ByteArrayBuffer
+
+        self.assertIsInstance(ByteArrayCodec().stream, buffer.ByteArrayBuffer)
+
+    def test_empty_stream(self):
+        stream = buffer.ByteArrayBuffer()
+
+        self.assertIdentical(codec.Codec(stream).stream, stream)
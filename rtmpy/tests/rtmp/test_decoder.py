@@ -21,7 +21,7 @@ from twisted.trial import unittest
 
 from pyamf.util import BufferedByteStream
 
-from rtmpy.protocol.rtmp import codec, header
+from rtmpy.protocol.rtmp import codec, header, buffer
 
 
 class MockChannel(object):
@@ -253,6 +253,35 @@ class FrameReaderTestCase(unittest.TestCase):
         self.assertEqual(meta.timestamp, 100)
 
 
+class StructHeadersFrameReaderTestCase(FrameReaderTestCase):
+    """
+    Tests for L{codec.FrameReader} using the C{struct} based header codec.
+    """
+
+    def setUp(self):
+        FrameReaderTestCase.setUp(self)
+
+        self.reader.structHeaders = True
+
+    def test_partial_header(self):
+        self.stream.append('\x03\x00\x00')
+
+        self.assertRaises(IOError, self.reader.readFrame)
+        self.assertEqual(self.stream.tell(), 0)
+        self.assertEqual(self.reader.bytes, 0)
+
+
+class ByteArrayBufferFrameReaderTestCase(FrameReaderTestCase):
+    """
+    Tests for L{codec.FrameReader} reading from a L{buffer.ByteArrayBuffer}.
+    """
+
+    def setUp(self):
+        self.reader = codec.FrameReader(buffer.ByteArrayBuffer())
+        self.channels = self.reader.channels
+        self.stream = self.reader.stream
+
+
 class DeMuxerTestCase(unittest.TestCase):
     """
     Tests for L{codec.DeMuxer}
@@ -273,18 +302,64 @@ class DeMuxerTestCase(unittest.TestCase):
         self.assertEqual(self.demuxer.bucket, {})
 
     def test_iterate(self):
-        meta = ChannelMeta(channelId=1)
+        meta = ChannelMeta(channelId=1, bodyLength=9)
 
         self.add_events(
             ('foo', False, meta), ('bar', False, meta), ('baz', True, meta))
 
         self.assertEqual(self.demuxer.readFrame(), (None, None))
-        self.assertEqual(self.demuxer.bucket, {1: 'foo'})
+        buf = self.demuxer.bucket[1]
+        self.assertEqual(buf.data, 'foo\x00\x00\x00\x00\x00\x00')
+        self.assertEqual(buf.pos, 3)
+
+        self.assertEqual(self.demuxer.readFrame(), (None, None))
+        self.assertIdentical(self.demuxer.bucket[1], buf)
+        self.assertEqual(buf.pos, 6)
+
+        data, m = self.demuxer.readFrame()
+
+        self.assertIdentical(m, meta)
+        self.assertEqual(data, 'foobarbaz')
+        self.assertEqual(type(data), str)
+        self.assertEqual(self.demuxer.bucket, {})
+
+    def test_overrun(self):
+        """
+        Frames that are longer than the body length of the message are a
+        L{codec.DecodeError}.
+        """
+        meta = ChannelMeta(channelId=1, bodyLength=4)
+
+        self.add_events(('foo', False, meta), ('bar', True, meta))
 
         self.assertEqual(self.demuxer.readFrame(), (None, None))
-        self.assertEqual(self.demuxer.bucket, {1: 'foobar'})
+        self.assertRaises(codec.DecodeError, self.demuxer.readFrame)
+        self.assertEqual(self.demuxer.bucket, {})
+
+    def test_single_frame(self):
+        """
+        A message that fits in one frame is returned without being buffered.
+        """
+        meta = ChannelMeta(channelId=1, bodyLength=3)
+        data = 'foo'
+
+        self.add_events((data, True, meta))
 
-        self.assertEqual(self.demuxer.readFrame(), ('foobarbaz', meta))
+        self.assertEqual(self.demuxer.readFrame(), (data, meta))
+        self.assertEqual(self.demuxer.bucket, {})
+
+    def test_interleaved(self):
+        meta1 = ChannelMeta(channelId=1, bodyLength=4)
+        meta2 = ChannelMeta(channelId=2, bodyLength=4)
+
+        self.add_events(
+            ('ab', False, meta1), ('12', False, meta2), ('cd', True, meta1),
+            ('34', True, meta2))
+
+        self.assertEqual(self.demuxer.readFrame(), (None, None))
+        self.assertEqual(self.demuxer.readFrame(), (None, None))
+        self.assertEqual(self.demuxer.readFrame(), ('abcd', meta1))
+        self.assertEqual(self.demuxer.readFrame(), ('1234', meta2))
         self.assertEqual(self.demuxer.bucket, {})
 
 
@@ -395,3 +470,102 @@ class BytesIntervalTestCase(unittest.TestCase):
         self.assertEqual(self.decoder.bytes, 12)
         self.assertEqual(self.dispatcher.intervals, [12])
 
+
+
+class DecodeAllTestCase(unittest.TestCase):
+    """
+    Tests for L{codec.Decoder.decodeAll}
+    """
+
+    def setUp(self):
+        self.dispatcher = DispatchTester(self)
+        self.stream_factory = MockStreamFactory(self)
+        self.decoder = codec.Decoder(self.dispatcher, self.stream_factory)
+        self.stream = MockStream()
+
+    def getStream(self, streamId):
+        return self.stream
+
+    def encode(self, channelId, datatype, data):
+        buf = BufferedByteStream()
+        h = header.Header(channelId, datatype=datatype, bodyLength=len(data),
+            streamId=0, timestamp=0)
+        size = self.decoder.frameSize
+
+        header.encode(buf, h)
+        buf.write(data[:size])
+
+        for i in xrange(size, len(data), size):
+            header.encode(buf, h, h)
+            buf.write(data[i:i + size])
+
+        return buf.getvalue()
+
+    def write(self, channelId, datatype, data):
+        self.decoder.send(self.encode(channelId, datatype, data))
+
+    def test_empty(self):
+        self.assertEqual(self.decoder.decodeAll(), [])
+        self.assertEqual(self.dispatcher.messages, [])
+
+    def test_dispatch(self):
+        self.write(3, 20, 'foo')
+        self.write(4, 18, 'b' * 300)
+
+        messages = self.decoder.decodeAll()
+
+        self.assertEqual(messages, [
+            (self.stream, 20, 0, 'foo'),
+            (self.stream, 18, 0, 'b' * 300)
+        ])
+        self.assertEqual(self.dispatcher.messages, messages)
+        self.assertEqual(self.decoder.stream.getvalue(), '')
+
+    def test_partial(self):
+        self.write(3, 20, 'foo')
+        self.decoder.send(self.encode(4, 18, 'bar')[:5])
+
+        self.assertEqual(self.decoder.decodeAll(), [(self.stream, 20, 0, 'foo')])
+        self.assertEqual(self.decoder.stream.getvalue(), '\x06\x00\x00\x00\x00')
+
+    def test_no_dispatch(self):
+        self.failOnDispatch = True
+
+        self.write(3, 20, 'foo')
+
+        self.assertEqual(self.decoder.decodeAll(False),
+            [(self.stream, 20, 0, 'foo')])
+
+    def test_stop_on_frame_size(self):
+        self.failOnDispatch = True
+
+        self.write(0, 1, '\x00\x00\x01\x00')
+        self.write(3, 20, 'foo')
+
+        self.assertEqual(self.decoder.decodeAll(False),
+            [(self.stream, 1, 0, '\x00\x00\x01\x00')])
+        self.assertEqual(self.decoder.decodeAll(False),
+            [(self.stream, 20, 0, 'foo')])
+
+    def test_interval(self):
+        self.decoder.setBytesInterval(8)
+
+        self.write(3, 20, 'foo')
+        self.write(3, 20, 'bar')
+
+        self.decoder.decodeAll()
+
+        self.assertEqual(self.dispatcher.intervals, [15, 30])
+
+
+
+class ByteArrayBufferDecodeAllTestCase(DecodeAllTestCase):
+    """
+    Tests for L{codec.Decoder.decodeAll} with a L{buffer.ByteArrayBuffer}.
+    """
+
+    def setUp(self):
+        DecodeAllTestCase.setUp(self)
+
+        self.decoder = codec.Decoder(self.dispatcher, self.stream_factory,
+            stream=buffer.ByteArrayBuffer(compactThreshold=16))
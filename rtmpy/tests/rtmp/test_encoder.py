@@ -19,9 +19,11 @@ Encoding tests for L{rtmpy.protocol.rtmp.codec}.
 
 import unittest
 
+from twisted.internet import defer, task
+from twisted.internet.interfaces import IPushProducer
 from pyamf.util import BufferedByteStream
 
-from rtmpy.protocol.rtmp import codec
+from rtmpy.protocol.rtmp import codec, buffer, pacer
 from rtmpy import message
 
 
@@ -51,12 +53,12 @@ class EncoderTestCase(BaseTestCase):
 
         self.encoder.send('bar', 12, 2, 3)
 
-        self.assertEqual(self.encoder.pending, [('bar', 12, 2, 3, None)])
+        self.assertEqual(list(self.encoder.pending), [('bar', 12, 2, 3, None)])
 
         self.encoder.channelsInUse -= 1
         self.encoder.next()
 
-        self.assertEqual(self.encoder.pending, [])
+        self.assertEqual(list(self.encoder.pending), [])
 
 
 class AquireChannelTestCase(BaseTestCase):
@@ -213,6 +215,598 @@ class WritingTestCase(BaseTestCase):
         self.assertTrue(self.output.at_eof())
 
 
+class SchedulingTestCase(BaseTestCase):
+    """
+    Tests for the order in which frames are encoded from the active channels.
+    """
+
+    def readFrames(self):
+        """
+        Returns the channel id of each frame in C{output}. All frames are
+        expected to be 10 bytes long.
+        """
+        self.output.seek(0)
+        ids = []
+
+        while not self.output.at_eof():
+            b = self.output.read_uchar()
+            ids.append(b & 0x3f)
+            self.output.seek([11, 7, 3, 0][b >> 6] + 10, 1)
+
+        self.output.consume()
+
+        return ids
+
+    def test_round_robin(self):
+        self.encoder.setFrameSize(10)
+
+        self.encoder.send('a' * 30, 8, 1, 0)
+        self.encoder.send('b' * 10, 8, 1, 0)
+        self.encoder.send('c' * 20, 9, 1, 0)
+
+        self.encoder.next()
+        self.assertEqual(self.readFrames(), [3, 4, 5])
+
+        self.encoder.next()
+        self.assertEqual(self.readFrames(), [3, 5])
+
+        self.encoder.next()
+        self.assertEqual(self.readFrames(), [3])
+
+        self.assertFalse(self.encoder.active)
+        self.assertRaises(StopIteration, self.encoder.next)
+
+    def test_priority(self):
+        self.encoder.setFrameSize(10)
+
+        self.encoder.send('a' * 20, 8, 1, 0)
+        self.encoder.send('b' * 30, message.INVOKE, 1, 0)
+
+        self.assertTrue(self.encoder.active)
+        self.encoder.next()
+
+        self.assertEqual(self.readFrames(), [4, 4, 4, 3])
+        self.assertEqual(list(self.encoder.priorityChannels), [])
+
+    def test_quota(self):
+        self.encoder.setFrameSize(10)
+        self.encoder.quota = 30
+
+        self.encoder.send('a' * 40, 8, 1, 0)
+        self.encoder.send('b' * 40, 9, 1, 0)
+
+        self.encoder.next()
+        # 22 + 22 bytes
+        self.assertEqual(self.readFrames(), [3, 4])
+
+        self.encoder.quota = 40
+        self.encoder.next()
+        # 11 + 11 + 11 + 11 bytes
+        self.assertEqual(self.readFrames(), [3, 4, 3, 4])
+
+        self.encoder.next()
+        self.assertEqual(self.readFrames(), [3, 4])
+        self.assertFalse(self.encoder.active)
+
+    def test_pending_order(self):
+        self.encoder.channelsInUse = codec.MAX_CHANNELS
+
+        self.encoder.send('a', 8, 1, 0)
+        self.encoder.send('b', 8, 1, 0)
+
+        self.encoder.channelsInUse -= 1
+        self.encoder.next()
+
+        self.assertEqual(list(self.encoder.pending), [('b', 8, 1, 0, None)])
+
+
+class SendMessageTestCase(BaseTestCase):
+    """
+    Tests for L{codec.ChannelMuxer.sendMessage}, which encodes messages
+    straight into the payload buffer of a channel.
+    """
+
+    def encode(self, msg):
+        buf = BufferedByteStream()
+        msg.encode(buf)
+
+        return buf.getvalue()
+
+    def sendBoth(self, msg):
+        """
+        Returns what C{msg} is encoded to with L{codec.Encoder.sendMessage}
+        and with L{codec.Encoder.send}.
+        """
+        results = []
+
+        for send in (self.encoder.sendMessage, None):
+            output = BufferedByteStream()
+            encoder = codec.Encoder(output)
+
+            if send is None:
+                encoder.send(self.encode(msg), msg.__data_type__, 1, 0)
+            else:
+                encoder.sendMessage(msg, 1, 0)
+
+            while True:
+                try:
+                    encoder.next()
+                except StopIteration:
+                    break
+
+            results.append(output.getvalue())
+
+        return results
+
+    def test_single_frame(self):
+        a, b = self.sendBoth(message.Invoke('foo', 1, None, 'bar'))
+
+        self.assertEqual(a, b)
+
+    def test_multiple_frames(self):
+        a, b = self.sendBoth(message.Invoke('foo', 1, None, 'x' * 400))
+
+        self.assertEqual(a, b)
+
+    def test_command(self):
+        self.encoder.sendMessage(message.BytesRead(16), 0, 8)
+
+        self.assertEqual(self.output.getvalue(),
+            '\x02\x00\x00\x08\x00\x00\x04\x03\x00\x00\x00\x00'
+            '\x00\x00\x00\x10')
+
+    def test_reuse_buffer(self):
+        msg = message.Invoke('foo', 1, None, 'bar')
+
+        self.encoder.sendMessage(msg, 1, 0)
+        channel = self.encoder.getChannel(1)
+        buf = channel.messageBuffer
+
+        self.assertIdentical(channel.payload, buf)
+        self.assertEqual(buf.getvalue(), self.encode(msg))
+
+        self.encoder.next()
+
+        self.assertEqual(channel.payload, '')
+        self.assertEqual(len(buf), 0)
+
+        self.encoder.sendMessage(msg, 1, 0)
+
+        self.assertIdentical(self.encoder.getChannel(1).messageBuffer, buf)
+
+    def test_encode_error(self):
+        self.assertRaises(message.EncodeError, self.encoder.sendMessage,
+            message.UpstreamBandwidth(), 1, 0)
+        self.assertRaises(message.EncodeError, self.encoder.sendMessage,
+            message.ControlMessage(0, 'foo'), 0, 0)
+
+        self.assertEqual(self.encoder.channelsInUse, 0)
+        self.assertEqual(self.encoder.backlog, 0)
+
+        self.encoder.sendMessage(message.BytesRead(16), 0, 8)
+
+        self.assertEqual(self.output.getvalue()[-4:], '\x00\x00\x00\x10')
+
+    def test_pending(self):
+        self.encoder.channelsInUse = codec.MAX_CHANNELS
+
+        msg = message.Invoke('foo', 1, None, 'bar')
+        self.encoder.sendMessage(msg, 1, 2)
+
+        self.assertEqual(list(self.encoder.pending),
+            [(self.encode(msg), message.INVOKE, 1, 2, None)])
+
+
+
+class StructHeadersWritingTestCase(WritingTestCase):
+    """
+    Tests for writing RTMP frames using the C{struct} based header codec.
+    """
+
+    def setUp(self):
+        WritingTestCase.setUp(self)
+
+        self.encoder.structHeaders = True
+
+
+class ByteArrayBufferWritingTestCase(WritingTestCase):
+    """
+    Tests for writing RTMP frames through a L{buffer.ByteArrayBuffer}.
+    """
+
+    def setUp(self):
+        self.output = BufferedByteStream()
+        self.encoder = codec.Encoder(self.output,
+            stream=buffer.ByteArrayBuffer())
+
+
+class SequenceOutput(object):
+    """
+    Records the calls to C{writeSequence}.
+    """
+
+    def __init__(self):
+        self.sequences = []
+
+    def writeSequence(self, data):
+        self.sequences.append(list(data))
+
+    def getvalue(self):
+        return ''.join([''.join(s) for s in self.sequences])
+
+
+class VectoredWritingTestCase(WritingTestCase):
+    """
+    Tests for writing RTMP frames through a L{buffer.SegmentBuffer}.
+    """
+
+    def setUp(self):
+        self.output = BufferedByteStream()
+        self.encoder = codec.Encoder(self.output,
+            stream=buffer.SegmentBuffer())
+
+    def test_vectored(self):
+        self.assertTrue(self.encoder.vectored)
+
+    def test_write_sequence(self):
+        output = SequenceOutput()
+        payload = 'a' * 128 + 'b' * 2
+
+        self.encoder = codec.Encoder(output, stream=buffer.SegmentBuffer())
+        self.encoder.send(payload, 9, 1, 0)
+        self.encoder.next()
+        self.encoder.next()
+
+        self.assertEqual(output.sequences, [[
+            '\x03\x00\x00\x00\x00\x00\x82\x09\x01\x00\x00\x00',
+            'a' * 128,
+        ], ['\xc3bb']])
+        self.assertEqual(self.encoder.bytes, 143)
+        self.assertEqual(self.encoder.stream.getSegments(), [])
+
+    def test_single_frame_payload(self):
+        output = SequenceOutput()
+        payload = 'a' * 100
+
+        self.encoder = codec.Encoder(output, stream=buffer.SegmentBuffer())
+        self.encoder.send(payload, 9, 1, 0)
+        self.encoder.next()
+
+        self.assertIdentical(output.sequences[0][1], payload)
+
+
+class StreamingChannelTestCase(unittest.TestCase):
+    """
+    Tests for L{codec.StreamingChannel}.
+    """
+
+    def setUp(self):
+        self.output = SequenceOutput()
+        self.encoder = codec.Encoder(BufferedByteStream())
+        self.channel = codec.StreamingChannel(self.encoder.acquireChannel(),
+            1, self.output)
+        self.channel.setType(9)
+
+    def test_send(self):
+        self.channel.sendData('a' * 128 + 'b' * 2, 10)
+
+        self.assertEqual(self.output.sequences, [[
+            '\x03\x00\x00\x0a\x00\x00\x82\x09\x01\x00\x00\x00',
+            'a' * 128,
+            '\xc3bb'
+        ]])
+
+        self.channel.sendData('c', 20)
+
+        self.assertEqual(self.output.sequences[1],
+            ['\x43\x00\x00\x0a\x00\x00\x01\x09c'])
+
+    def test_prepared(self):
+        data = 'a' * 128 + 'b' * 2
+        output = SequenceOutput()
+        encoder = codec.Encoder(BufferedByteStream())
+        channel = codec.StreamingChannel(encoder.acquireChannel(), 1, output)
+        channel.setType(9)
+
+        prepared = codec.PreparedMessage(data)
+
+        self.channel.sendData(data, 10)
+        channel.sendData(prepared, 10)
+
+        self.assertEqual(output.getvalue(), self.output.getvalue())
+        self.assertIdentical(output.sequences[0][1],
+            prepared.getFrames(128, 1)[0])
+
+        self.channel.sendData('c', 20)
+        channel.sendData(codec.PreparedMessage('c'), 20)
+
+        self.assertEqual(output.getvalue(), self.output.getvalue())
+
+
+class ProducerTestCase(BaseTestCase):
+    """
+    Tests for L{codec.Encoder} as an C{IPushProducer}.
+    """
+
+    def test_interface(self):
+        self.assertTrue(IPushProducer.providedBy(self.encoder))
+
+    def test_pause(self):
+        self.encoder.send('foo', 8, 1, 0)
+        self.encoder.pauseProducing()
+
+        self.assertTrue(self.encoder.paused)
+
+        d = self.encoder.next()
+
+        self.assertTrue(isinstance(d, defer.Deferred))
+        self.assertIdentical(self.encoder.next(), d)
+        self.assertEqual(self.output.getvalue(), '')
+
+        self.encoder.resumeProducing()
+
+        self.assertTrue(d.called)
+        self.assertFalse(self.encoder.paused)
+
+        self.encoder.next()
+        self.assertNotEqual(self.output.getvalue(), '')
+
+    def test_stop(self):
+        self.encoder.send('foo', 8, 1, 0)
+        self.encoder.pauseProducing()
+
+        d = self.encoder.next()
+
+        self.encoder.stopProducing()
+
+        self.assertTrue(d.called)
+        self.assertRaises(StopIteration, self.encoder.next)
+
+    def test_watermarks(self):
+        self.encoder.setFrameSize(10)
+        self.encoder.highWatermark = 30
+        self.encoder.lowWatermark = 10
+
+        self.encoder.send('a' * 20, 8, 1, 0)
+        self.assertFalse(self.encoder.congested)
+
+        self.encoder.send('b' * 20, 8, 1, 0)
+        self.assertEqual(self.encoder.backlog, 40)
+        self.assertTrue(self.encoder.congested)
+        self.assertTrue(self.encoder.paused)
+
+        self.encoder.next()
+        self.assertEqual(self.encoder.backlog, 40)
+        self.assertTrue(self.encoder.congested)
+
+        self.encoder.next()
+        self.assertEqual(self.encoder.backlog, 0)
+        self.assertFalse(self.encoder.congested)
+
+    def test_streaming_channel(self):
+        channel = codec.StreamingChannel(self.encoder.acquireChannel(), 1,
+            self.output, self.encoder)
+
+        self.assertFalse(channel.paused)
+
+        self.encoder.pauseProducing()
+        self.assertTrue(channel.paused)
+
+        channel = codec.StreamingChannel(self.encoder.acquireChannel(), 1,
+            self.output)
+
+        self.assertFalse(channel.paused)
+
+    def test_streaming_backlog(self):
+        """
+        Data written by a L{codec.StreamingChannel} while the output is paused
+        is held by the encoder and counted in its backlog.
+        """
+        self.encoder.highWatermark = 30
+        self.encoder.lowWatermark = 10
+
+        output = SequenceOutput()
+        channel = codec.StreamingChannel(self.encoder.acquireChannel(), 1,
+            output, self.encoder)
+        channel.setType(9)
+
+        channel.sendData('a' * 20, 0)
+
+        self.assertEqual(len(output.sequences), 1)
+        self.assertEqual(self.encoder.backlog, 0)
+
+        self.encoder.pauseProducing()
+
+        channel.sendData('b' * 20, 10)
+        self.assertFalse(self.encoder.congested)
+
+        channel.sendData('c' * 20, 20)
+
+        self.assertEqual(len(output.sequences), 1)
+        self.assertEqual(self.encoder.backlog,
+            sum([size for _, _, size in self.encoder.delayed]))
+        self.assertTrue(self.encoder.congested)
+
+        self.encoder.resumeProducing()
+
+        self.assertEqual(len(output.sequences), 3)
+        self.assertEqual(self.encoder.backlog, 0)
+        self.assertFalse(self.encoder.congested)
+        self.assertFalse(channel.paused)
+
+    def test_stop_streaming_backlog(self):
+        channel = codec.StreamingChannel(self.encoder.acquireChannel(), 1,
+            SequenceOutput(), self.encoder)
+        channel.setType(9)
+
+        self.encoder.pauseProducing()
+        channel.sendData('a' * 20, 0)
+
+        self.encoder.stopProducing()
+
+        self.assertEqual(len(self.encoder.delayed), 0)
+        self.assertEqual(self.encoder.backlog, 0)
+
+
+class PacingTestCase(BaseTestCase):
+    """
+    Tests for limiting the rate of an L{codec.Encoder} with a
+    L{pacer.TokenBucket}.
+    """
+
+    def setUp(self):
+        BaseTestCase.setUp(self)
+
+        self.clock = task.Clock()
+        self.bucket = pacer.TokenBucket(1000, 10, self.clock)
+        self.encoder.setBucket(self.bucket)
+
+    def test_limit(self):
+        self.encoder.setFrameSize(10)
+        self.encoder.send('a' * 40, 8, 1, 0)
+
+        self.encoder.next()
+
+        self.assertEqual(self.bucket.tokens, 10 - len(self.output.getvalue()))
+        self.assertTrue(self.bucket.limited)
+        self.assertFalse(self.encoder.paused)
+
+        d = self.encoder.next()
+
+        self.assertTrue(isinstance(d, defer.Deferred))
+        self.assertIdentical(self.encoder.next(), d)
+
+        self.clock.advance(self.bucket.getDelay())
+
+        self.assertTrue(d.called)
+        self.assertFalse(self.bucket.limited)
+
+        sent = len(self.output.getvalue())
+
+        self.encoder.next()
+        self.assertTrue(len(self.output.getvalue()) > sent)
+
+    def test_unlimit(self):
+        self.encoder.send('a' * 20, 8, 1, 0)
+        self.encoder.next()
+
+        d = self.encoder.next()
+
+        self.encoder.setBucket(None)
+
+        self.assertTrue(d.called)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_stop(self):
+        self.encoder.send('a' * 20, 8, 1, 0)
+        self.encoder.next()
+
+        d = self.encoder.next()
+
+        self.encoder.stopProducing()
+
+        self.assertTrue(d.called)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_streaming_channel(self):
+        output = SequenceOutput()
+        channel = codec.StreamingChannel(self.encoder.acquireChannel(), 1,
+            output, self.encoder)
+        channel.setType(9)
+
+        channel.sendData('a' * 20, 0)
+
+        sent = len(output.getvalue())
+
+        self.assertEqual(self.bucket.tokens, 10 - sent)
+
+        # a large frame puts the bucket in debt, that is not congestion
+        self.assertTrue(self.bucket.limited)
+        self.assertFalse(channel.paused)
+
+        channel.sendData('b' * 20, 10)
+        channel.sendData('c' * 20, 20)
+
+        self.assertEqual(len(output.getvalue()), sent)
+        self.assertEqual(len(self.encoder.delayed), 2)
+        self.assertEqual(self.encoder.backlog,
+            sum([size for _, _, size in self.encoder.delayed]))
+        self.assertFalse(channel.paused)
+
+        self.clock.advance(self.bucket.getDelay())
+
+        self.assertEqual(len(self.encoder.delayed), 1)
+        self.assertEqual(len(output.sequences), 2)
+
+        self.clock.advance(self.bucket.getDelay())
+
+        self.assertEqual(len(self.encoder.delayed), 0)
+        self.assertEqual(self.encoder.backlog, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertTrue(output.getvalue().endswith('c' * 20))
+
+    def test_delayed_congestion(self):
+        self.encoder.highWatermark = 30
+        self.encoder.lowWatermark = 10
+
+        output = SequenceOutput()
+        channel = codec.StreamingChannel(self.encoder.acquireChannel(), 1,
+            output, self.encoder)
+        channel.setType(9)
+
+        for i in xrange(3):
+            channel.sendData('a' * 20, i)
+
+        self.assertTrue(self.encoder.congested)
+        self.assertTrue(channel.paused)
+
+        while self.encoder.delayed:
+            self.clock.advance(self.bucket.getDelay())
+
+        self.assertFalse(self.encoder.congested)
+        self.assertFalse(channel.paused)
+
+    def test_unlimit_delayed(self):
+        output = SequenceOutput()
+        channel = codec.StreamingChannel(self.encoder.acquireChannel(), 1,
+            output, self.encoder)
+        channel.setType(9)
+
+        channel.sendData('a' * 20, 0)
+        channel.sendData('b' * 20, 10)
+
+        self.encoder.setBucket(None)
+
+        self.assertEqual(len(self.encoder.delayed), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertTrue(output.getvalue().endswith('b' * 20))
+
+
+
+class PreparedMessageTestCase(unittest.TestCase):
+    """
+    Tests for L{codec.PreparedMessage}.
+    """
+
+    def test_str(self):
+        m = codec.PreparedMessage('foo')
+
+        self.assertEqual(m, 'foo')
+        self.assertEqual(len(m), 3)
+        self.assertEqual(m.frames, {})
+
+    def test_frames(self):
+        m = codec.PreparedMessage('a' * 5 + 'b' * 5 + 'c')
+
+        frames = m.getFrames(5, 3)
+
+        self.assertEqual(frames, ['aaaaa', '\xc5bbbbb', '\xc5c'])
+        self.assertIdentical(m.getFrames(5, 3), frames)
+        self.assertEqual(m.getFrames(5, 4), ['aaaaa', '\xc6bbbbb', '\xc6c'])
+        self.assertEqual(m.getFrames(128, 3), ['aaaaabbbbbc'])
+        self.assertEqual(sorted(m.frames.keys()), [(5, 3), (5, 4), (128, 3)])
+
+
 class TimestampTestCase(BaseTestCase):
     """
     Tests to check for relative or absolute timestamps are encoded properly
@@ -17,11 +17,16 @@
 Tests for L{rtmpy.rtmp.codec.header}.
 """
 
-import unittest
+from twisted.trial import unittest
 
 from rtmpy.protocol.rtmp import header
 from rtmpy import util
 
+try:
+    from rtmpy.protocol.rtmp import _codec
+except ImportError:
+    _codec = None
+
 
 class HeaderTestCase(unittest.TestCase):
     """
@@ -269,6 +274,92 @@ class DecodeTestCase(unittest.TestCase):
         self.assertEqual(h.channelId, 65597)
 
 
+class PackTestCase(EncodeTestCase):
+    """
+    Tests for L{header.pack}
+    """
+
+    def assertEncoded(self, bytes):
+        self.assertEqual(header.pack(self.new, self.old), bytes)
+
+    def test_no_previous(self):
+        self.old = None
+
+        self.assertEncoded('\x02\x00\x00\x03\x00\x00\x05\x04\x06\x00\x00\x00')
+
+    def test_extended_timestamp_full(self):
+        self.old = None
+        self.new.channelId = 318
+        self.new.timestamp = 0x1000000
+
+        self.assertEncoded('\x01\x00\x01\xff\xff\xff\x00\x00\x05\x04'
+            '\x06\x00\x00\x00\x01\x00\x00\x00')
+
+
+class UnpackFromTestCase(DecodeTestCase):
+    """
+    Tests for L{header.unpack_from}
+    """
+
+    def _decode(self, s):
+        h, size = header.unpack_from(s)
+
+        self.assertEqual(size, len(s))
+
+        return h
+
+    def test_offset(self):
+        data = 'foo\x15\x03\x92\xfa\x00z\n\x03-\x00\x00\x00bar'
+
+        h, size = header.unpack_from(data, 3)
+
+        self.assertEqual(size, 12)
+        self.assertEquals(h.channelId, 19)
+        self.assertEquals(h.timestamp, 234234)
+        self.assertEquals(h.bodyLength, 31242)
+        self.assertEquals(h.datatype, 3)
+        self.assertEquals(h.streamId, 45)
+        self.assertTrue(h.full)
+
+    def test_buffers(self):
+        s = 'U\x03\x92\xfa\x00z\n\x03'
+
+        for data in (buffer(s), bytearray(s), memoryview(s)):
+            h, size = header.unpack_from(data)
+
+            self.assertEqual(size, 8)
+            self.assertEquals(h.channelId, 19)
+            self.assertEquals(h.timestamp, 234234)
+            self.assertEquals(h.bodyLength, 31242)
+            self.assertEquals(h.datatype, 3)
+
+    def test_need_more(self):
+        s = '"\xff\xff\xff\x00z\n\x03-\x00\x00\x00\x01\x00\x00\x00'
+
+        for i in xrange(len(s)):
+            self.assertEqual(header.unpack_from(s[:i]), (None, 0))
+
+        self.assertEqual(header.unpack_from('\xc1\x00'), (None, 0))
+        self.assertEqual(header.unpack_from('\xc0'), (None, 0))
+
+    def test_round_trip(self):
+        old = header.Header(400, 10, 8, 300, 2)
+        new = header.Header(400, 0x1000000, 9, 15, 2)
+
+        for h, previous in ((old, None), (new, old), (old, old)):
+            s = header.pack(h, previous)
+            stream = util.BufferedByteStream(s)
+
+            decoded, size = header.unpack_from(s)
+            expected = header.decode(stream)
+
+            self.assertEqual(size, len(s))
+            self.assertTrue(stream.at_eof())
+
+            for k in header.Header.__slots__:
+                self.assertEqual(getattr(decoded, k), getattr(expected, k))
+
+
 class MergeTestCase(unittest.TestCase):
     """
     Tests for L{header.merge}
@@ -325,3 +416,17 @@ class MergeTestCase(unittest.TestCase):
 
         h = self.merge(streamId=15)
         self.assertEqual(h.streamId, 15)
+
+
+class AcceleratedTestCase(unittest.TestCase):
+    """
+    Tests for the optional C extension L{rtmpy.protocol.rtmp._codec}.
+    """
+
+    def test_replaced(self):
+        self.assertIdentical(header.pack, _codec.pack)
+        self.assertIdentical(header.unpack_from, _codec.unpack_from)
+
+
+if _codec is None:
+    AcceleratedTestCase.skip = 'C extension rtmpy.protocol.rtmp._codec not built'
@@ -0,0 +1,72 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.protocol.rtmp.pacer}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+from rtmpy.protocol.rtmp import pacer
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    """
+    Tests for L{pacer.TokenBucket}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.bucket = pacer.TokenBucket(1000, 100, self.clock)
+
+    def test_burst(self):
+        self.assertEqual(self.bucket.tokens, 100)
+
+        self.bucket.consume(100)
+        self.assertFalse(self.bucket.limited)
+
+        self.bucket.consume(1)
+        self.assertTrue(self.bucket.limited)
+
+    def test_refill(self):
+        self.bucket.consume(150)
+
+        self.assertTrue(self.bucket.limited)
+        self.assertEqual(self.bucket.getDelay(), 0.05)
+
+        self.clock.advance(0.05)
+
+        self.assertFalse(self.bucket.limited)
+        self.assertEqual(self.bucket.getDelay(), 0)
+
+        # never more than the burst allowance
+        self.clock.advance(10)
+        self.bucket.refill()
+
+        self.assertEqual(self.bucket.tokens, 100)
+
+    def test_set_rate(self):
+        self.bucket.consume(100)
+        self.clock.advance(0.05)
+
+        self.bucket.setRate(2000, 20)
+
+        self.assertEqual(self.bucket.tokens, 20)
+        self.assertEqual(self.bucket.rate, 2000)
+
+        self.bucket.consume(40)
+
+        self.assertEqual(self.bucket.getDelay(), 0.01)
@@ -20,7 +20,7 @@ Tests for L{rtmpy.protocol.rtmp}
 """
 
 from twisted.trial import unittest
-from twisted.internet import error, defer, reactor
+from twisted.internet import error, defer, reactor, task
 from twisted.test.proto_helpers import StringTransportWithDisconnection
 
 from rtmpy.protocol import rtmp
@@ -166,17 +166,23 @@ class ConnectionLostTestCase(ProtocolTestCase):
         self.protocol.handshakeSuccess('')
         self.protocol.startDecoding()
 
-        self.assertTrue(hasattr(self.protocol, 'decoder_task'))
+        pump = self.protocol.decoderPump
+        pump.running = True
+
         self.protocol.connectionLost(error.ConnectionDone())
-        self.assertFalse(hasattr(self.protocol, 'decoder_task'))
+        self.assertFalse(hasattr(self.protocol, 'decoderPump'))
+        self.assertFalse(pump.running)
 
     def test_encode_task(self):
         self.protocol.handshakeSuccess('')
         self.protocol.startEncoding()
 
-        self.assertTrue(hasattr(self.protocol, 'encoder_task'))
+        pump = self.protocol.encoderPump
+        pump.running = True
+
         self.protocol.connectionLost(error.ConnectionDone())
-        self.assertFalse(hasattr(self.protocol, 'encoder_task'))
+        self.assertFalse(hasattr(self.protocol, 'encoderPump'))
+        self.assertFalse(pump.running)
 
     def test_inform_application(self):
         self.protocol.handshakeSuccess('')
@@ -186,6 +192,42 @@ class ConnectionLostTestCase(ProtocolTestCase):
 
 
 
+class ProducerTestCase(ProtocolTestCase):
+    """
+    Tests for registering the encoder as a producer with the transport.
+    """
+
+    def setUp(self):
+        ProtocolTestCase.setUp(self)
+
+        self.connect()
+        self.protocol.highWatermark = 1000
+        self.protocol.lowWatermark = 100
+        self.protocol.handshakeSuccess('')
+
+    def test_register(self):
+        self.assertIdentical(self.transport.producer, self.protocol.encoder)
+        self.assertTrue(self.transport.streaming)
+        self.assertEqual(self.transport.bufferSize, 1000)
+
+    def test_watermarks(self):
+        encoder = self.protocol.encoder
+
+        self.assertEqual(encoder.highWatermark, 1000)
+        self.assertEqual(encoder.lowWatermark, 100)
+
+    def test_paused(self):
+        channel = self.protocol.getStreamingChannel(self.protocol)
+
+        self.assertFalse(channel.paused)
+
+        self.transport.producer.pauseProducing()
+        self.assertTrue(channel.paused)
+
+        self.transport.producer.resumeProducing()
+        self.assertFalse(channel.paused)
+
+
 class TestRuntimeError(RuntimeError):
     pass
 
@@ -211,15 +253,11 @@ class CooperateTestCase(ProtocolTestCase):
 
         self.patch(self.protocol.decoder, 'next', boom)
 
-        def eb(f):
-            f.trap(TestRuntimeError)
-
-            self.assertFalse(self.transport.connected)
-            self.flushLoggedErrors(TestRuntimeError)
-
-        d = self.protocol.startDecoding().addErrback(eb)
+        self.protocol.startDecoding()
 
-        return d
+        self.assertFalse(self.transport.connected)
+        self.assertFalse(self.protocol.decoding)
+        self.assertEqual(len(self.flushLoggedErrors(TestRuntimeError)), 1)
 
     def test_fail_encode(self):
         def boom(*args):
@@ -227,26 +265,53 @@ class CooperateTestCase(ProtocolTestCase):
 
         self.patch(self.protocol.encoder, 'next', boom)
 
-        def eb(f):
-            f.trap(TestRuntimeError)
+        self.protocol.startEncoding()
 
-            self.assertFalse(self.transport.connected)
-            self.flushLoggedErrors(TestRuntimeError)
+        self.assertFalse(self.transport.connected)
+        self.assertFalse(self.protocol.encoding)
+        self.assertEqual(len(self.flushLoggedErrors(TestRuntimeError)), 1)
 
-        d = self.protocol.startEncoding().addErrback(eb)
+    def test_resume_decode(self):
+        self.protocol.startDecoding()
 
-        return d
+        self.assertFalse(self.protocol.decoding)
+        self.assertTrue(self.transport.connected)
 
-    def test_resume_decode(self):
-        d = self.protocol.startDecoding()
+        self.protocol.startDecoding()
+
+        self.assertFalse(self.protocol.decoding)
+
+    def test_clock(self):
+        """
+        The pumps yield to C{clock} once a slice has been used up.
+        """
+        clock = task.Clock()
 
-        def resume(res):
-            self.assertTrue(self.transport.connected)
-            return self.protocol.startDecoding()
+        decoder = self.protocol.decoder
 
-        d.addCallback(resume)
+        self.protocol.clock = clock
+        self.protocol.byteSlice = 0
+        self.protocol.decoderPump = self.protocol.buildPump(decoder)
+        calls = []
 
-        return d
+        def next():
+            calls.append(True)
+            decoder.bytes += 1
+
+            if len(calls) == 2:
+                raise StopIteration
+
+        self.patch(decoder, 'next', next)
+
+        self.protocol.startDecoding()
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(self.protocol.decoding)
+
+        clock.advance(0)
+
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(self.protocol.decoding)
 
 
 class DataReceivedTestCase(ProtocolTestCase):
@@ -269,13 +334,37 @@ class DataReceivedTestCase(ProtocolTestCase):
 
         decoder = self.protocol.decoder
 
-        self.assertEqual(self.protocol.decoder_task, None)
         self.protocol.dataReceived('woot')
-        self.assertNotEqual(self.protocol.decoder_task, None)
 
+        # not enough for a header, the data is left in the buffer
+        self.assertFalse(self.protocol.decoding)
         self.assertEqual(decoder.stream.getvalue(), 'woot')
 
-        self.protocol.decoder_task.addErrback(lambda x: None)
+    def test_sync_decode(self):
+        """
+        Input within C{syncDecodeBudget} is decoded without starting a task.
+        """
+        self.connect()
+        self.protocol.handshakeSuccess('')
+        self.protocol.syncDecodeBudget = 64
+
+        decoder = self.protocol.decoder
+        decoded = []
+
+        pumped = []
+
+        self.patch(decoder, 'decodeAll', lambda: decoded.append(True))
+        self.patch(self.protocol, 'startDecoding', lambda: pumped.append(True))
+
+        self.protocol.dataReceived('woot')
+
+        self.assertEqual(decoded, [True])
+        self.assertEqual(pumped, [])
+
+        self.protocol.dataReceived('a' * 64)
+
+        self.assertEqual(decoded, [True])
+        self.assertEqual(pumped, [True])
 
 
 
@@ -349,6 +438,127 @@ class BasicResponseTestCase(ProtocolTestCase):
 
 
 
+class PacingTestCase(ProtocolTestCase):
+    """
+    Tests for limiting the rate at which data is sent to the peer.
+    """
+
+    def setUp(self):
+        ProtocolTestCase.setUp(self)
+
+        self.protocol.clock = task.Clock()
+
+    def stream(self):
+        self.connect()
+        self.protocol.handshakeSuccess('')
+
+        return self.protocol.encoder
+
+    def test_default(self):
+        self.assertEqual(self.stream().bucket, None)
+
+    def test_before_streaming(self):
+        self.protocol.setSendRate(1000)
+
+        bucket = self.stream().bucket
+
+        self.assertEqual((bucket.rate, bucket.burst), (1000, 100))
+        self.assertIdentical(bucket.clock, self.protocol.clock)
+
+    def test_change(self):
+        encoder = self.stream()
+
+        self.protocol.setSendRate(1000, 500)
+        bucket = encoder.bucket
+
+        self.protocol.setSendRate(2000, 50)
+
+        self.assertIdentical(encoder.bucket, bucket)
+        self.assertEqual((bucket.rate, bucket.burst), (2000, 50))
+
+        self.protocol.setSendRate(None)
+
+        self.assertEqual(encoder.bucket, None)
+
+    def test_peer_bandwidth(self):
+        encoder = self.stream()
+        self.protocol.setSendRate(1000)
+
+        # a dynamic limit is ignored unless the current limit is hard
+        self.protocol.onUpstreamBandwidth(500, message.LIMIT_DYNAMIC, 0)
+        self.assertEqual(self.protocol.peerBandwidth, None)
+
+        self.protocol.onUpstreamBandwidth(500, message.LIMIT_HARD, 0)
+        self.assertEqual(self.protocol.peerBandwidth, 500)
+
+        # a soft limit can only lower the limit
+        self.protocol.onUpstreamBandwidth(800, message.LIMIT_SOFT, 0)
+        self.assertEqual(self.protocol.peerBandwidth, 500)
+
+        self.protocol.onUpstreamBandwidth(400, message.LIMIT_HARD, 0)
+        self.protocol.onUpstreamBandwidth(2000, message.LIMIT_DYNAMIC, 0)
+        self.assertEqual(self.protocol.peerBandwidth, 2000)
+
+        # the window is in bytes, not bytes per second, so it does not pace
+        self.assertEqual(encoder.bucket.rate, 1000)
+
+        self.protocol.setSendRate(None)
+        self.protocol.onUpstreamBandwidth(500, message.LIMIT_HARD, 0)
+
+        self.assertEqual(encoder.bucket, None)
+
+    def test_stop_streaming(self):
+        encoder = self.stream()
+        self.protocol.setSendRate(1000)
+
+        self.protocol.connectionLost(error.ConnectionDone())
+
+        self.assertEqual(encoder.bucket, None)
+
+
+
+class SendMessageTestCase(ProtocolTestCase):
+    """
+    Tests for L{rtmp.BaseStreamer.sendMessage}.
+    """
+
+    def setUp(self):
+        ProtocolTestCase.setUp(self)
+
+        self.connect()
+        self.protocol.handshakeSuccess('')
+
+        self.sent = []
+
+        def sendMessage(msg, streamId, timestamp, whenDone=None):
+            self.sent.append((msg, streamId))
+
+        self.patch(self.protocol.encoder, 'sendMessage', sendMessage)
+
+    def test_send(self):
+        """
+        The message is handed to the encoder to be encoded into the payload
+        of a channel.
+        """
+        msg = message.BytesRead(16)
+
+        self.protocol.sendMessage(msg, self.protocol)
+
+        self.assertEqual(self.sent, [(msg, 0)])
+
+    def test_encode_error(self):
+        """
+        A message that fails to encode is reported to the caller.
+        """
+        del self.protocol.encoder.sendMessage
+
+        self.assertRaises(message.EncodeError, self.protocol.sendMessage,
+            message.ControlMessage(0, 'foo'), self.protocol)
+
+        self.assertEqual(self.protocol.encoder.backlog, 0)
+
+
+
 class InvokableStream(core.NetStream):
     """
     Be able to control the targets easily.
@@ -364,6 +574,12 @@ class InvokableStream(core.NetStream):
 
         return defer.maybeDeferred(target, *args)
 
+    def isExposed(self, name):
+        if name in self.targets:
+            return True
+
+        return core.NetStream.isExposed(self, name)
+
 
 class InvokingTestCase(ProtocolTestCase):
     """
@@ -705,3 +921,53 @@ class InvokingTestCase(ProtocolTestCase):
         self.assertIsInstance(d, defer.Deferred)
 
         return wait_ok
+
+
+class DispatchListener(object):
+    """
+    Records the messages dispatched to it.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def onVideoData(self, data, timestamp):
+        self.events.append(('video', data, timestamp))
+
+    def onNotify(self, name, args, timestamp):
+        self.events.append(('notify', name, args, timestamp))
+
+
+class MessageDispatcherTestCase(unittest.TestCase):
+    """
+    Tests for L{rtmp.MessageDispatcher}
+    """
+
+    def setUp(self):
+        self.dispatcher = rtmp.MessageDispatcher(None)
+        self.listener = DispatchListener()
+
+    def test_streaming(self):
+        """
+        Audio/video data is handed over as it was received.
+        """
+        data = 'foobar'
+
+        self.dispatcher.dispatchMessage(self.listener, message.VIDEO_DATA,
+            10, data)
+
+        kind, received, timestamp = self.listener.events[0]
+
+        self.assertEqual(kind, 'video')
+        self.assertIdentical(received, data)
+        self.assertEqual(timestamp, 10)
+
+    def test_decode(self):
+        """
+        Other messages are decoded.
+        """
+        data = '\x02\x00\x03foo\x02\x00\x03bar'
+
+        self.dispatcher.dispatchMessage(self.listener, message.NOTIFY, 5, data)
+
+        self.assertEqual(self.listener.events, [('notify', 'foo', ['bar'], 5)])
@@ -0,0 +1,145 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.protocol.rtmp.pump}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import task, defer
+
+from rtmpy.protocol.rtmp import pump
+
+
+class Iterator(object):
+    """
+    Returns each of C{results} in turn, then raises C{StopIteration}.
+
+    @ivar bytes: Incremented by C{size} on every call to L{next}.
+    """
+
+    def __init__(self, clock, results, size=1, duration=0):
+        self.clock = clock
+        self.results = list(results)
+        self.size = size
+        self.duration = duration
+
+        self.bytes = 0
+        self.calls = 0
+
+    def next(self):
+        self.calls += 1
+        self.bytes += self.size
+        self.clock.advance(self.duration)
+
+        if not self.results:
+            raise StopIteration
+
+        result = self.results.pop(0)
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+
+class PumpTestCase(unittest.TestCase):
+    """
+    Tests for L{pump.Pump}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.errors = []
+
+    def build(self, *args, **kwargs):
+        self.iterator = Iterator(self.clock, *args, **kwargs)
+
+        return pump.Pump(self.iterator, self.clock, self.errors.append)
+
+    def test_inline(self):
+        p = self.build([None] * 10)
+
+        p.run()
+
+        self.assertEqual(self.iterator.calls, 11)
+        self.assertFalse(p.running)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_byte_slice(self):
+        p = self.build([None] * 10, size=10)
+        p.byteSlice = 30
+
+        p.run()
+
+        self.assertEqual(self.iterator.calls, 3)
+        self.assertTrue(p.running)
+
+        # already running
+        p.run()
+
+        self.assertEqual(self.iterator.calls, 3)
+
+        self.clock.advance(0)
+
+        self.assertEqual(self.iterator.calls, 11)
+        self.assertFalse(p.running)
+
+    def test_time_slice(self):
+        p = self.build([None] * 10, duration=0.004)
+        p.timeSlice = 0.01
+
+        p.run()
+
+        self.assertEqual(self.iterator.calls, 3)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        while p.running:
+            self.clock.advance(0)
+
+        self.assertEqual(self.iterator.calls, 11)
+
+    def test_deferred(self):
+        d = defer.Deferred()
+        p = self.build([None, d, None])
+
+        p.run()
+
+        self.assertEqual(self.iterator.calls, 2)
+        self.assertTrue(p.running)
+
+        d.callback(None)
+
+        self.assertEqual(self.iterator.calls, 4)
+        self.assertFalse(p.running)
+
+    def test_error(self):
+        p = self.build([None, RuntimeError('foo')])
+
+        p.run()
+
+        self.assertFalse(p.running)
+        self.assertEqual(len(self.errors), 1)
+        self.errors[0].trap(RuntimeError)
+
+    def test_stop(self):
+        p = self.build([None] * 10)
+        p.byteSlice = 1
+
+        p.run()
+        p.stop()
+
+        self.assertFalse(p.running)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
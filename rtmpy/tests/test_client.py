@@ -0,0 +1,118 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.client}.
+"""
+
+from twisted.trial import unittest
+
+from rtmpy import client, server, exc
+from rtmpy.tests import util
+
+
+class Subscriber(object):
+    """
+    Records the audio/video/meta data of a stream being played.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.unpublished = False
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.received.append(('video', data))
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.received.append(('audio', data))
+
+
+    def onMetaData(self, data):
+        self.received.append(('meta', data))
+
+
+    def unpublish(self):
+        self.unpublished = True
+
+
+
+class ClientTestCase(unittest.TestCase):
+    """
+    Tests for L{client.ClientProtocol} against a L{server.ServerFactory} on the
+    loopback interface.
+    """
+
+    def setUp(self):
+        self.app = server.Application()
+        self.loopback = util.Loopback(self)
+        self.port = self.loopback.listen(server.ServerFactory({
+            'live': self.app
+        }))
+
+    def connect(self, appName='live'):
+        factory = client.ClientFactory({'app': appName})
+
+        self.loopback.connect(self.port, factory)
+
+        return factory.deferred
+
+    def test_connect(self):
+        def cb(nc):
+            self.assertIsInstance(nc, client.NetConnection)
+            self.assertTrue(nc.connected)
+            self.assertEqual(len(self.app.clients), 1)
+
+        return self.connect().addCallback(cb)
+
+    def test_unknown_application(self):
+        return self.assertFailure(self.connect('foo'), exc.ConnectRejected)
+
+    def test_create_stream(self):
+        def cb(stream):
+            self.assertIsInstance(stream, client.NetStream)
+            self.assertEqual(stream.streamId, 1)
+            self.assertIdentical(stream.nc.streams[1], stream)
+
+        d = self.connect()
+        d.addCallback(lambda nc: nc.createStream())
+
+        return d.addCallback(cb)
+
+    def test_play(self):
+        publisher = self.app.publishStream(self.app.buildClient(None, {}),
+            None, 'foo')
+        subscriber = Subscriber()
+
+        publisher.onMetaData({'width': 320})
+
+        def playing(stream):
+            publisher.audioDataReceived('audio', 0)
+
+            return util.wait_for(lambda: len(subscriber.received) == 2)
+
+        def received(result):
+            self.assertEqual(subscriber.received, [
+                ('meta', {'width': 320}),
+                ('audio', 'audio')
+            ])
+
+        d = self.connect()
+        d.addCallback(lambda nc: nc.createStream())
+        d.addCallback(lambda stream: stream.play('foo', subscriber))
+        d.addCallback(playing)
+
+        return d.addCallback(received)
@@ -19,7 +19,7 @@ Tests for L{rtmpy.core}
 
 from twisted.trial import unittest
 
-from rtmpy import core, message, status
+from rtmpy import core, message, status, exc
 
 
 
@@ -442,6 +442,47 @@ class NetConnectionTestCase(unittest.TestCase):
 
 
 
+class LazyArgumentsTestCase(unittest.TestCase):
+    """
+    Calls to methods that are not exposed are rejected without decoding their
+    arguments.
+    """
+
+    def setUp(self):
+        self.nc = core.NetConnection(None)
+        self.messages = []
+
+        self.nc.sendMessage = lambda msg, whenDone=None: \
+            self.messages.append(msg)
+
+    def buildArguments(self):
+        args = message.Arguments(None)
+
+        def decode(count=None):
+            self.fail('The arguments were decoded')
+
+        args._decode = decode
+
+        return args
+
+    def test_invoke(self):
+        d = self.nc.onInvoke('foo', 2, self.buildArguments(), 0)
+
+        self.assertFailure(d, exc.CallFailed)
+
+        msg, = self.messages
+
+        self.assertEqual(msg.name, '_error')
+
+        return d
+
+    def test_notify(self):
+        self.nc.onNotify('foo', self.buildArguments(), 0)
+
+        self.assertEqual(self.messages, [])
+
+
+
 class NetStreamTestCase(unittest.TestCase):
     """
     Tests for L{core.NetStream}
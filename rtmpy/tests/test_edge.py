@@ -0,0 +1,210 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.edge}, with an origin and an edge server on the loopback
+interface.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from rtmpy import client, server, edge, exc
+from rtmpy.tests import util
+from rtmpy.tests.test_client import Subscriber
+
+
+class Edge(edge.Edge):
+    """
+    Tracks the connections to the origin.
+    """
+
+    def __init__(self, loopback, port):
+        edge.Edge.__init__(self, '127.0.0.1', port)
+
+        self.loopback = loopback
+
+
+    def connect(self, factory):
+        return edge.Edge.connect(self, self.loopback.track(factory))
+
+
+
+class EdgeTestCase(unittest.TestCase):
+    """
+    Tests for L{edge.Edge}.
+    """
+
+    def setUp(self):
+        self.loopback = util.Loopback(self)
+
+        self.originApp = server.Application()
+        originPort = self.loopback.listen(server.ServerFactory({
+            'live': self.originApp
+        }))
+
+        self.edgeApp = server.Application()
+        self.edgeFactory = server.ServerFactory({'live': self.edgeApp})
+        self.edge = self.edgeFactory.edge = Edge(self.loopback, originPort)
+        self.edgePort = self.loopback.listen(self.edgeFactory)
+
+        self.publisher = self.originApp.publishStream(
+            self.originApp.buildClient(None, {}), None, 'foo')
+
+    def play(self, subscriber, name='foo'):
+        """
+        Plays C{name} from the edge.
+        """
+        factory = client.ClientFactory({'app': 'live'})
+        self.loopback.connect(self.edgePort, factory)
+
+        d = factory.deferred
+        d.addCallback(lambda nc: nc.createStream())
+        d.addCallback(lambda stream: stream.play(name, subscriber))
+
+        return d
+
+    def test_pull(self):
+        subscribers = [Subscriber(), Subscriber()]
+
+        def playing(result):
+            # one connection from the edge for all of the viewers
+            self.assertEqual(len(self.originApp.clients), 1)
+            self.assertEqual(len(self.edgeApp.clients), 2)
+            self.assertEqual(self.edge.pulls.keys(), [('live', 'foo')])
+            self.assertIdentical(self.edgeApp.streams['foo'],
+                self.edge.pulls[('live', 'foo')].publisher)
+
+            self.publisher.videoDataReceived('\x17\x01video', 0)
+            self.publisher.audioDataReceived('audio', 10)
+
+            return util.wait_for(lambda: all(len(s.received) == 2
+                for s in subscribers))
+
+        def received(result):
+            for s in subscribers:
+                self.assertEqual(s.received, [
+                    ('video', '\x17\x01video'),
+                    ('audio', 'audio')
+                ])
+
+        d = defer.gatherResults([self.play(s) for s in subscribers])
+        d.addCallback(playing)
+
+        return d.addCallback(received)
+
+    def test_unpublish(self):
+        subscriber = Subscriber()
+
+        def playing(stream):
+            self.originApp.unpublishStream('foo', self.publisher)
+
+            return util.wait_for(lambda: subscriber.unpublished)
+
+        def unpublished(result):
+            self.assertEqual(self.edge.pulls, {})
+            self.assertEqual(self.edgeApp.streams, {})
+
+        d = self.play(subscriber)
+        d.addCallback(playing)
+
+        return d.addCallback(unpublished)
+
+    def test_published_locally(self):
+        self.edgeApp.publishStream(self.edgeApp.buildClient(None, {}), None,
+            'foo')
+
+        def playing(stream):
+            self.assertEqual(self.edge.pulls, {})
+            self.assertEqual(self.originApp.clients, {})
+
+        return self.play(Subscriber()).addCallback(playing)
+
+    def test_idle(self):
+        """
+        The pull is stopped once nothing on the edge is playing the stream.
+        """
+        def playing(stream):
+            pull = self.edge.pulls[('live', 'foo')]
+
+            self.assertEqual(pull.idleCall, None)
+
+            self.edge.idleTimeout = 0
+
+            stream.nc.protocol.transport.loseConnection()
+
+            return util.wait_for(lambda: not self.originApp.clients)
+
+        def stopped(result):
+            self.assertEqual(self.edge.pulls, {})
+            self.assertEqual(self.edgeApp.streams, {})
+
+        d = self.play(Subscriber())
+        d.addCallback(playing)
+
+        return d.addCallback(stopped)
+
+    def test_idle_unpublished(self):
+        """
+        The idle timeout is armed when the pull starts, a stream that the
+        origin does not publish is not pulled forever.
+        """
+        self.edge.idleTimeout = 0.05
+
+        # never playing, the call fails when the client is disconnected
+        self.play(Subscriber(), 'bar').addErrback(lambda f: f.trap(
+            exc.CallFailed))
+
+        def pulling(result):
+            pull = self.edge.pulls[('live', 'bar')]
+
+            self.assertNotEqual(pull.idleCall, None)
+            self.assertEqual(pull.waiting, 1)
+
+            return util.wait_for(lambda: not self.edge.pulls and
+                not self.originApp.clients)
+
+        d = util.wait_for(lambda: self.edge.pulls)
+
+        return d.addCallback(pulling)
+
+    def test_waiter_gone(self):
+        """
+        A pull that has not been published is stopped when the last peer
+        waiting for it goes away.
+        """
+        factory = client.ClientFactory({'app': 'live'})
+        self.loopback.connect(self.edgePort, factory)
+
+        def connected(nc):
+            d = nc.createStream()
+            d.addCallback(lambda stream: stream.play('bar', Subscriber()))
+            d.addErrback(lambda f: f.trap(exc.CallFailed))
+
+            pulling = util.wait_for(lambda: self.edge.pulls and
+                self.originApp.clients)
+
+            return pulling.addCallback(lambda result: nc)
+
+        def pulling(nc):
+            nc.protocol.transport.loseConnection()
+
+            return util.wait_for(lambda: not self.edge.pulls and
+                not self.originApp.clients)
+
+        d = factory.deferred
+        d.addCallback(connected)
+
+        return d.addCallback(pulling)
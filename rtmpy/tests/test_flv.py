@@ -0,0 +1,71 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.flv}
+"""
+
+from twisted.trial import unittest
+
+from rtmpy import flv
+
+
+class VideoTagTestCase(unittest.TestCase):
+    """
+    Tests for inspecting the first bytes of a video tag.
+    """
+
+    def test_frame_type(self):
+        self.assertEqual(flv.get_frame_type('\x17'), flv.KEYFRAME)
+        self.assertEqual(flv.get_frame_type('\x22'), flv.INTER_FRAME)
+        self.assertEqual(flv.get_frame_type(''), None)
+
+    def test_codec_id(self):
+        self.assertEqual(flv.get_codec_id('\x17'), flv.CODEC_AVC)
+        self.assertEqual(flv.get_codec_id('\x22'), 2)
+        self.assertEqual(flv.get_codec_id(''), None)
+
+    def test_keyframe(self):
+        self.assertTrue(flv.is_keyframe('\x17\x01'))
+        self.assertTrue(flv.is_keyframe('\x42'))
+        self.assertFalse(flv.is_keyframe('\x27\x01'))
+        self.assertFalse(flv.is_keyframe(''))
+
+    def test_sequence_header(self):
+        self.assertTrue(flv.is_sequence_header('\x17\x00'))
+        self.assertFalse(flv.is_sequence_header('\x17\x01'))
+        self.assertFalse(flv.is_sequence_header('\x12\x00'))
+        self.assertFalse(flv.is_sequence_header('\x17'))
+
+    def test_audio_sequence_header(self):
+        self.assertTrue(flv.is_sequence_header('\xaf\x00', audio=True))
+        self.assertFalse(flv.is_sequence_header('\xaf\x01', audio=True))
+        self.assertFalse(flv.is_sequence_header('\x2f\x00', audio=True))
+
+    def test_disposable(self):
+        self.assertTrue(flv.is_disposable('\x27\x01'))
+        self.assertTrue(flv.is_disposable('\x32'))
+        self.assertFalse(flv.is_disposable('\x27\x00'))
+        self.assertFalse(flv.is_disposable('\x17\x01'))
+        self.assertFalse(flv.is_disposable('\x57'))
+        self.assertFalse(flv.is_disposable(''))
+
+    def test_tag_header(self):
+        header = flv.pack_tag_header(flv.TAG_VIDEO, 0x123, 0x01020304)
+
+        self.assertEqual(header, '\x09\x00\x01\x23\x02\x03\x04\x01\x00\x00\x00')
+        self.assertEqual(len(header), flv.TAG_HEADER_SIZE)
+        self.assertEqual(flv.unpack_tag_header('xx' + header, 2),
+            (flv.TAG_VIDEO, 0x123, 0x01020304))
@@ -0,0 +1,243 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.loop}.
+"""
+
+import socket
+
+from twisted.trial import unittest
+from twisted.internet import task, protocol
+
+from rtmpy import loop, server, client, edge
+from rtmpy.tests import util
+from rtmpy.tests.test_client import Subscriber
+
+
+class ClockTestCase(unittest.TestCase):
+    """
+    Tests for L{loop.Clock}.
+    """
+
+    def setUp(self):
+        self.clock = loop.Clock()
+
+    def test_timeout(self):
+        self.assertEqual(self.clock.getTimeout(), None)
+
+        self.clock.callLater(60, lambda: None)
+
+        self.assertTrue(59 < self.clock.getTimeout() <= 60)
+
+    def test_run(self):
+        calls = []
+
+        def f():
+            calls.append('f')
+
+            # left for the next iteration
+            self.clock.callLater(0, calls.append, 'g')
+
+        self.clock.callLater(0, f)
+        self.clock.callLater(60, calls.append, 'h')
+        self.clock.runUntilCurrent()
+
+        self.assertEqual(calls, ['f'])
+
+        self.clock.runUntilCurrent()
+
+        self.assertEqual(calls, ['f', 'g'])
+        self.assertEqual(len(self.clock.calls), 1)
+
+    def test_cancelled(self):
+        calls = []
+
+        later = self.clock.callLater(0, calls.append, 'g')
+        self.clock.callLater(-1, later.cancel)
+
+        self.clock.runUntilCurrent()
+
+        self.assertEqual(calls, [])
+        self.assertEqual(self.clock.calls, [])
+
+
+
+class Producer(object):
+    """
+    Records the calls made to a streaming producer.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def pauseProducing(self):
+        self.calls.append('pause')
+
+    def resumeProducing(self):
+        self.calls.append('resume')
+
+    def stopProducing(self):
+        self.calls.append('stop')
+
+
+class ConnectionTestCase(unittest.TestCase):
+    """
+    Tests for L{loop.Connection}.
+    """
+
+    def setUp(self):
+        self.loop = loop.Loop()
+
+        sock, other = socket.socketpair()
+        self.addCleanup(other.close)
+
+        self.connection = loop.Connection(self.loop, sock, protocol.Protocol())
+        self.addCleanup(self.connection.close)
+
+        self.sent = []
+        self.connection.send = self.send
+
+    def send(self, data):
+        data = str(data)[:3]
+        self.sent.append(data)
+
+        return len(data)
+
+    def test_partial_write(self):
+        producer = Producer()
+
+        self.connection.bufferSize = 4
+        self.connection.registerProducer(producer, True)
+
+        self.connection.write('abcde')
+        self.connection.write('fg')
+
+        self.assertEqual(producer.calls, ['pause'])
+
+        self.connection.handle_write()
+
+        self.assertEqual(self.sent, ['abc'])
+        self.assertEqual(self.connection.buffered, 4)
+        self.assertEqual(self.connection.offset, 3)
+        self.assertEqual(list(self.connection.buffer), ['abcde', 'fg'])
+
+        self.connection.handle_write()
+
+        self.assertEqual(self.sent, ['abc', 'de', 'fg'])
+        self.assertEqual(self.connection.buffered, 0)
+        self.assertEqual(self.connection.offset, 0)
+        self.assertFalse(self.connection.writable())
+        self.assertEqual(producer.calls, ['pause', 'resume'])
+
+
+class CheckFactoryTestCase(unittest.TestCase):
+    """
+    Tests for L{loop.check_factory}, the features that need the reactor are
+    refused rather than left to hang on a L{loop.Loop}.
+    """
+
+    def test_plain(self):
+        loop.check_factory(server.ServerFactory({'live': server.Application()}))
+
+    def test_edge(self):
+        factory = server.ServerFactory()
+        factory.edge = edge.Edge('localhost')
+
+        self.assertRaises(ValueError, loop.check_factory, factory)
+        self.assertRaises(ValueError, loop.Loop().listenTCP, 0, factory)
+
+    def test_record(self):
+        app = server.Application()
+        app.recordPath = self.mktemp()
+
+        self.assertRaises(ValueError, loop.check_factory,
+            server.ServerFactory({'live': app}))
+
+    def test_vod(self):
+        app = server.Application()
+        app.vodPath = self.mktemp()
+
+        self.assertRaises(ValueError, loop.check_factory,
+            server.ServerFactory({'live': app}))
+
+
+class LoopTestCase(unittest.TestCase):
+    """
+    Serves a L{server.ServerFactory} from a L{loop.Loop} to an RTMPy client on
+    the reactor. The reactor iterates the loop.
+    """
+
+    def setUp(self):
+        self.loop = loop.Loop()
+        self.loopback = util.Loopback(self)
+
+        self.app = server.Application()
+        self.port = self.loop.listenTCP(0, server.ServerFactory({
+            'live': self.app
+        }), interface='127.0.0.1')
+
+        self.driver = task.LoopingCall(self.loop.iterate, 0)
+        self.driver.start(0.001)
+
+        self.addCleanup(self.loop.stop)
+        self.addCleanup(self.driver.stop)
+
+    def connect(self):
+        factory = client.ClientFactory({'app': 'live'})
+
+        self.loopback.connect(self.port.getHost().port, factory)
+
+        return factory.deferred
+
+    def test_connect(self):
+        def connected(nc):
+            self.assertTrue(nc.connected)
+            self.assertEqual(len(self.app.clients), 1)
+
+            protocol = self.app.clients.values()[0].nc.protocol
+
+            self.assertIdentical(protocol.clock, self.loop.clock)
+            self.assertEqual(protocol.transport.getPeer().host, '127.0.0.1')
+
+            nc.protocol.transport.loseConnection()
+
+            return util.wait_for(lambda: not self.app.clients)
+
+        return self.connect().addCallback(connected)
+
+    def test_play(self):
+        publisher = self.app.publishStream(self.app.buildClient(None, {}),
+            None, 'foo')
+        subscriber = Subscriber()
+
+        def playing(stream):
+            publisher.videoDataReceived('\x17\x01' + 'v' * 1000, 0)
+            publisher.audioDataReceived('audio', 10)
+
+            return util.wait_for(lambda: len(subscriber.received) == 2)
+
+        def received(result):
+            self.assertEqual(subscriber.received, [
+                ('video', '\x17\x01' + 'v' * 1000),
+                ('audio', 'audio')
+            ])
+
+        d = self.connect()
+        d.addCallback(lambda nc: nc.createStream())
+        d.addCallback(lambda stream: stream.play('foo', subscriber))
+        d.addCallback(playing)
+
+        return d.addCallback(received)
@@ -291,6 +291,58 @@ class NotifyTestCase(BaseTestCase):
         self.assertEquals(self.listener.calls, [('notify', ('foo', [], 54), {})])
 
 
+class ArgumentsTestCase(BaseTestCase):
+    """
+    Tests for L{message.Arguments}.
+    """
+
+    def decode(self, data):
+        import pyamf
+
+        self.buffer.append(data)
+
+        return message.Arguments(pyamf.get_decoder(pyamf.AMF0,
+            stream=self.buffer))
+
+    def test_lazy(self):
+        args = self.decode('\x05\x02\x00\x03foo\x00?\xf0\x00\x00\x00\x00'
+            '\x00\x00')
+
+        self.assertEqual(args.items, [])
+
+        self.assertEqual(args[0], None)
+        self.assertEqual(args.items, [None])
+
+        self.assertEqual(args[1:], ['foo', 1])
+        self.assertIdentical(args.decoder, None)
+
+    def test_list(self):
+        args = self.decode('\x05\x02\x00\x03foo')
+
+        self.assertEqual(args, [None, 'foo'])
+        self.assertEqual(len(args), 2)
+        self.assertEqual(list(args), [None, 'foo'])
+        self.assertEqual(args[-1], 'foo')
+        self.assertRaises(IndexError, lambda: args[2])
+
+    def test_empty(self):
+        args = self.decode('')
+
+        self.assertFalse(args)
+        self.assertEqual(args, [])
+
+    def test_eager(self):
+        e = message.Invoke()
+        e.lazy = False
+
+        self.buffer.append('\x02\x00\x03foo\x00?\xf0\x00\x00\x00\x00\x00'
+            '\x00\x05')
+        e.decode(self.buffer)
+
+        self.assertEqual(type(e.argv), list)
+        self.assertEqual(e.argv, [None])
+
+
 class InvokeTestCase(BaseTestCase):
     """
     Tests for L{message.Invoke}
@@ -643,3 +695,67 @@ class HelperTestCase(unittest.TestCase):
 
         self.assertFalse('foo' in message.TYPE_MAP.keys())
         self.assertRaises(message.UnknownType, message.classByType, 'foo')
+
+
+
+class PreparedTestCase(unittest.TestCase):
+    """
+    Tests for L{message.prepare} and L{message.Prepared}.
+    """
+
+    def test_prepare(self):
+        x = message.prepare(message.ControlMessage(0, 1))
+
+        self.assertEqual(x.__data_type__, message.CONTROL)
+        self.assertEqual(x.body, '\x00\x00\x00\x00\x00\x01')
+
+        buf = BufferedByteStream()
+        x.encode(buf)
+
+        self.assertEqual(buf.getvalue(), x.body)
+
+    def test_dispatch(self):
+        x = message.prepare(message.Notify('foo', 'bar'))
+        listener = MockMessageListener()
+
+        x.dispatch(listener, 54)
+
+        self.assertEqual(listener.calls,
+            [('notify', (u'foo', [u'bar'], 54), {})])
+
+
+
+class TemplateTestCase(unittest.TestCase):
+    """
+    Tests for L{message.Template}.
+    """
+
+    def decode(self, x):
+        m = message.classByType(x.__data_type__)()
+        m.decode(BufferedByteStream(x.body))
+
+        return m
+
+    def test_invoke(self):
+        t = message.Template(message.Invoke, 'foo', 0, None)
+        m = self.decode(t.build({'a': 'b'}, 3))
+
+        self.assertTrue(isinstance(m, message.Invoke))
+        self.assertEqual((m.name, m.id, m.argv), ('foo', 0, [None, {'a': 'b'}, 3]))
+
+    def test_notify(self):
+        t = message.Template(message.Notify, 'foo')
+        m = self.decode(t.build('bar'))
+
+        self.assertEqual((m.name, m.argv), ('foo', ['bar']))
+
+    def test_fragment(self):
+        t = message.Template(message.Notify, 'foo')
+        x = t.build(message.encode_amf0('bar'), 'baz')
+
+        self.assertEqual(x.body, message.encode_amf0('foo', 'bar', 'baz'))
+
+    def test_amf3(self):
+        self.assertRaises(message.EncodeError, message.Template,
+            message.FlexMessage, 'foo')
+
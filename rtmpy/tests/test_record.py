@@ -0,0 +1,367 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.record}.
+"""
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer
+import pyamf
+
+from rtmpy import record, server, flv, exc
+from rtmpy.protocol.rtmp import codec
+
+
+class ManualRecorder(record.Recorder):
+    """
+    Holds on to the jobs for the thread pool until L{runJob} is called.
+    """
+
+    def __init__(self, *args, **kwargs):
+        record.Recorder.__init__(self, *args, **kwargs)
+
+        self.jobs = []
+
+
+    def deferToThread(self, f, *args):
+        d = defer.Deferred()
+
+        self.jobs.append((f, args, d))
+
+        return d
+
+
+    def runJob(self):
+        f, args, d = self.jobs.pop(0)
+
+        d.callback(f(*args))
+
+
+
+def read_tags(path):
+    """
+    Returns the C{(tagType, timestamp, data)} of the tags in the FLV file
+    C{path}.
+    """
+    data = open(path, 'rb').read()
+    pos = len(flv.FILE_HEADER)
+    tags = []
+
+    assert data[:pos] == flv.FILE_HEADER
+
+    while pos < len(data):
+        tagType, size, timestamp = flv.unpack_tag_header(data, pos)
+        pos += flv.TAG_HEADER_SIZE
+
+        tags.append((tagType, timestamp, data[pos:pos + size]))
+        pos += size
+
+        assert flv.previous_tag_size.unpack_from(data, pos)[0] == \
+            size + flv.TAG_HEADER_SIZE
+        pos += 4
+
+    return tags
+
+
+
+class RecorderTestCase(unittest.TestCase):
+    """
+    Tests for L{record.Recorder}.
+    """
+
+    def setUp(self):
+        self.path = self.mktemp()
+
+    def test_record(self):
+        r = record.Recorder(self.path)
+        r.start()
+
+        r.onMetaData({'width': 320})
+        r.videoDataReceived('\x17\x01video', 0)
+        r.audioDataReceived('audio', 0x1020304)
+
+        def closed(result):
+            tags = read_tags(self.path)
+
+            self.assertEqual(tags[0][:2], (flv.TAG_SCRIPT, 0))
+            self.assertEqual(pyamf.decode(tags[0][2], encoding=pyamf.AMF0)
+                .next(), 'onMetaData')
+            self.assertEqual(tags[1:], [
+                (flv.TAG_VIDEO, 0, '\x17\x01video'),
+                (flv.TAG_AUDIO, 0x1020304, 'audio'),
+            ])
+
+        r.unpublish()
+
+        self.assertTrue(r.closed)
+
+        return r.close().addCallback(closed)
+
+    def test_append(self):
+        r = record.Recorder(self.path)
+        r.start()
+        r.audioDataReceived('foo', 1000)
+
+        def append(result):
+            r = record.Recorder(self.path, append=True)
+            r.start()
+            r.audioDataReceived('bar', 0)
+            r.audioDataReceived('baz', 20)
+
+            return r.close()
+
+        def closed(result):
+            self.assertEqual(read_tags(self.path), [
+                (flv.TAG_AUDIO, 1000, 'foo'),
+                (flv.TAG_AUDIO, 1001, 'bar'),
+                (flv.TAG_AUDIO, 1021, 'baz'),
+            ])
+
+        d = r.close()
+        d.addCallback(append)
+
+        return d.addCallback(closed)
+
+    def test_append_empty(self):
+        """
+        Appending to a file with no tags starts at the stream's timestamps.
+        """
+        with open(self.path, 'wb') as f:
+            f.write(flv.FILE_HEADER)
+
+        r = record.Recorder(self.path, append=True)
+        r.start()
+        r.audioDataReceived('foo', 10)
+
+        def closed(result):
+            self.assertEqual(read_tags(self.path), [
+                (flv.TAG_AUDIO, 10, 'foo'),
+            ])
+
+        return r.close().addCallback(closed)
+
+    def test_append_missing(self):
+        r = record.Recorder(self.path, append=True)
+        r.start()
+        r.audioDataReceived('foo', 10)
+
+        def closed(result):
+            self.assertEqual(read_tags(self.path), [
+                (flv.TAG_AUDIO, 10, 'foo'),
+            ])
+
+        return r.close().addCallback(closed)
+
+    def test_batch(self):
+        """
+        Tags received while a write is in progress are written together.
+        """
+        r = ManualRecorder(self.path)
+        r.start()
+
+        r.audioDataReceived('a', 0)
+        r.audioDataReceived('b', 1)
+
+        self.assertEqual(len(r.jobs), 1)
+        self.assertTrue(r.busy)
+
+        r.runJob()
+
+        self.assertEqual(r.pending, [])
+        self.assertEqual(len(r.jobs), 1)
+
+        f, args, d = r.jobs[0]
+
+        self.assertEqual(args, ([(flv.TAG_AUDIO, 0, 'a'),
+            (flv.TAG_AUDIO, 1, 'b')],))
+
+    def test_prepared(self):
+        """
+        A prepared payload is queued as a plain C{str}, its cached frames are
+        not kept alive until the write.
+        """
+        r = ManualRecorder(self.path)
+        r.start()
+
+        data = codec.PreparedMessage('audio')
+        data.getFrames(128, 4)
+
+        r.audioDataReceived(data, 0)
+
+        self.assertEqual(r.pending, [(flv.TAG_AUDIO, 0, 'audio')])
+        self.assertIs(type(r.pending[0][2]), str)
+
+    def test_drop(self):
+        r = ManualRecorder(self.path)
+        r.maxPending = 5
+        r.start()
+
+        r.audioDataReceived('abc', 0)
+        r.audioDataReceived('def', 1)
+        r.audioDataReceived('gh', 2)
+
+        self.assertEqual(r.dropped, 1)
+        self.assertEqual(r.pendingBytes, 5)
+
+        r.runJob()
+
+        self.assertEqual(r.pendingBytes, 0)
+
+    def test_drop_video(self):
+        """
+        Sequence headers are never dropped and video is dropped up to the next
+        keyframe.
+        """
+        r = ManualRecorder(self.path)
+        r.maxPending = 10
+        r.start()
+
+        r.videoDataReceived('\x17\x01key', 0)
+        r.videoDataReceived('\x27\x01inter', 10)
+        r.videoDataReceived('\x17\x00header', 20)
+        r.audioDataReceived('\xaf\x00', 20)
+        r.onMetaData({'width': 320})
+
+        self.assertTrue(r.dropping)
+        self.assertEqual([tag[:2] for tag in r.pending], [
+            (flv.TAG_VIDEO, 0),
+            (flv.TAG_VIDEO, 20),
+            (flv.TAG_AUDIO, 20),
+            (flv.TAG_SCRIPT, 0)
+        ])
+
+        r.runJob()
+
+        # the inter frames depend on the one that was dropped
+        r.videoDataReceived('\x27\x01', 30)
+        r.videoDataReceived('\x17\x01', 40)
+        r.videoDataReceived('\x27\x01', 50)
+
+        self.assertFalse(r.dropping)
+        self.assertEqual(r.dropped, 2)
+        self.assertEqual(r.pending, [
+            (flv.TAG_VIDEO, 40, '\x17\x01'),
+            (flv.TAG_VIDEO, 50, '\x27\x01'),
+        ])
+
+    def test_close_pending(self):
+        r = ManualRecorder(self.path)
+        r.start()
+        r.audioDataReceived('abc', 0)
+
+        d = r.close()
+        r.audioDataReceived('def', 1)
+
+        self.assertFalse(d.called)
+
+        while r.jobs:
+            r.runJob()
+
+        self.assertTrue(d.called)
+        self.assertTrue(r.finished)
+        self.assertEqual(read_tags(self.path), [(flv.TAG_AUDIO, 0, 'abc')])
+
+    def test_failure(self):
+        r = record.Recorder(os.path.join(self.mktemp(), 'missing', 'foo.flv'))
+        r.start()
+        r.audioDataReceived('abc', 0)
+
+        def closed(result):
+            self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+            self.assertTrue(r.closed)
+            self.assertEqual(r.pending, [])
+
+        return r.close().addCallback(closed)
+
+    def test_fsync(self):
+        r = ManualRecorder(self.path)
+        r.start()
+        r.runJob()
+
+        synced = []
+        r.sync = lambda: synced.append(True)
+
+        r.fsyncInterval = None
+        r.writeTags([])
+
+        self.assertEqual(synced, [])
+
+        r.fsyncInterval = 0
+        r.writeTags([])
+
+        self.assertEqual(synced, [True])
+
+
+
+class ApplicationRecordingTestCase(unittest.TestCase):
+    """
+    Tests for recording with L{server.Application}.
+    """
+
+    def setUp(self):
+        self.app = server.Application()
+        self.app.recordPath = self.mktemp()
+        self.client = self.app.buildClient(None, {})
+
+        os.mkdir(self.app.recordPath)
+
+    def test_live(self):
+        publisher = self.app.publishStream(self.client, None, 'foo')
+
+        self.assertEqual(publisher.subscribers, {})
+
+    def test_disabled(self):
+        self.app.recordPath = None
+
+        publisher = self.app.publishStream(self.client, None, 'foo', 'record')
+
+        self.assertEqual(publisher.subscribers, {})
+
+    def test_bad_name(self):
+        for name in ('../foo', '.foo', 'foo/bar'):
+            self.assertRaises(exc.BadNameError, self.app.publishStream,
+                self.client, None, name, 'record')
+
+        self.assertEqual(self.app.streams, {})
+
+    def test_record(self):
+        publisher = self.app.publishStream(self.client, None, 'foo', 'record')
+        recorder, = publisher.subscribers.keys()
+
+        self.assertIsInstance(recorder, record.Recorder)
+        self.assertFalse(recorder.append)
+        self.assertEqual(recorder.path,
+            os.path.join(self.app.recordPath, 'foo.flv'))
+
+        publisher.audioDataReceived('audio', 10)
+        publisher.unpublish()
+
+        def closed(result):
+            self.assertEqual(read_tags(recorder.path), [
+                (flv.TAG_AUDIO, 10, 'audio'),
+            ])
+
+        return recorder.close().addCallback(closed)
+
+    def test_append(self):
+        publisher = self.app.publishStream(self.client, None, 'foo', 'append')
+        recorder, = publisher.subscribers.keys()
+
+        self.assertTrue(recorder.append)
+
+        return recorder.close()
@@ -0,0 +1,227 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.ring}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+from rtmpy import ring, server, message
+
+
+class Publisher(object):
+    """
+    Records the calls made by a L{ring.RingReader}.
+    """
+
+    def __init__(self):
+        self.received = []
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.received.append(('video', data, timestamp))
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.received.append(('audio', data, timestamp))
+
+
+    def onMetaData(self, data):
+        self.received.append(('meta', data))
+
+
+    def unpublish(self):
+        self.received.append(('unpublish',))
+
+
+
+class RingBufferTestCase(unittest.TestCase):
+    """
+    Tests for L{ring.RingBuffer}.
+    """
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.ring = ring.RingBuffer(self.path, capacity=100)
+        self.addCleanup(self.ring.close)
+
+    def test_create(self):
+        self.assertEqual(self.ring.capacity, 100)
+        self.assertEqual(self.ring.maxRecordSize, 25)
+        self.assertEqual(self.ring.getHead(), 0)
+
+    def test_open(self):
+        self.ring.write(message.VIDEO_DATA, 10, 'foo')
+
+        other = ring.RingBuffer(self.path)
+        self.addCleanup(other.close)
+
+        self.assertEqual(other.capacity, 100)
+        self.assertEqual(other.getHead(), 12)
+
+        datatype, timestamp, payload, pos = other.read(0)
+
+        self.assertEqual((datatype, timestamp, str(payload), pos),
+            (message.VIDEO_DATA, 10, 'foo', 12))
+        self.assertIdentical(other.read(pos), None)
+
+    def test_not_a_ring(self):
+        path = self.mktemp()
+        open(path, 'wb').write('\x00' * 100)
+
+        self.assertRaises(ValueError, ring.RingBuffer, path)
+
+    def test_too_large(self):
+        self.assertRaises(ValueError, self.ring.write, message.VIDEO_DATA, 0,
+            'a' * 20)
+
+    def test_wrap(self):
+        for i in range(7):
+            self.ring.write(message.AUDIO_DATA, i, 'a' * 10)
+
+        # 5 records of 19 bytes fit, the remaining 5 bytes are skipped
+        self.assertEqual(self.ring.getHead(), 100 + 2 * 19)
+
+        pos = 0
+
+        for i in range(5):
+            pos = self.ring.read(pos)[3]
+
+        datatype, timestamp, payload, pos = self.ring.read(pos)
+
+        self.assertEqual((timestamp, str(payload), pos), (5, 'a' * 10, 119))
+
+    def test_padding(self):
+        for i in range(4):
+            self.ring.write(message.AUDIO_DATA, i, 'a' * 10)
+
+        # 76 bytes written, this record does not fit in the remaining 24
+        self.ring.write(message.AUDIO_DATA, 4, 'a' * 16)
+
+        datatype, timestamp, payload, pos = self.ring.read(76)
+
+        self.assertEqual(self.ring.getHead(), 125)
+        self.assertEqual((timestamp, str(payload), pos), (4, 'a' * 16, 125))
+
+    def test_valid(self):
+        self.assertTrue(self.ring.isValid(0))
+
+        for i in range(4):
+            self.ring.write(message.AUDIO_DATA, i, 'a' * 10)
+
+        self.assertFalse(self.ring.isValid(0))
+        self.assertFalse(self.ring.isValid(19))
+        self.assertTrue(self.ring.isValid(26))
+
+    def test_torn_wrap(self):
+        """
+        A write that does not fit before the end of the ring wraps to the
+        start, it must not tear a record that was still considered valid.
+        """
+        ring._head.pack_into(self.ring.map, ring._HEAD_OFFSET, 115)
+        self.ring.write(message.AUDIO_DATA, 1, 'b' * 10)
+
+        ring._head.pack_into(self.ring.map, ring._HEAD_OFFSET, 190)
+
+        # the head is only 75 bytes ahead of the record
+        valid = self.ring.isValid(115)
+
+        # 20 bytes do not fit in the 10 left before the end of the ring
+        self.ring.write(message.AUDIO_DATA, 2, 'c' * 11)
+
+        self.assertEqual(self.ring.getHead(), 220)
+        self.assertNotEqual(self.ring.read(115)[:2], (message.AUDIO_DATA, 1))
+        self.assertFalse(valid)
+
+
+
+class RingWriterTestCase(unittest.TestCase):
+    """
+    Tests for L{ring.RingWriter} and L{ring.RingReader}.
+    """
+
+    def setUp(self):
+        path = self.mktemp()
+
+        self.ring = ring.RingBuffer(path, capacity=1000)
+        self.addCleanup(self.ring.close)
+
+        self.clock = task.Clock()
+        self.writer = ring.RingWriter(self.ring)
+        self.publisher = Publisher()
+
+        other = ring.RingBuffer(path)
+        self.addCleanup(other.close)
+
+        self.reader = ring.RingReader(other, self.publisher, self.clock)
+
+    def test_interface(self):
+        self.assertTrue(server.IPublishingStream.providedBy(self.writer))
+
+    def test_relay(self):
+        publisher = server.StreamPublisher(None, None)
+        publisher.addSubscriber(self.writer)
+
+        self.reader.start()
+
+        publisher.onMetaData({'foo': 'bar'})
+        publisher.videoDataReceived('video', 0)
+        publisher.audioDataReceived('audio', 10)
+
+        self.clock.advance(self.reader.interval)
+
+        publisher.unpublish()
+
+        self.clock.advance(self.reader.interval)
+
+        self.assertEqual(self.publisher.received, [
+            ('meta', {'foo': 'bar'}),
+            ('video', 'video', 0),
+            ('audio', 'audio', 10),
+            ('unpublish',)
+        ])
+        self.assertIdentical(self.reader.call, None)
+
+    def test_start_at_head(self):
+        self.writer.videoDataReceived('old', 0)
+        self.reader = ring.RingReader(self.reader.ring, self.publisher,
+            self.clock)
+        self.writer.videoDataReceived('new', 10)
+
+        self.reader.poll()
+
+        self.assertEqual(self.publisher.received, [('video', 'new', 10)])
+
+    def test_too_large(self):
+        self.writer.videoDataReceived('a' * 1000, 0)
+
+        self.assertEqual(self.writer.dropped, 1)
+        self.assertEqual(self.ring.getHead(), 0)
+
+    def test_overrun(self):
+        for i in range(100):
+            self.writer.audioDataReceived('a' * 41, i)
+
+        self.reader.poll()
+
+        self.assertEqual(self.reader.overruns, 1)
+        self.assertEqual(self.publisher.received, [])
+
+        self.writer.audioDataReceived('b', 100)
+        self.reader.poll()
+
+        self.assertEqual(self.publisher.received, [('audio', 'b', 100)])
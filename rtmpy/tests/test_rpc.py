@@ -712,6 +712,11 @@ class SimpleFacilitator(rpc.AbstractCallHandler):
         return rpc.CommandResult('foo', {'one': 'two'})
 
 
+    @rpc.expose
+    def deferred_return(self):
+        return self.test.result
+
+
 
 class CallReceiverTestCase(unittest.TestCase):
     """
@@ -863,3 +868,61 @@ class CallReceiverTestCase(unittest.TestCase):
         self.assertEqual(msg.name, '_result')
         self.assertEqual(msg.argv, [{'one': 'two'}, 'foo'])
         self.assertEqual(msg.id, 1)
+
+
+    def test_sync_result(self):
+        """
+        A method that returns a plain value is answered straight away and the
+        value is returned as is.
+        """
+        ret = self.makeCall('known_return')
+
+        self.assertEqual(ret, 'foo')
+        self.assertEqual(len(self.messages), 1)
+        self.assertEqual(self.receiver._activeCalls, {})
+
+
+    def test_deferred_result(self):
+        """
+        A method that returns a L{defer.Deferred} is answered once it fires.
+        """
+        self.result = defer.Deferred()
+
+        d = self.makeCall('deferred_return')
+
+        self.assertFalse(d.called)
+        self.assertEqual(self.messages, [])
+
+        self.result.callback('bar')
+
+        msg, = self.messages
+
+        self.assertEqual(msg.argv, [None, 'bar'])
+
+        return d
+
+
+    def test_no_result(self):
+        """
+        A call that expects no result is not tracked.
+        """
+        ret = self.receiver.callReceived('known_return', rpc.NO_RESULT)
+
+        self.assertEqual(ret, 'foo')
+        self.assertEqual(self.receiver._activeCalls, {})
+        self.assertEqual(self.messages, [])
+
+
+    def test_cache(self):
+        """
+        The exposed functions are looked up once per class, nothing is cached
+        on the instance.
+        """
+        self.makeCall('known_return')
+
+        functions = SimpleFacilitator.__dict__['__exposed_functions__']
+
+        self.assertIdentical(functions['known_return'],
+            SimpleFacilitator.__dict__['known_return'])
+        self.assertFalse('not_exposed' in functions)
+        self.assertFalse(hasattr(self.receiver, '_exposedMethods'))
@@ -18,12 +18,17 @@
 """
 """
 
+import os
+
 from twisted.trial import unittest
 from twisted.internet import defer, reactor, protocol
 from twisted.test.proto_helpers import StringTransportWithDisconnection, StringIOWithoutClosing
+from pyamf.util import BufferedByteStream
 
-from rtmpy import server, exc, rpc, util
-from rtmpy.protocol.rtmp import message
+from rtmpy import server, exc, rpc, util, vod
+from rtmpy.tests.test_vod import write_flv, sample_tags, FileCache
+from rtmpy.protocol import rtmp
+from rtmpy.protocol.rtmp import message, codec
 
 
 
@@ -503,20 +508,15 @@ class ConnectingTestCase(unittest.TestCase):
 
     def test_invoke(self):
         """
-        Make sure that invoking connect call self.protocol.onConnect
+        Invoking connect calls L{server.NetConnection.onConnect}.
         """
-        my_args = {'foo': 'bar'}
-        self.executed = False
-
-        def connect(args):
-            self.executed = True
-            self.assertEqual(args, my_args)
-
-        self.patch(self.control, 'onConnect', connect)
+        d = self.protocol.nc.onInvoke('connect', 0, [{}], 0)
 
-        d = self.control.onInvoke('connect', 0, [my_args], 0)
+        def cb(res):
+            self.assertEqual(res.result.description,
+                "Bad connect packet (missing 'app' key)")
 
-        return d
+        return d.addCallback(cb)
 
     def test_missing_app_key(self):
         """
@@ -1162,6 +1162,104 @@ class PlayTestCase(ServerFactoryTestCase):
         return d
 
 
+    def test_file(self):
+        """
+        A file is played when there is no stream of that name.
+        """
+        self.app.vodPath = self.mktemp()
+        os.mkdir(self.app.vodPath)
+        write_flv(os.path.join(self.app.vodPath, 'bar.flv'), sample_tags())
+
+        self.assertEqual(self.app.getPlaybackPath('../bar'), None)
+
+        self.connect(self.app, self.protocol)
+        s = self.createStream(self.protocol.streamManager)
+
+        def cb(player):
+            self.assertIsInstance(player, vod.Player)
+            self.assertIdentical(player.subscriber, s)
+            self.assertIdentical(s.source, player)
+            self.assertIdentical(player.cache, self.app.fileCache)
+
+            player.stop()
+            self.app.fileCache.clear()
+
+        return s.play('bar').addCallback(cb)
+
+
+    def test_file_missing(self):
+        """
+        The file is looked up in the thread pool, if it does not exist the
+        stream is waited for as if files were not played.
+        """
+        self.app.vodPath = self.mktemp()
+        self.app.fileCache = FileCache()
+        os.mkdir(self.app.vodPath)
+
+        client = self.connect(self.app, self.protocol)
+        s = self.createStream(self.protocol.streamManager)
+
+        d = s.play('baz')
+
+        self.assertEqual(len(self.app.fileCache.jobs), 1)
+
+        self.app.fileCache.finish()
+
+        self.assertFalse(d.called)
+
+        publisher = self.app.publishStream(client, None, 'baz')
+
+        self.assertTrue(d.called)
+        self.assertTrue(s in publisher.subscribers)
+
+
+    def test_file_closed(self):
+        """
+        A stream closed while its file is being opened releases the player
+        once it has been built.
+        """
+        self.app.vodPath = self.mktemp()
+        self.app.fileCache = FileCache()
+        os.mkdir(self.app.vodPath)
+        write_flv(os.path.join(self.app.vodPath, 'bar.flv'), sample_tags())
+
+        self.connect(self.app, self.protocol)
+        s = self.createStream(self.protocol.streamManager)
+        sent = []
+
+        s.sendStatus = sent.append
+
+        d = s.play('bar')
+        s.closeStream()
+
+        self.assertTrue(d.called)
+
+        cache = self.app.fileCache
+        cache.finish()
+        cache.finish()
+
+        self.assertEqual(len(cache.idle), 1)
+        self.assertEqual(cache.files.values()[0][1], 0)
+        self.assertEqual(s.source, None)
+        self.assertEqual(sent, [])
+
+        cache.clear()
+
+
+    def test_seek_live(self):
+        client = self.connect(self.app, self.protocol)
+        s = self.createStream(self.protocol.streamManager)
+        sent = []
+
+        self.app.publishStream(client, s, 'foo')
+        s.play('foo')
+
+        s.sendStatus = sent.append
+        s.seek(1000)
+
+        self.assertEqual(sent[0].code, 'NetStream.Seek.Failed')
+
+
 
 class Publisher(object):
     """
@@ -1269,3 +1367,319 @@ class SendTestCase(ServerFactoryTestCase):
 
         self.clearMetaData()
         self.assertMetaData({})
+
+
+    def test_not_publishing(self):
+        """
+        Meta data sent to a stream that is not publishing is dropped without
+        being decoded.
+        """
+        self.stream.publisher = None
+
+        self.assertFalse(self.stream.isExposed('@setDataFrame'))
+        self.assertTrue(self.stream.isExposed('@clearDataFrame'))
+
+        self.setMetaData({'foo': 'bar'})
+
+        self.assertEqual(self.publisher.meta_data, None)
+
+
+
+class Subscriber(object):
+    """
+    Records the audio/video data passed to it by a L{server.StreamPublisher}.
+    """
+
+    def __init__(self):
+        self.received = []
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.received.append((data, timestamp))
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.received.append((data, timestamp))
+
+
+
+class StreamListener(object):
+    """
+    Passes the audio/video messages dispatched by a L{codec.Decoder} on to a
+    L{server.StreamPublisher}, like L{server.NetStream} does.
+    """
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+        self.types = []
+
+
+    def getStream(self, streamId):
+        return self
+
+
+    def onVideoData(self, data, timestamp):
+        self.types.append(type(data))
+        self.publisher.videoDataReceived(data, timestamp)
+
+
+    def onAudioData(self, data, timestamp):
+        self.types.append(type(data))
+        self.publisher.audioDataReceived(data, timestamp)
+
+
+
+class StreamPublisherTestCase(unittest.TestCase):
+    """
+    Tests for L{server.StreamPublisher}.
+    """
+
+    def setUp(self):
+        self.publisher = server.StreamPublisher(None, None)
+
+
+    def test_single_subscriber(self):
+        subscriber = Subscriber()
+        self.publisher.addSubscriber(subscriber)
+
+        self.publisher.videoDataReceived('foo', 10)
+
+        self.assertEqual(subscriber.received, [('foo', 10)])
+        self.assertFalse(isinstance(subscriber.received[0][0],
+            codec.PreparedMessage))
+
+
+    def test_fan_out(self):
+        subscribers = [Subscriber(), Subscriber()]
+
+        for subscriber in subscribers:
+            self.publisher.addSubscriber(subscriber)
+
+        self.publisher.videoDataReceived('foo', 10)
+        self.publisher.audioDataReceived('bar', 20)
+
+        video, audio = subscribers[0].received
+
+        self.assertTrue(isinstance(video[0], codec.PreparedMessage))
+        self.assertTrue(isinstance(audio[0], codec.PreparedMessage))
+        self.assertEqual(subscribers[1].received, [('foo', 10), ('bar', 20)])
+        self.assertIdentical(subscribers[1].received[0][0], video[0])
+
+
+    def test_congested(self):
+        subscribers = [Subscriber(), Subscriber()]
+
+        for subscriber in subscribers:
+            self.publisher.addSubscriber(subscriber)
+
+        subscribers[0].paused = True
+
+        self.assertTrue(self.publisher.isCongested(subscribers[0]))
+        self.assertFalse(self.publisher.isCongested(subscribers[1]))
+
+        self.publisher.videoDataReceived('\x27\x01', 10)
+        self.publisher.audioDataReceived('bar', 20)
+
+        self.assertEqual(subscribers[0].received, [('bar', 20)])
+        self.assertEqual(subscribers[1].received,
+            [('\x27\x01', 10), ('bar', 20)])
+
+
+    def test_drop_until_keyframe(self):
+        subscriber = Subscriber()
+        self.publisher.addSubscriber(subscriber)
+        context = self.publisher.subscribers[subscriber]
+
+        subscriber.paused = True
+
+        # avc sequence header, keyframe, inter frame
+        self.publisher.videoDataReceived('\x17\x00', 0)
+        self.publisher.videoDataReceived('\x17\x01', 10)
+        self.publisher.videoDataReceived('\x27\x01', 20)
+
+        self.assertEqual(subscriber.received,
+            [('\x17\x00', 0), ('\x17\x01', 10)])
+        self.assertTrue(context['dropping'])
+
+        subscriber.paused = False
+
+        # still dropping until the next keyframe
+        self.publisher.videoDataReceived('\x27\x01', 30)
+        self.publisher.videoDataReceived('\x57', 40)
+        self.publisher.videoDataReceived('\x17\x01', 50)
+        self.publisher.videoDataReceived('\x27\x01', 60)
+
+        self.assertEqual(subscriber.received[2:],
+            [('\x57', 40), ('\x17\x01', 50), ('\x27\x01', 60)])
+        self.assertFalse(context['dropping'])
+        self.assertEqual(context['dropped'], 2)
+
+
+    def test_gop_replay(self):
+        subscriber = Subscriber()
+
+        self.publisher.videoDataReceived('\x17\x00', 0)
+        self.publisher.audioDataReceived('\xaf\x00', 0)
+        self.publisher.videoDataReceived('\x27\x01', 100)
+        self.publisher.videoDataReceived('\x17\x01', 200)
+        self.publisher.audioDataReceived('\xaf\x01', 210)
+        self.publisher.videoDataReceived('\x27\x01', 240)
+
+        self.publisher.addSubscriber(subscriber)
+
+        self.assertEqual(subscriber.received, [
+            ('\x17\x00', 0),
+            ('\xaf\x00', 0),
+            ('\x17\x01', 0),
+            ('\xaf\x01', 10),
+            ('\x27\x01', 40)
+        ])
+
+        self.publisher.videoDataReceived('\x27\x01', 280)
+
+        self.assertEqual(subscriber.received[-1], ('\x27\x01', 80))
+
+
+    def test_sequence_headers(self):
+        self.publisher.cache.maxBytes = 0
+
+        self.publisher.videoDataReceived('\x17\x00\x01', 0)
+        self.publisher.audioDataReceived('\xaf\x00\x01', 0)
+        self.publisher.videoDataReceived('\x17\x01', 100)
+        self.publisher.audioDataReceived('\xaf\x01', 110)
+
+        self.assertEqual(self.publisher.videoHeader, '\x17\x00\x01')
+        self.assertEqual(self.publisher.audioHeader, '\xaf\x00\x01')
+
+        # the encoder changed its configuration
+        self.publisher.videoDataReceived('\x17\x00\x02', 200)
+
+        subscriber = Subscriber()
+        self.publisher.addSubscriber(subscriber)
+
+        self.assertEqual(subscriber.received,
+            [('\x17\x00\x02', 0), ('\xaf\x00\x01', 0)])
+
+        self.publisher.videoDataReceived('\x27\x01', 250)
+
+        self.assertEqual(subscriber.received[-1], ('\x27\x01', 50))
+
+
+    def test_multi_frame(self):
+        """
+        Payloads larger than the frame size are reassembled by the codec and
+        published as a C{str}.
+        """
+        output = BufferedByteStream()
+        encoder = codec.Encoder(output)
+
+        listener = StreamListener(self.publisher)
+        decoder = codec.Decoder(rtmp.MessageDispatcher(None), listener)
+
+        subscriber = Subscriber()
+        self.publisher.addSubscriber(subscriber)
+
+        videoHeader = '\x17\x00' + 'h' * 298
+        audioHeader = '\xaf\x00' + 'a' * 298
+        keyframe = '\x17\x01' + 'k' * 298
+
+        encoder.send(videoHeader, message.VIDEO_DATA, 1, 0)
+        encoder.send(audioHeader, message.AUDIO_DATA, 1, 0)
+        encoder.send(keyframe, message.VIDEO_DATA, 1, 10)
+
+        while True:
+            try:
+                encoder.next()
+            except StopIteration:
+                break
+
+        decoder.send(output.getvalue())
+        decoder.decodeAll()
+
+        self.assertEqual(listener.types, [str] * 3)
+
+        self.assertEqual(subscriber.received,
+            [(videoHeader, 0), (audioHeader, 0), (keyframe, 10)])
+        self.assertEqual(self.publisher.videoHeader, videoHeader)
+        self.assertEqual(self.publisher.audioHeader, audioHeader)
+        self.assertEqual(self.publisher.cache.getPackets(),
+            [(True, keyframe, 10)])
+
+
+
+class GOPCacheTestCase(unittest.TestCase):
+    """
+    Tests for L{server.GOPCache}.
+    """
+
+    def setUp(self):
+        self.cache = server.GOPCache()
+
+
+    def test_empty(self):
+        self.assertEqual(self.cache.start, None)
+        self.assertEqual(self.cache.getPackets(), [])
+
+
+    def test_wait_for_keyframe(self):
+        self.cache.addVideo('\x27\x01', 0)
+        self.cache.addAudio('\xaf\x01', 10)
+
+        self.assertEqual(self.cache.getPackets(), [])
+
+        self.cache.addVideo('\x17\x01', 20)
+        self.cache.addAudio('\xaf\x01', 30)
+
+        self.assertEqual(self.cache.start, 20)
+        self.assertEqual(self.cache.getPackets(),
+            [(True, '\x17\x01', 20), (False, '\xaf\x01', 30)])
+        self.assertEqual(self.cache.size, 4)
+
+
+    def test_new_gop(self):
+        self.cache.addVideo('\x17\x01', 0)
+        self.cache.addVideo('\x27\x01', 10)
+        self.cache.addVideo('\x17\x01', 20)
+
+        self.assertEqual(self.cache.getPackets(), [(True, '\x17\x01', 20)])
+
+
+    def test_sequence_headers(self):
+        self.cache.addVideo('\x17\x00', 0)
+        self.cache.addAudio('\xaf\x00', 0)
+
+        self.assertEqual(self.cache.start, None)
+        self.assertEqual(self.cache.getPackets(), [])
+
+        self.cache.addVideo('\x17\x01', 10)
+        self.cache.addVideo('\x17\x00', 20)
+        self.cache.addAudio('\xaf\x00', 20)
+
+        self.assertEqual(self.cache.getPackets(), [(True, '\x17\x01', 10)])
+
+
+    def test_max_bytes(self):
+        self.cache.maxBytes = 5
+
+        self.cache.addVideo('\x17\x01', 0)
+        self.cache.addVideo('\x27\x01', 10)
+        self.cache.addVideo('\x27\x01', 20)
+
+        self.assertEqual(self.cache.getPackets(), [])
+
+        self.cache.addVideo('\x27\x01', 30)
+
+        self.assertEqual(self.cache.getPackets(), [])
+
+
+    def test_max_duration(self):
+        self.cache.maxDuration = 100
+
+        self.cache.addVideo('\x17\x01', 0)
+        self.cache.addVideo('\x27\x01', 100)
+
+        self.assertEqual(len(self.cache.getPackets()), 2)
+
+        self.cache.addVideo('\x27\x01', 101)
+
+        self.assertEqual(self.cache.getPackets(), [])
@@ -3,7 +3,10 @@ Tests for L{rtmpy.core.status}
 """
 
 from twisted.trial import unittest
+import pyamf
+from pyamf.util import BufferedByteStream
 
+from rtmpy import message, rpc
 from rtmpy.core import status
 
 
@@ -241,6 +244,86 @@ class AMFEncodingTestCase(unittest.TestCase):
 
 
 
+class TemplateTestCase(unittest.TestCase):
+    """
+    Tests for L{status.Template}.
+    """
+
+
+    def test_encode(self):
+        t = status.Template(status.STATUS_STATUS, 'NetStream.Play.Start')
+        blob = t.encode('Started playing foo', clientid=3, foo='bar')
+
+        self.assertTrue(blob.startswith('\x03\x00\x05level'))
+        self.assertTrue(blob.endswith('\x00\x00\x09'))
+
+        decoded = pyamf.decode(blob, encoding=pyamf.AMF0).next()
+
+        self.assertEqual(decoded, {
+            'level': 'status',
+            'code': 'NetStream.Play.Start',
+            'description': 'Started playing foo',
+            'clientid': 3,
+            'foo': 'bar'
+        })
+
+
+    def test_invoke(self):
+        """
+        The pre-encoded onStatus body must carry the same values as the
+        C{Invoke} it replaces, with the keys in level, code, description order
+        followed by the extra context sorted by key.
+        """
+        t = status.Template(status.STATUS_STATUS, 'NetStream.Play.Start')
+        on_status = message.Template(
+            message.Invoke, 'onStatus', rpc.NO_RESULT, None)
+
+        prepared = on_status.build(
+            t.encode('Started playing foo', clientid='abc'))
+
+        invoke = message.Invoke('onStatus', rpc.NO_RESULT, None,
+            status.status('NetStream.Play.Start', 'Started playing foo',
+                clientid='abc'))
+        stream = BufferedByteStream()
+        invoke.encode(stream)
+
+        self.assertEqual(prepared.__data_type__, invoke.__data_type__)
+        self.assertEqual(len(prepared.body), len(stream.getvalue()))
+
+        self.assertEqual(prepared.body,
+            '\x02\x00\x08onStatus'
+            '\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+            '\x05'
+            '\x03'
+            '\x00\x05level\x02\x00\x06status'
+            '\x00\x04code\x02\x00\x14NetStream.Play.Start'
+            '\x00\x0bdescription\x02\x00\x13Started playing foo'
+            '\x00\x08clientid\x02\x00\x03abc'
+            '\x00\x00\x09')
+
+        decoded = message.Invoke()
+        decoded.decode(BufferedByteStream(prepared.body))
+
+        self.assertEqual(decoded.name, invoke.name)
+        self.assertEqual(decoded.id, invoke.id)
+        self.assertEqual(decoded.argv[0], None)
+        self.assertEqual(decoded.argv[1], {
+            'level': 'status',
+            'code': 'NetStream.Play.Start',
+            'description': 'Started playing foo',
+            'clientid': 'abc'
+        })
+
+
+    def test_code_by_class(self):
+        from rtmpy import exc
+
+        t = status.Template(status.STATUS_ERROR, exc.StreamNotFound)
+
+        self.assertEqual(t.code, exc.codeByClass(exc.StreamNotFound))
+
+
+
 class TestRuntimeError(RuntimeError):
     """
     """
@@ -0,0 +1,532 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.vod}.
+"""
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import task, defer
+
+from rtmpy import vod, flv, message
+
+
+#: An AVC sequence header, keyframe and inter frame.
+VIDEO_HEADER = '\x17\x00header'
+KEYFRAME = '\x17\x01key'
+INTER_FRAME = '\x27\x01inter'
+
+
+def write_flv(path, tags):
+    """
+    Writes the C{(tagType, timestamp, data)} C{tags} to the FLV file C{path}.
+    """
+    parts = [flv.FILE_HEADER]
+
+    for tagType, timestamp, data in tags:
+        parts.append(flv.pack_tag_header(tagType, len(data), timestamp))
+        parts.append(data)
+        parts.append(flv.previous_tag_size.pack(len(data) +
+            flv.TAG_HEADER_SIZE))
+
+    f = open(path, 'wb')
+    f.write(''.join(parts))
+    f.close()
+
+
+def sample_tags():
+    """
+    Meta data and a sequence header, followed by 3 seconds of video with a
+    keyframe every second and audio.
+    """
+    tags = [
+        (flv.TAG_SCRIPT, 0, message.encode_amf0('onMetaData',
+            {'duration': 3})),
+        (flv.TAG_VIDEO, 0, VIDEO_HEADER),
+    ]
+
+    for timestamp in range(0, 3000, 500):
+        if timestamp % 1000 == 0:
+            tags.append((flv.TAG_VIDEO, timestamp, KEYFRAME))
+        else:
+            tags.append((flv.TAG_VIDEO, timestamp, INTER_FRAME))
+
+        tags.append((flv.TAG_AUDIO, timestamp, 'audio'))
+
+    return tags
+
+
+def offsets(tags):
+    """
+    Returns the offsets of C{tags} in the file written by L{write_flv}.
+    """
+    result = []
+    pos = len(flv.FILE_HEADER)
+
+    for tagType, timestamp, data in tags:
+        result.append(pos)
+        pos += flv.TAG_HEADER_SIZE + len(data) + 4
+
+    return result
+
+
+
+class Subscriber(object):
+    """
+    Records what a L{vod.Player} sends.
+    """
+
+    paused = False
+
+    def __init__(self):
+        self.received = []
+        self.unpublished = False
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.received.append(('video', data, timestamp))
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.received.append(('audio', data, timestamp))
+
+
+    def onMetaData(self, data):
+        self.received.append(('meta', data))
+
+
+    def unpublish(self):
+        self.unpublished = True
+
+
+
+class IndexTestCase(unittest.TestCase):
+    """
+    Tests for L{vod.Index}.
+    """
+
+    def test_find(self):
+        index = vod.Index([0, 1000, 2000], [13, 100, 200])
+
+        self.assertEqual(index.find(0), (0, 13))
+        self.assertEqual(index.find(999), (0, 13))
+        self.assertEqual(index.find(1000), (1000, 100))
+        self.assertEqual(index.find(5000), (2000, 200))
+        self.assertEqual(index.find(-1), (0, 13))
+        self.assertEqual(vod.Index().find(0), None)
+
+    def test_encode(self):
+        index = vod.Index([0, 1000], [13, 100], [20])
+        data = index.encode(300, 12.5)
+
+        decoded = vod.Index.decode(data, 300, 12.5)
+
+        self.assertEqual(decoded.timestamps, [0, 1000])
+        self.assertEqual(decoded.offsets, [13, 100])
+        self.assertEqual(decoded.headers, [20])
+
+    def test_stale(self):
+        data = vod.Index([0], [13]).encode(300, 12.5)
+
+        self.assertEqual(vod.Index.decode(data, 301, 12.5), None)
+        self.assertEqual(vod.Index.decode(data, 300, 13.0), None)
+        self.assertEqual(vod.Index.decode(data[:-1], 300, 12.5), None)
+        self.assertEqual(vod.Index.decode('', 300, 12.5), None)
+
+
+
+class FLVFileTestCase(unittest.TestCase):
+    """
+    Tests for L{vod.FLVFile}.
+    """
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.tags = sample_tags()
+        self.offsets = offsets(self.tags)
+
+        write_flv(self.path, self.tags)
+
+        self.file = vod.FLVFile(self.path)
+        self.file.open()
+
+        self.addCleanup(self.file.close)
+
+    def test_not_flv(self):
+        path = self.mktemp()
+        open(path, 'wb').write('x' * 20)
+
+        self.assertRaises(IOError, vod.FLVFile(path).open)
+
+    def test_read(self):
+        self.assertEqual(self.file.start, len(flv.FILE_HEADER))
+
+        tag = self.file.readTag(self.offsets[1])
+
+        self.assertEqual(tag, (flv.TAG_VIDEO, 0, VIDEO_HEADER,
+            self.offsets[2]))
+        self.assertEqual(self.file.readTag(self.file.size), None)
+
+    def test_build_index(self):
+        index = self.file.buildIndex()
+
+        self.assertEqual(index.timestamps, [0, 1000, 2000])
+        self.assertEqual(index.offsets,
+            [self.offsets[2], self.offsets[6], self.offsets[10]])
+        self.assertEqual(index.headers, self.offsets[:2])
+
+    def test_audio_only(self):
+        path = self.mktemp()
+        write_flv(path, [(flv.TAG_AUDIO, t, 'a') for t in range(0, 3000, 400)])
+
+        f = vod.FLVFile(path)
+        f.open()
+        self.addCleanup(f.close)
+
+        self.assertEqual(f.buildIndex().timestamps, [0, 1200, 2400])
+
+    def test_truncated(self):
+        path = self.mktemp()
+        write_flv(path, self.tags)
+
+        data = open(path, 'rb').read()
+        open(path, 'wb').write(data[:-5])
+
+        f = vod.FLVFile(path)
+        f.open()
+        self.addCleanup(f.close)
+
+        self.assertEqual(len(f.buildIndex().timestamps), 3)
+        self.assertEqual(f.readTag(self.offsets[-1]), None)
+
+    def test_load_index(self):
+        index = self.file.loadIndex()
+
+        self.assertIdentical(self.file.index, index)
+        self.assertTrue(os.path.exists(self.path + '.idx'))
+
+        # the saved index is used from now on
+        f = vod.FLVFile(self.path)
+        f.open()
+        self.addCleanup(f.close)
+
+        f.buildIndex = lambda: self.fail('Index rebuilt')
+
+        self.assertEqual(f.loadIndex().offsets, index.offsets)
+
+    def test_load_stale_index(self):
+        open(self.path + '.idx', 'wb').write(
+            vod.Index([0], [13]).encode(0, 0))
+
+        self.assertEqual(self.file.loadIndex().timestamps, [0, 1000, 2000])
+
+    def test_seek(self):
+        self.file.loadIndex()
+
+        self.assertEqual(self.file.seek(1500), (1000, self.offsets[6]))
+        self.assertEqual(self.file.seek(0), (0, self.offsets[2]))
+
+
+
+class PlayerTestCase(unittest.TestCase):
+    """
+    Tests for L{vod.Player}.
+    """
+
+    def setUp(self):
+        path = self.mktemp()
+        write_flv(path, sample_tags())
+
+        self.file = vod.FLVFile(path)
+        self.file.open()
+        self.file.loadIndex()
+
+        self.clock = task.Clock()
+        self.player = vod.Player(self.file, self.clock)
+        self.player.preload = 0
+        self.subscriber = Subscriber()
+
+        self.addCleanup(self.player.stop)
+
+    def test_pacing(self):
+        self.player.addSubscriber(self.subscriber)
+
+        self.assertEqual(self.subscriber.received, [])
+
+        self.clock.advance(0)
+
+        self.assertEqual(self.subscriber.received, [
+            ('meta', {'duration': 3}),
+            ('video', VIDEO_HEADER, 0),
+            ('video', KEYFRAME, 0),
+            ('audio', 'audio', 0),
+        ])
+
+        self.clock.advance(0.4)
+        self.assertEqual(len(self.subscriber.received), 4)
+
+        self.clock.advance(0.1)
+        self.assertEqual(self.subscriber.received[4:], [
+            ('video', INTER_FRAME, 500),
+            ('audio', 'audio', 500),
+        ])
+
+    def test_preload(self):
+        self.player.preload = 1000
+        self.player.addSubscriber(self.subscriber)
+        self.clock.advance(0)
+
+        self.assertEqual(self.subscriber.received[-1], ('audio', 'audio', 1000))
+
+    def test_end(self):
+        self.player.addSubscriber(self.subscriber)
+        self.clock.advance(0)
+
+        self.clock.pump([0.5] * 6)
+
+        self.assertTrue(self.subscriber.unpublished)
+        self.assertEqual(self.player.subscribers, {})
+        self.assertEqual(self.file.data, None)
+
+    def test_seek(self):
+        self.player.addSubscriber(self.subscriber)
+        self.clock.advance(0)
+
+        del self.subscriber.received[:]
+
+        self.assertEqual(self.player.seek(2200), 2000)
+        self.clock.advance(0)
+
+        # the headers come first, with the timestamp of the keyframe
+        self.assertEqual(self.subscriber.received, [
+            ('meta', {'duration': 3}),
+            ('video', VIDEO_HEADER, 2000),
+            ('video', KEYFRAME, 2000),
+            ('audio', 'audio', 2000),
+        ])
+
+    def test_paused(self):
+        self.player.addSubscriber(self.subscriber)
+        self.clock.advance(0)
+
+        self.subscriber.paused = True
+        self.clock.pump([0.1] * 10)
+
+        self.assertEqual(len(self.subscriber.received), 4)
+
+        # the clock was held while paused, the frames due when the pause was
+        # noticed are sent next
+        self.subscriber.paused = False
+        self.clock.pump([0.1, 0.1])
+
+        self.assertEqual(self.subscriber.received[-1], ('audio', 'audio', 500))
+        self.assertEqual(len(self.subscriber.received), 6)
+
+        self.clock.advance(0.3)
+
+        self.assertEqual(len(self.subscriber.received), 6)
+
+    def test_remove(self):
+        self.player.addSubscriber(self.subscriber)
+        self.player.removeSubscriber(self.subscriber)
+
+        self.clock.advance(1)
+
+        self.assertEqual(self.subscriber.received, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_error(self):
+        def fail(data, timestamp):
+            raise RuntimeError
+
+        self.subscriber.audioDataReceived = fail
+        self.player.addSubscriber(self.subscriber)
+        self.clock.advance(0)
+
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(self.player.subscribers, {})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
+class FileCache(vod.FileCache):
+    """
+    Holds on to the jobs for the thread pool until L{finish} is called.
+    """
+
+    def __init__(self):
+        vod.FileCache.__init__(self)
+
+        self.jobs = []
+        self.opened = []
+
+
+    def deferToThread(self, f, *args):
+        d = defer.Deferred()
+
+        self.jobs.append((f, args, d))
+
+        return d
+
+
+    def openFile(self, path):
+        self.opened.append(path)
+
+        return vod.FileCache.openFile(self, path)
+
+
+    def finish(self):
+        while self.jobs:
+            f, args, d = self.jobs.pop(0)
+
+            try:
+                result = f(*args)
+            except:
+                d.errback()
+            else:
+                d.callback(result)
+
+
+
+class FileCacheTestCase(unittest.TestCase):
+    """
+    Tests for L{vod.FileCache}.
+    """
+
+    def setUp(self):
+        self.cache = FileCache()
+        self.paths = []
+
+        for i in range(3):
+            path = self.mktemp()
+            write_flv(path, sample_tags())
+
+            self.paths.append(path)
+
+        self.addCleanup(self.cache.clear)
+
+    def acquire(self, path):
+        result = []
+
+        self.cache.acquire(path).addBoth(result.append)
+        self.cache.finish()
+
+        return result[0]
+
+    def test_shared(self):
+        """
+        Concurrent plays of the same file share one mapping and index.
+        """
+        results = []
+
+        self.cache.acquire(self.paths[0]).addCallback(results.append)
+        self.cache.acquire(self.paths[0]).addCallback(results.append)
+
+        self.cache.finish()
+
+        a, b = results
+
+        self.assertIdentical(a, b)
+        self.assertNotEqual(a.index, None)
+        self.assertIdentical(self.acquire(self.paths[0]), a)
+        self.assertEqual(self.cache.opened, [self.paths[0]])
+
+        key = self.cache.keys[a]
+
+        self.assertEqual(self.cache.files[key][1], 3)
+
+    def test_thread(self):
+        """
+        The file is looked up on disk in the thread pool, not on the reactor
+        thread.
+        """
+        results = []
+
+        self.cache.acquire(self.paths[0]).addCallback(results.append)
+
+        (f, args, d), = self.cache.jobs
+
+        self.assertIdentical(f, vod.get_mtime)
+        self.assertEqual(args, (self.paths[0],))
+        self.assertEqual(results, [])
+        self.assertEqual(self.cache.opened, [])
+
+        self.cache.finish()
+
+        self.assertEqual(len(results), 1)
+
+    def test_release(self):
+        f = self.acquire(self.paths[0])
+        self.acquire(self.paths[0])
+
+        self.cache.release(f)
+
+        self.assertEqual(self.cache.idle.keys(), [])
+
+        self.cache.release(f)
+
+        self.assertEqual(self.cache.idle.keys(), [self.cache.keys[f]])
+        self.assertNotEqual(f.data, None)
+
+        # an idle file is reused
+        self.assertIdentical(self.acquire(self.paths[0]), f)
+        self.assertEqual(self.cache.idle.keys(), [])
+
+    def test_evict(self):
+        self.cache.maxIdle = 1
+
+        a = self.acquire(self.paths[0])
+        b = self.acquire(self.paths[1])
+
+        self.cache.release(a)
+        self.cache.release(b)
+
+        self.assertEqual(a.data, None)
+        self.assertNotEqual(b.data, None)
+        self.assertFalse(a in self.cache.keys)
+
+    def test_changed(self):
+        """
+        A file that has changed on disk is opened afresh.
+        """
+        a = self.acquire(self.paths[0])
+        self.cache.release(a)
+
+        st = os.stat(self.paths[0])
+        os.utime(self.paths[0], (st.st_atime, st.st_mtime + 10))
+
+        b = self.acquire(self.paths[0])
+
+        self.assertNotIdentical(a, b)
+        self.assertEqual(a.data, None)
+        self.assertEqual(len(self.cache.files), 1)
+
+    def test_missing(self):
+        result = self.acquire(self.mktemp())
+
+        self.assertTrue(result.check(IOError))
+        self.assertEqual(self.cache.files, {})
+
+    def test_player(self):
+        f = self.acquire(self.paths[0])
+        player = vod.Player(f, task.Clock(), self.cache)
+
+        player.addSubscriber(Subscriber())
+        player.stop()
+
+        self.assertEqual(self.cache.idle.keys(), [self.cache.keys[f]])
+        self.assertNotEqual(f.data, None)
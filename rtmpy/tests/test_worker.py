@@ -0,0 +1,490 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.worker}.
+"""
+
+import sys
+import struct
+
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+from twisted.internet import error, stdio
+from twisted.python import failure, log
+
+from rtmpy import server, worker, exc
+
+
+def framed(*messages):
+    """
+    Returns C{messages} as they are written to the pipe.
+    """
+    return ''.join([struct.pack('!L', len(data)) + data for data in messages])
+
+
+class Subscriber(object):
+    """
+    Records the audio/video data passed to it by a L{server.StreamPublisher}.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.unpublished = False
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.received.append(('video', data, timestamp))
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.received.append(('audio', data, timestamp))
+
+
+    def onMetaData(self, data):
+        self.received.append(('meta', data))
+
+
+    def unpublish(self):
+        self.unpublished = True
+
+
+
+class PublishingStream(object):
+    """
+    Stands in for the L{server.NetStream} that publishes a stream.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.statuses = []
+
+
+    def publishingStopped(self, s):
+        self.statuses.append(s)
+
+
+
+class Port(object):
+    """
+    Stands in for the listening port of a L{worker.Master}.
+    """
+
+    addressFamily = 2
+
+    def __init__(self):
+        self.reading = True
+
+    def fileno(self):
+        return 7
+
+    def stopReading(self):
+        self.reading = False
+
+
+class Reactor(object):
+    """
+    Records the calls made to the reactor by L{worker.Master} and
+    L{worker.run_worker}.
+    """
+
+    running = False
+
+    def __init__(self):
+        self.processes = []
+        self.adopted = []
+        self.port = Port()
+
+    def listenTCP(self, port, factory, backlog=50, interface=''):
+        return self.port
+
+    def spawnProcess(self, processProtocol, executable, args=(), env={},
+                     path=None, uid=None, gid=None, usePTY=0, childFDs=None):
+        self.processes.append((processProtocol, executable, args, childFDs))
+
+    def adoptStreamPort(self, fd, family, factory):
+        self.adopted.append((fd, family, factory))
+
+    def run(self):
+        self.running = True
+
+
+def makeFactory():
+    return server.ServerFactory({'live': server.Application()})
+
+
+class MessageTestCase(unittest.TestCase):
+    """
+    Tests for L{worker.encode_message} and L{worker.decode_message}.
+    """
+
+    def test_encode(self):
+        self.assertEqual(worker.encode_message(worker.VIDEO, 'app', 'foo', 10,
+            'bar'), '\x03\x00\x00\x00\x0a\x00\x03\x00\x03appfoobar')
+
+    def test_round_trip(self):
+        data = worker.encode_message(worker.AUDIO, 'live', 'stream', 0x12345,
+            '\x00' * 10)
+
+        self.assertEqual(worker.decode_message(data),
+            (worker.AUDIO, 'live', 'stream', 0x12345, '\x00' * 10))
+        self.assertEqual(worker.decode_key(data), ('live', 'stream'))
+
+
+
+class WorkerRelayTestCase(unittest.TestCase):
+    """
+    Tests for L{worker.WorkerRelay}.
+    """
+
+    def setUp(self):
+        self.app = server.Application()
+        self.factory = server.ServerFactory({'live': self.app})
+        self.relay = self.factory.relay = worker.WorkerRelay(self.factory)
+        self.transport = StringTransport()
+
+        self.relay.makeConnection(self.transport)
+
+    def receive(self, *args):
+        self.relay.sendString = self.relay.stringReceived
+        self.relay.sendMessage(*args)
+        del self.relay.sendString
+
+    def sent(self):
+        messages = []
+        data = self.transport.value()
+
+        while data:
+            size, = struct.unpack('!L', data[:4])
+            messages.append(worker.decode_message(data[4:4 + size]))
+            data = data[4 + size:]
+
+        return messages
+
+    def test_publish(self):
+        client = self.app.buildClient(None, {})
+        publisher = self.app.publishStream(client, None, 'foo')
+
+        publisher.onMetaData({'width': 320})
+        publisher.videoDataReceived('video', 0)
+        publisher.audioDataReceived('audio', 10)
+        publisher.unpublish()
+
+        self.assertEqual(self.sent(), [
+            (worker.PUBLISH, 'live', 'foo', 0, ''),
+            (worker.META, 'live', 'foo', 0,
+                '\x03\x00\x05width\x00@t\x00\x00\x00\x00\x00\x00\x00\x00\x09'),
+            (worker.VIDEO, 'live', 'foo', 0, 'video'),
+            (worker.AUDIO, 'live', 'foo', 10, 'audio'),
+            (worker.UNPUBLISH, 'live', 'foo', 0, ''),
+        ])
+
+    def test_relayed(self):
+        received = []
+
+        self.app.whenPublished('foo', received.append)
+        self.receive(worker.PUBLISH, 'live', 'foo')
+
+        publisher = self.app.streams['foo']
+        subscriber = Subscriber()
+
+        self.assertEqual(received, [publisher])
+        self.assertIdentical(self.relay.publishers[('live', 'foo')], publisher)
+
+        publisher.addSubscriber(subscriber)
+
+        self.receive(worker.META, 'live', 'foo', 0,
+            '\x03\x00\x05width\x00@t\x00\x00\x00\x00\x00\x00\x00\x00\x09')
+        self.receive(worker.VIDEO, 'live', 'foo', 0, 'video')
+        self.receive(worker.AUDIO, 'live', 'foo', 10, 'audio')
+        self.receive(worker.UNPUBLISH, 'live', 'foo')
+
+        self.assertEqual(subscriber.received, [
+            ('meta', {'width': 320}),
+            ('video', 'video', 0),
+            ('audio', 'audio', 10),
+        ])
+        self.assertTrue(subscriber.unpublished)
+        self.assertEqual(self.app.streams, {})
+        self.assertEqual(self.relay.publishers, {})
+        # nothing is echoed back to the master
+        self.assertEqual(self.transport.value(), '')
+
+    def test_flow_control(self):
+        """
+        While the pipe to the master is full, the publisher drops video for
+        the relay like it does for any congested subscriber.
+        """
+        client = self.app.buildClient(None, {})
+        publisher = self.app.publishStream(client, None, 'foo')
+
+        self.assertIdentical(self.transport.producer, self.relay)
+        self.assertTrue(self.transport.streaming)
+
+        self.transport.clear()
+        self.relay.pauseProducing()
+
+        publisher.videoDataReceived('\x27inter', 0)
+        publisher.audioDataReceived('audio', 10)
+
+        self.relay.resumeProducing()
+
+        publisher.videoDataReceived('\x27inter', 20)
+        publisher.videoDataReceived('\x17key', 30)
+
+        self.assertEqual(self.sent(), [
+            (worker.AUDIO, 'live', 'foo', 10, 'audio'),
+            (worker.VIDEO, 'live', 'foo', 30, '\x17key'),
+        ])
+
+    def test_rejected(self):
+        """
+        The master rejects a stream published to this worker when another
+        worker published the same name first.
+        """
+        client = self.app.buildClient(None, {})
+        stream = PublishingStream(client)
+        publisher = self.app.publishStream(client, stream, 'foo')
+        subscriber = Subscriber()
+
+        publisher.addSubscriber(subscriber)
+        self.transport.clear()
+
+        self.receive(worker.REJECT, 'live', 'foo')
+
+        self.assertEqual(self.app.streams, {})
+        self.assertEqual(publisher.subscribers, {})
+        self.assertTrue(subscriber.unpublished)
+        self.assertEqual([s.code for s in stream.statuses],
+            ['NetStream.Publish.BadName'])
+
+        # the local stream is not relayed any more
+        publisher.videoDataReceived('video', 0)
+
+        self.assertEqual(self.transport.value(), '')
+
+        # the master relays the stream that was published first
+        self.receive(worker.PUBLISH, 'live', 'foo')
+
+        self.assertIdentical(self.app.streams['foo'],
+            self.relay.publishers[('live', 'foo')])
+
+    def test_relayed_name_in_use(self):
+        self.receive(worker.PUBLISH, 'live', 'foo')
+
+        client = self.app.buildClient(None, {})
+
+        self.assertRaises(exc.BadNameError, self.app.publishStream, client,
+            None, 'foo')
+
+    def test_unknown_application(self):
+        self.receive(worker.PUBLISH, 'vod', 'foo')
+        self.receive(worker.VIDEO, 'vod', 'foo', 0, 'video')
+
+        self.assertEqual(self.relay.publishers, {})
+
+    def test_connection_lost(self):
+        self.receive(worker.PUBLISH, 'live', 'foo')
+
+        self.relay.connectionLost(failure.Failure(error.ConnectionDone()))
+
+        self.assertEqual(self.app.streams, {})
+
+
+
+class MasterTestCase(unittest.TestCase):
+    """
+    Tests for L{worker.Master}.
+    """
+
+    def setUp(self):
+        self.master = worker.Master('foo.bar', workers=2)
+        self.master.running = False
+
+    def connectWorker(self):
+        relay = worker.MasterRelay(self.master)
+        relay.makeConnection(StringTransport())
+
+        return relay
+
+    def test_default_workers(self):
+        self.assertTrue(worker.Master('foo.bar').workers >= 1)
+
+    def test_listen(self):
+        reactor = Reactor()
+        master = worker.Master('foo.bar', workers=2, reactor=reactor)
+
+        self.assertIdentical(master.listenTCP(1935), reactor.port)
+        self.assertFalse(reactor.port.reading)
+        self.assertTrue(master.running)
+        self.assertEqual(len(reactor.processes), 2)
+
+    def test_spawn(self):
+        reactor = Reactor()
+        master = worker.Master('foo.bar', workers=1, reactor=reactor)
+        master.port = reactor.port
+
+        master.spawnWorker()
+
+        processProtocol, executable, args, childFDs = reactor.processes[0]
+
+        self.assertEqual(executable, sys.executable)
+        self.assertEqual(args, [sys.executable, '-m', 'rtmpy.worker',
+            'foo.bar', '7', '2'])
+        self.assertEqual(childFDs, {0: 'w', 1: 'r', 2: 2, 7: 7})
+
+        process = StringTransport()
+        processProtocol.makeConnection(process)
+
+        relay, = master.relays
+
+        self.assertTrue(isinstance(relay, worker.MasterRelay))
+        self.assertIdentical(process.producer, relay)
+
+    def test_restart(self):
+        reactor = Reactor()
+        master = worker.Master('foo.bar', workers=1, reactor=reactor)
+        master.port = reactor.port
+        master.running = True
+
+        relay = worker.MasterRelay(master)
+        relay.makeConnection(StringTransport())
+        relay.connectionLost(failure.Failure(error.ProcessDone(0)))
+
+        self.assertEqual(master.relays, [])
+        self.assertEqual(len(reactor.processes), 1)
+
+    def test_flow_control(self):
+        """
+        Video for a worker whose pipe is full is dropped until the next
+        keyframe, the other workers are not affected.
+        """
+        a, b, c = [self.connectWorker() for i in range(3)]
+
+        def video(data):
+            return worker.encode_message(worker.VIDEO, 'live', 'foo', 0, data)
+
+        audio = worker.encode_message(worker.AUDIO, 'live', 'foo', 0, 'audio')
+
+        b.pauseProducing()
+
+        self.master.messageReceived(a, video('\x27inter'))
+        self.master.messageReceived(a, audio)
+
+        b.resumeProducing()
+
+        self.master.messageReceived(a, video('\x27inter'))
+        self.master.messageReceived(a, video('\x17key'))
+
+        self.assertEqual(b.transport.value(), framed(audio, video('\x17key')))
+        self.assertEqual(c.transport.value(), framed(video('\x27inter'),
+            audio, video('\x27inter'), video('\x17key')))
+        self.assertEqual(b.dropped, 2)
+        self.assertEqual(b.dropping, set())
+
+    def test_forward(self):
+        a, b, c = [self.connectWorker() for i in range(3)]
+        data = worker.encode_message(worker.VIDEO, 'live', 'foo', 0, 'video')
+
+        a.dataReceived(framed(data))
+
+        self.assertEqual(a.transport.value(), '')
+        self.assertEqual(b.transport.value(), framed(data))
+        self.assertEqual(c.transport.value(), framed(data))
+
+    def test_replay(self):
+        a = self.connectWorker()
+
+        publish = worker.encode_message(worker.PUBLISH, 'live', 'foo')
+        meta = worker.encode_message(worker.META, 'live', 'foo', 0, 'bar')
+
+        self.master.messageReceived(a, publish)
+        self.master.messageReceived(a, meta)
+        self.master.messageReceived(a, meta)
+
+        b = self.connectWorker()
+
+        self.assertEqual(b.transport.value(), framed(publish, meta))
+
+    def test_conflict(self):
+        """
+        The first worker to publish a name keeps it, the others are rejected.
+        """
+        a, b, c = [self.connectWorker() for i in range(3)]
+
+        publish = worker.encode_message(worker.PUBLISH, 'live', 'foo')
+        meta = worker.encode_message(worker.META, 'live', 'foo', 0, 'bar')
+
+        self.master.messageReceived(a, publish)
+        self.master.messageReceived(a, meta)
+
+        for relay in (a, b, c):
+            relay.transport.clear()
+
+        self.master.messageReceived(b, publish)
+        self.master.messageReceived(b, worker.encode_message(worker.VIDEO,
+            'live', 'foo', 0, 'video'))
+        self.master.messageReceived(b, worker.encode_message(
+            worker.UNPUBLISH, 'live', 'foo'))
+
+        self.assertEqual(a.transport.value(), '')
+        self.assertEqual(c.transport.value(), '')
+        self.assertEqual(b.transport.value(), framed(
+            worker.encode_message(worker.REJECT, 'live', 'foo'),
+            publish, meta))
+        self.assertIdentical(self.master.published[('live', 'foo')][0], a)
+
+    def test_worker_stopped(self):
+        a, b = self.connectWorker(), self.connectWorker()
+
+        self.master.messageReceived(a, worker.encode_message(worker.PUBLISH,
+            'live', 'foo'))
+        b.transport.clear()
+
+        a.connectionLost(failure.Failure(error.ConnectionDone()))
+
+        self.assertEqual(self.master.relays, [b])
+        self.assertEqual(self.master.published, {})
+
+        self.assertEqual(b.transport.value(), framed(
+            worker.encode_message(worker.UNPUBLISH, 'live', 'foo')))
+
+
+
+class RunWorkerTestCase(unittest.TestCase):
+    """
+    Tests for L{worker.run_worker}.
+    """
+
+    def test_run(self):
+        reactor = Reactor()
+        pipes = []
+
+        self.patch(log, 'startLogging', lambda f: None)
+        self.patch(stdio, 'StandardIO',
+            lambda proto, reactor=None: pipes.append((proto, reactor)))
+
+        worker.run_worker('rtmpy.tests.test_worker.makeFactory', 7, 2,
+            reactor=reactor)
+
+        (fd, family, factory), = reactor.adopted
+        relay = factory.relay
+
+        self.assertEqual((fd, family), (7, 2))
+        self.assertTrue(isinstance(factory, server.ServerFactory))
+        self.assertTrue(isinstance(relay, worker.WorkerRelay))
+        self.assertIdentical(relay.reactor, reactor)
+        self.assertEqual(pipes, [(relay, reactor)])
+        self.assertTrue(reactor.running)
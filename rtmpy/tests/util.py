@@ -22,7 +22,7 @@ try:
 except ImportError:
     from StringIO import StringIO
 
-from twisted.internet import error
+from twisted.internet import error, defer, reactor, task
 
 
 class StringTransport:
@@ -53,6 +53,13 @@ class StringTransport:
     def writeSequence(self, data):
         self.io.write(''.join(data))
 
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        self.streaming = streaming
+
+    def unregisterProducer(self):
+        self.producer = None
+
     def loseConnection(self):
         pass
 
@@ -79,4 +86,84 @@ class DummyDelayedCall:
 
     def cancel(self):
         self.cancelled = True
-    
\ No newline at end of file
+    
+
+def tracked(protocolClass, connections):
+    """
+    Returns a subclass of C{protocolClass} whose instances add themselves to
+    C{connections} when they are connected. Each one has a C{lost} deferred
+    that fires when the connection has gone away.
+    """
+    class TrackedProtocol(protocolClass):
+        def connectionMade(self):
+            self.lost = defer.Deferred()
+            connections.append(self)
+
+            protocolClass.connectionMade(self)
+
+        def connectionLost(self, reason):
+            try:
+                protocolClass.connectionLost(self, reason)
+            finally:
+                self.lost.callback(None)
+
+    return TrackedProtocol
+
+
+def wait_for(predicate, interval=0.01):
+    """
+    Returns a deferred that fires once C{predicate()} is true, it is checked
+    every C{interval} seconds.
+    """
+    def check(ignored=None):
+        if predicate():
+            return
+
+        return task.deferLater(reactor, interval, check)
+
+    return defer.maybeDeferred(check)
+
+
+class Loopback(object):
+    """
+    Runs real servers and clients on the loopback interface. Everything is
+    disconnected by L{cleanup}, which is added to the test case.
+
+    @ivar connections: Every protocol connected through the loopback.
+    """
+
+    def __init__(self, testCase):
+        self.connections = []
+        self.ports = []
+
+        testCase.addCleanup(self.cleanup)
+
+    def track(self, factory):
+        factory.protocol = tracked(factory.protocol, self.connections)
+
+        return factory
+
+    def listen(self, factory):
+        """
+        Listens with C{factory} on an ephemeral port, which is returned.
+        """
+        port = reactor.listenTCP(0, self.track(factory), interface='127.0.0.1')
+
+        self.ports.append(port)
+
+        return port.getHost().port
+
+    def connect(self, port, factory):
+        return reactor.connectTCP('127.0.0.1', port, self.track(factory))
+
+    def cleanup(self):
+        dl = []
+
+        for p in self.connections:
+            dl.append(p.lost)
+            p.transport.loseConnection()
+
+        for port in self.ports:
+            dl.append(defer.maybeDeferred(port.stopListening))
+
+        return defer.DeferredList(dl)
@@ -0,0 +1,713 @@
+# -*- test-case-name: rtmpy.tests.test_vod -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Plays FLV files on demand.
+
+An L{FLVFile} is memory mapped, the tags are sliced out of the map as they are
+sent so the file is never read into memory as a whole. The keyframes of the
+file are indexed so that seeking is a binary search. The index is saved next to
+the file (with the suffix L{FLVFile.indexSuffix}) and is only rebuilt when the
+file changes::
+
+    app = server.Application()
+    app.vodPath = '/var/lib/rtmpy/live'
+
+Playing C{foo} then plays C{/var/lib/rtmpy/live/foo.flv} if nothing is
+published under that name. A L{Player} sends the tags to the L{server.NetStream}
+at the rate they were recorded at.
+
+The opened files are shared through a L{FileCache}, however many peers play the
+same file it is mapped and indexed once.
+"""
+
+import os
+import mmap
+import struct
+import bisect
+import collections
+
+from twisted.internet import defer, threads
+from twisted.python import log
+import pyamf
+
+from rtmpy import flv
+
+
+__all__ = [
+    'FLVFile',
+    'FileCache',
+    'Index',
+    'Player',
+    'get_mtime',
+    'open_file',
+]
+
+
+#: magic, version, size and mtime of the file, number of keyframes and headers.
+_index_header = struct.Struct('>4sBQdII')
+
+INDEX_MAGIC = 'RIDX'
+INDEX_VERSION = 1
+
+
+class Index(object):
+    """
+    The seekable points of an FLV file.
+
+    @ivar timestamps: The timestamps of the keyframes, in ascending order.
+    @ivar offsets: The offsets of the keyframe tags, matching L{timestamps}.
+    @ivar headers: The offsets of the tags that must be sent before playing
+        from a keyframe, the first C{onMetaData} and sequence headers.
+    """
+
+    def __init__(self, timestamps=None, offsets=None, headers=None):
+        self.timestamps = timestamps or []
+        self.offsets = offsets or []
+        self.headers = headers or []
+
+
+    def find(self, timestamp):
+        """
+        Returns the C{(timestamp, offset)} of the last keyframe at or before
+        C{timestamp}, or C{None} if there are no keyframes.
+        """
+        if not self.timestamps:
+            return None
+
+        i = bisect.bisect_right(self.timestamps, timestamp) - 1
+
+        if i < 0:
+            i = 0
+
+        return self.timestamps[i], self.offsets[i]
+
+
+    def encode(self, size, mtime):
+        """
+        Returns the index as a C{str}, tagged with the C{size} and C{mtime} of
+        the file that it was built from.
+        """
+        pairs = []
+
+        for pair in zip(self.timestamps, self.offsets):
+            pairs.extend(pair)
+
+        count = len(self.timestamps)
+
+        return ''.join([
+            _index_header.pack(INDEX_MAGIC, INDEX_VERSION, size, mtime,
+                count, len(self.headers)),
+            struct.pack('>' + 'IQ' * count, *pairs),
+            struct.pack('>%dQ' % (len(self.headers),), *self.headers)
+        ])
+
+
+    @classmethod
+    def decode(cls, data, size, mtime):
+        """
+        The reverse of L{encode}. Returns C{None} if C{data} is not an index of
+        a file with the supplied C{size} and C{mtime}.
+        """
+        if len(data) < _index_header.size:
+            return None
+
+        magic, version, s, m, count, headers = _index_header.unpack_from(data)
+
+        if (magic, version, s, m) != (INDEX_MAGIC, INDEX_VERSION, size, mtime):
+            return None
+
+        pos = _index_header.size
+        fmt = '>' + 'IQ' * count + 'Q' * headers
+
+        if len(data) != pos + struct.calcsize(fmt):
+            return None
+
+        values = struct.unpack_from(fmt, data, pos)
+        pairs = values[:count * 2]
+
+        return cls(list(pairs[::2]), list(pairs[1::2]),
+            list(values[count * 2:]))
+
+
+
+class FLVFile(object):
+    """
+    A memory mapped FLV file.
+
+    @ivar path: The path of the file.
+    @ivar data: The C{mmap} of the file.
+    @ivar size: The size of the file when it was opened.
+    @ivar mtime: The modification time of the file when it was opened.
+    @ivar start: The offset of the first tag.
+    @ivar index: The L{Index} of the file, see L{loadIndex}.
+    @cvar indexSuffix: Appended to L{path} to get the path of the index.
+    @cvar audioInterval: The number of milliseconds between the points indexed
+        in a file without video.
+    """
+
+    indexSuffix = '.idx'
+    audioInterval = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.index = None
+
+
+    def open(self):
+        """
+        Maps the file.
+
+        @raise IOError: The file does not exist or is not an FLV file.
+        """
+        f = open(self.path, 'rb')
+
+        try:
+            st = os.fstat(f.fileno())
+
+            if st.st_size < len(flv.FILE_HEADER):
+                raise IOError('%r is not an FLV file' % (self.path,))
+
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if data[:3] != 'FLV':
+            data.close()
+
+            raise IOError('%r is not an FLV file' % (self.path,))
+
+        self.data = data
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.start = flv.previous_tag_size.unpack_from(data, 5)[0] + 4
+
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+
+    def readTagHeader(self, offset):
+        """
+        Returns the C{(tagType, size, timestamp)} of the tag at C{offset}, or
+        C{None} if the file ends before the end of the tag.
+        """
+        if offset + flv.TAG_HEADER_SIZE > self.size:
+            return None
+
+        header = flv.unpack_tag_header(self.data, offset)
+
+        if offset + flv.TAG_HEADER_SIZE + header[1] > self.size:
+            return None
+
+        return header
+
+
+    def readTag(self, offset):
+        """
+        Returns the C{(tagType, timestamp, data, next)} of the tag at
+        C{offset}, where C{next} is the offset of the tag that follows. Returns
+        C{None} at the end of the file.
+        """
+        header = self.readTagHeader(offset)
+
+        if header is None:
+            return None
+
+        tagType, size, timestamp = header
+        pos = offset + flv.TAG_HEADER_SIZE
+
+        return tagType, timestamp, self.data[pos:pos + size], pos + size + 4
+
+
+    def buildIndex(self):
+        """
+        Scans the tag headers of the file for keyframes (or audio tags, if
+        there is no video) and headers.
+
+        @rtype: L{Index}
+        """
+        data = self.data
+        read = self.readTagHeader
+        index = Index()
+        audio = Index()
+        seen = set()
+        offset = self.start
+
+        while True:
+            header = read(offset)
+
+            if header is None:
+                break
+
+            tagType, size, timestamp = header
+            body = offset + flv.TAG_HEADER_SIZE
+            key = None
+
+            if tagType == flv.TAG_VIDEO:
+                first = data[body:body + 2]
+
+                if flv.is_sequence_header(first):
+                    key = tagType
+                elif flv.is_keyframe(first):
+                    index.timestamps.append(timestamp)
+                    index.offsets.append(offset)
+            elif tagType == flv.TAG_AUDIO:
+                if flv.is_sequence_header(data[body:body + 2], audio=True):
+                    key = tagType
+                elif (not audio.timestamps or timestamp >=
+                        audio.timestamps[-1] + self.audioInterval):
+                    audio.timestamps.append(timestamp)
+                    audio.offsets.append(offset)
+            elif tagType == flv.TAG_SCRIPT:
+                key = tagType
+
+            if key is not None and key not in seen:
+                seen.add(key)
+                index.headers.append(offset)
+
+            offset = body + size + 4
+
+        if not index.timestamps:
+            index.timestamps = audio.timestamps
+            index.offsets = audio.offsets
+
+        return index
+
+
+    def loadIndex(self):
+        """
+        Sets L{index}, from the index file if it is up to date. Otherwise the
+        index is built and saved.
+        """
+        path = self.path + self.indexSuffix
+
+        try:
+            f = open(path, 'rb')
+
+            try:
+                index = Index.decode(f.read(), self.size, self.mtime)
+            finally:
+                f.close()
+        except IOError:
+            index = None
+
+        if index is None:
+            index = self.buildIndex()
+
+            try:
+                f = open(path, 'wb')
+
+                try:
+                    f.write(index.encode(self.size, self.mtime))
+                finally:
+                    f.close()
+            except IOError:
+                log.msg('Unable to save the index of %r' % (self.path,))
+                log.err()
+
+        self.index = index
+
+        return index
+
+
+    def seek(self, timestamp):
+        """
+        Returns the C{(timestamp, offset)} to start playing from to get to
+        C{timestamp}.
+        """
+        found = self.index.find(timestamp)
+
+        if found is None:
+            return 0, self.start
+
+        return found
+
+
+
+def open_file(path):
+    """
+    Returns the L{FLVFile} C{path}, opened and indexed.
+    """
+    f = FLVFile(path)
+    f.open()
+
+    try:
+        f.loadIndex()
+    except:
+        f.close()
+
+        raise
+
+    return f
+
+
+
+def get_mtime(path):
+    """
+    Returns the modification time of C{path}, L{IOError} is raised if it does
+    not exist.
+    """
+    try:
+        return os.stat(path).st_mtime
+    except OSError, e:
+        raise IOError(*e.args)
+
+
+
+class FileCache(object):
+    """
+    Shares opened L{FLVFile}s between players.
+
+    The files are keyed by path and modification time, so a file that is
+    replaced on disk is opened afresh while the players of the old version
+    carry on with their own mapping. Every L{acquire} must be matched by a
+    L{release}. Files that are no longer used are kept open (up to L{maxIdle}
+    of them) and the least recently used is closed first.
+
+    All of the methods must be called from the reactor thread, the files are
+    looked up on disk and opened in the thread pool.
+
+    @ivar files: C{dict} of C{(path, mtime)} -> C{[file, refcount]}.
+    @ivar keys: C{dict} of file -> C{(path, mtime)}.
+    @ivar idle: The keys of the files that are not in use, least recently used
+        first.
+    @ivar loading: C{dict} of C{(path, mtime)} -> C{list} of
+        L{defer.Deferred}s waiting for the file to be opened.
+    """
+
+    maxIdle = 32
+
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.reactor = reactor
+
+        self.files = {}
+        self.keys = {}
+        self.idle = collections.OrderedDict()
+        self.loading = {}
+
+
+    def deferToThread(self, f, *args):
+        return threads.deferToThreadPool(self.reactor,
+            self.reactor.getThreadPool(), f, *args)
+
+
+    def openFile(self, path):
+        return self.deferToThread(open_file, path)
+
+
+    def acquire(self, path):
+        """
+        Returns a L{defer.Deferred} that fires with the opened L{FLVFile}
+        C{path}.
+        """
+        d = self.deferToThread(get_mtime, path)
+
+        return d.addCallback(self._acquire, path)
+
+
+    def _acquire(self, mtime, path):
+        key = (path, mtime)
+        entry = self.files.get(key, None)
+
+        if entry is not None:
+            entry[1] += 1
+            self.idle.pop(key, None)
+
+            return entry[0]
+
+        d = defer.Deferred()
+        waiting = self.loading.get(key, None)
+
+        if waiting is not None:
+            waiting.append(d)
+
+            return d
+
+        waiting = self.loading[key] = [d]
+
+        def cb(f):
+            del self.loading[key]
+
+            self.files[key] = [f, len(waiting)]
+            self.keys[f] = key
+            self._closeStale(path, key)
+
+            for d in waiting:
+                d.callback(f)
+
+        def eb(fail):
+            del self.loading[key]
+
+            for d in waiting:
+                d.errback(fail)
+
+        self.openFile(path).addCallbacks(cb, eb)
+
+        return d
+
+
+    def release(self, f):
+        """
+        The caller has finished with C{f}.
+        """
+        key = self.keys.get(f, None)
+
+        if key is None:
+            f.close()
+
+            return
+
+        entry = self.files[key]
+        entry[1] -= 1
+
+        if entry[1] > 0:
+            return
+
+        self.idle[key] = None
+
+        while len(self.idle) > self.maxIdle:
+            self._close(self.idle.popitem(last=False)[0])
+
+
+    def _close(self, key):
+        self.idle.pop(key, None)
+
+        f = self.files.pop(key)[0]
+        del self.keys[f]
+
+        f.close()
+
+
+    def _closeStale(self, path, key):
+        """
+        Closes the unused files of older versions of C{path}.
+        """
+        for other in self.idle.keys():
+            if other[0] == path and other != key:
+                self._close(other)
+
+
+    def clear(self):
+        """
+        Closes all of the files that are not in use.
+        """
+        for key in self.idle.keys():
+            self._close(key)
+
+
+
+class Player(object):
+    """
+    Plays an L{FLVFile} to a subscriber, usually a L{server.NetStream}.
+
+    The tags are sent as the wall clock reaches their timestamps, L{preload}
+    milliseconds ahead so that the peer can buffer. While the subscriber is
+    congested (see L{server.StreamPublisher.isCongested}) nothing is sent and
+    the clock is held.
+
+    At the end of the file the subscriber is unpublished, as the subscribers of
+    a live stream are when the stream goes away.
+
+    @ivar file: The L{FLVFile}, opened and indexed.
+    @ivar cache: The L{FileCache} that C{file} was acquired from, it is
+        released when playing stops. If C{None}, the file is closed instead.
+    @ivar subscribers: The subscriber, once added.
+    @ivar offset: The offset of the next tag to send.
+    @ivar timestamp: The timestamp that playback started (or was seeked) at.
+    @ivar started: The wall clock time that playback started at.
+    """
+
+    preload = 1000
+    interval = 0.1
+
+    def __init__(self, file, clock=None, cache=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.file = file
+        self.clock = clock
+        self.cache = cache
+
+        self.subscribers = {}
+        self.subscriber = None
+        self.offset = file.start
+        self.timestamp = 0
+        self.started = None
+        self.call = None
+
+
+    def addSubscriber(self, subscriber):
+        """
+        Starts playing the file to C{subscriber}.
+        """
+        self.subscriber = subscriber
+        self.subscribers = {subscriber: {}}
+
+        self.seek(0)
+
+
+    def removeSubscriber(self, subscriber):
+        self.stop()
+
+
+    def stop(self):
+        """
+        Stops playing and releases the file.
+        """
+        if self.call is not None:
+            self.call.cancel()
+            self.call = None
+
+        self.subscriber = None
+        self.subscribers = {}
+
+        f, self.file = self.file, None
+
+        if f is None:
+            return
+
+        if self.cache is not None:
+            self.cache.release(f)
+        else:
+            f.close()
+
+
+    def seek(self, timestamp):
+        """
+        Carries on playing from the keyframe at or before C{timestamp}. Nothing
+        is sent until the reactor gets control back, so that the caller can
+        report the seek first.
+
+        @return: The timestamp of the keyframe, or C{None} if playing has
+            stopped.
+        """
+        if self.file is None:
+            return None
+
+        self.timestamp, self.offset = self.file.seek(timestamp)
+
+        if self.call is not None:
+            self.call.cancel()
+
+        self.call = self.clock.callLater(0, self._start)
+
+        return self.timestamp
+
+
+    def _start(self):
+        """
+        Sends the headers that come before the play head and starts the clock.
+        """
+        self.call = None
+        self.started = self.clock.seconds()
+
+        try:
+            for offset in self.file.index.headers:
+                if offset < self.offset:
+                    self.sendTag(self.file.readTag(offset)[:3], self.timestamp)
+        except:
+            log.err()
+            self.stop()
+
+            return
+
+        self._tick()
+
+
+    def sendTag(self, tag, timestamp=None):
+        tagType, ts, data = tag
+        subscriber = self.subscriber
+
+        if timestamp is None:
+            timestamp = ts
+
+        if tagType == flv.TAG_VIDEO:
+            subscriber.videoDataReceived(data, timestamp)
+        elif tagType == flv.TAG_AUDIO:
+            subscriber.audioDataReceived(data, timestamp)
+        elif tagType == flv.TAG_SCRIPT:
+            values = pyamf.decode(data, encoding=pyamf.AMF0)
+
+            if values.next() == 'onMetaData':
+                subscriber.onMetaData(values.next())
+
+
+    def _tick(self):
+        self.call = None
+
+        if self.subscriber is None:
+            return
+
+        now = self.clock.seconds()
+
+        if getattr(self.subscriber, 'paused', False):
+            self.started += self.interval
+            self.call = self.clock.callLater(self.interval, self._tick)
+
+            return
+
+        playhead = self.timestamp + (now - self.started) * 1000 + self.preload
+        readTag = self.file.readTag
+
+        while True:
+            tag = readTag(self.offset)
+
+            if tag is None:
+                self.finished()
+
+                return
+
+            if tag[1] > playhead:
+                break
+
+            try:
+                self.sendTag(tag[:3])
+            except:
+                log.err()
+                self.stop()
+
+                return
+
+            if self.subscriber is None:
+                return
+
+            self.offset = tag[3]
+
+        delay = (tag[1] - playhead) / 1000.0
+
+        self.call = self.clock.callLater(delay, self._tick)
+
+
+    def finished(self):
+        """
+        The end of the file has been reached.
+        """
+        subscriber = self.subscriber
+
+        self.stop()
+
+        try:
+            subscriber.unpublish()
+        except:
+            log.err()
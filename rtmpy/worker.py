@@ -0,0 +1,644 @@
+# -*- test-case-name: rtmpy.tests.test_worker -*-
+
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Runs a L{server.ServerFactory} in several worker processes.
+
+The master process opens the listening socket but never accepts from it.
+Each worker inherits the socket, builds its own factory and accepts
+connections from it, so the kernel spreads the peers across the workers.
+
+Streams published to one worker are relayed to all of the others over the
+stdin/stdout pipes of the workers (the master forwards every message it
+receives from one worker to the rest). Every worker then has a
+L{server.StreamPublisher} for every published stream and serves the
+subscribers that connected to it. If two workers publish the same name at the
+same time, the master keeps the one it hears about first and the other is
+rejected.
+
+Each pipe is flow controlled. A relay is registered as the streaming producer
+of its pipe and is paused while the pipe's buffer is full, video is then
+dropped for that pipe until the next keyframe (the same policy as
+L{server.StreamPublisher.dropVideo}). A slow worker does not hold up the
+others, nor does it make the master buffer without limit.
+
+Example::
+
+    # myapp.py
+    def makeFactory():
+        return server.ServerFactory({'live': LiveApplication()})
+
+    # in the master process
+    master = worker.Master('myapp.makeFactory', workers=4)
+    master.listenTCP(1935)
+    reactor.run()
+
+The factory must be built from a dotted name as it is created in the worker
+processes, not in the master.
+"""
+
+import os
+import sys
+import struct
+import socket
+
+from zope.interface import implements
+from twisted.internet import protocol, endpoints
+from twisted.internet.interfaces import IPushProducer
+from twisted.protocols import basic
+from twisted.python import log, reflect
+import pyamf
+
+from rtmpy import server, status, flv
+from rtmpy.status import codes
+
+
+__all__ = [
+    'Master',
+    'WorkerRelay',
+    'run_worker',
+]
+
+
+#: A stream has been published.
+PUBLISH = 1
+#: A stream has been unpublished.
+UNPUBLISH = 2
+#: The payload is a video packet.
+VIDEO = 3
+#: The payload is an audio packet.
+AUDIO = 4
+#: The payload is the AMF0 encoded meta data of the stream.
+META = 5
+#: Sent by the master, the stream is already published to another worker.
+REJECT = 6
+
+#: kind, timestamp, length of the application name, length of the stream name.
+_header = struct.Struct('!BLHH')
+
+
+def encode_message(kind, appName, name, timestamp=0, payload=''):
+    """
+    Encodes a relay message.
+
+    @rtype: C{str}
+    """
+    appName = str(appName)
+    name = str(name)
+
+    return ''.join([
+        _header.pack(kind, timestamp, len(appName), len(name)),
+        appName,
+        name,
+        payload
+    ])
+
+
+def decode_message(data):
+    """
+    Decodes a relay message.
+
+    @return: C{(kind, appName, name, timestamp, payload)}
+    """
+    kind, timestamp, appLength, nameLength = _header.unpack_from(data)
+
+    pos = _header.size + appLength
+    end = pos + nameLength
+
+    return kind, data[_header.size:pos], data[pos:end], timestamp, data[end:]
+
+
+def decode_key(data):
+    """
+    Returns the C{(appName, name)} of a relay message, without copying the
+    payload.
+    """
+    appLength, nameLength = _header.unpack_from(data)[2:]
+
+    pos = _header.size + appLength
+
+    return data[_header.size:pos], data[pos:pos + nameLength]
+
+
+def get_payload(data):
+    """
+    Returns the payload of a relay message as a C{buffer}, without copying it.
+    """
+    appLength, nameLength = _header.unpack_from(data)[2:]
+
+    return buffer(data, _header.size + appLength + nameLength)
+
+
+def get_worker_count():
+    """
+    The default number of workers, one per cpu.
+    """
+    try:
+        import multiprocessing
+    except ImportError:
+        return 1
+
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+
+class RelaySubscriber(object):
+    """
+    Subscribes to a stream published to this worker and sends everything it
+    receives to the master.
+
+    @ivar relay: The L{WorkerRelay} connected to the master.
+    @ivar appName: The name of the application the stream was published to.
+    @ivar name: The name of the stream.
+    """
+
+    implements(server.IPublishingStream)
+
+    def __init__(self, relay, appName, name):
+        self.relay = relay
+        self.appName = appName
+        self.name = name
+
+
+    @property
+    def paused(self):
+        """
+        Whether the pipe to the master is full, the publisher then drops video
+        for this subscriber (see L{server.StreamPublisher.isCongested}).
+        """
+        return self.relay.paused
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.relay.sendMessage(VIDEO, self.appName, self.name, timestamp, data)
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.relay.sendMessage(AUDIO, self.appName, self.name, timestamp, data)
+
+
+    def onMetaData(self, data):
+        meta = pyamf.encode(data, encoding=pyamf.AMF0).getvalue()
+
+        self.relay.sendMessage(META, self.appName, self.name, 0, meta)
+
+
+    def unpublish(self):
+        self.relay.sendMessage(UNPUBLISH, self.appName, self.name)
+
+
+
+class WorkerRelay(basic.Int32StringReceiver):
+    """
+    The worker end of the pipe to the master.
+
+    Installed as C{relay} on the worker's L{server.ServerFactory}, which tells
+    the applications to call L{publishStarted} for every stream that is
+    published.
+
+    @ivar factory: The L{server.ServerFactory} of this worker.
+    @ivar reactor: Stopped when the pipe to the master is closed, if set.
+    @ivar publishers: The streams relayed from other workers.
+    @type publishers: C{dict} of C{(appName, name)} -> L{server.StreamPublisher}
+    @ivar paused: Whether the pipe to the master is full.
+    """
+
+    implements(IPushProducer)
+
+    MAX_LENGTH = 0x1000000
+
+    subscriber_class = RelaySubscriber
+    publisher_class = server.StreamPublisher
+
+    def __init__(self, factory, reactor=None):
+        self.factory = factory
+        self.reactor = reactor
+        self.publishers = {}
+        self.paused = False
+
+
+    def connectionMade(self):
+        self.transport.registerProducer(self, True)
+
+
+    def pauseProducing(self):
+        self.paused = True
+
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+    def stopProducing(self):
+        self.paused = True
+
+
+    def sendMessage(self, kind, appName, name, timestamp=0, payload=''):
+        """
+        Sends a message to the master.
+        """
+        self.sendString(encode_message(kind, appName, name, timestamp,
+            payload))
+
+
+    def publishStarted(self, app, name, publisher):
+        """
+        C{publisher} has been created for a stream published to C{app} by a
+        peer connected to this worker.
+        """
+        subscriber = self.subscriber_class(self, app.name, name)
+
+        self.sendMessage(PUBLISH, app.name, name)
+        publisher.addSubscriber(subscriber)
+
+
+    def stringReceived(self, data):
+        kind, appName, name, timestamp, payload = decode_message(data)
+        key = (appName, name)
+
+        if kind == PUBLISH:
+            self.relayPublished(appName, name)
+
+            return
+
+        if kind == REJECT:
+            self.publishRejected(appName, name)
+
+            return
+
+        publisher = self.publishers.get(key, None)
+
+        if publisher is None:
+            return
+
+        if kind == VIDEO:
+            publisher.videoDataReceived(payload, timestamp)
+        elif kind == AUDIO:
+            publisher.audioDataReceived(payload, timestamp)
+        elif kind == META:
+            publisher.onMetaData(pyamf.decode(payload,
+                encoding=pyamf.AMF0).next())
+        elif kind == UNPUBLISH:
+            self.relayUnpublished(appName, name)
+
+
+    def relayPublished(self, appName, name):
+        """
+        A stream has been published to another worker.
+        """
+        app = self.factory.applications.get(appName, None)
+
+        if app is None or name in app.streams:
+            return
+
+        # the relayed client never matches a local one, so peers of this
+        # worker cannot publish over (or unpublish) the stream.
+        publisher = self.publisher_class(None, server.Client(None))
+
+        self.publishers[(appName, name)] = publisher
+
+        app.addPublisher(name, publisher)
+
+
+    def publishRejected(self, appName, name):
+        """
+        The stream C{name} was published to this worker while it was already
+        published to another one. The local publish is undone, the master
+        then relays the other stream to this worker.
+        """
+        log.msg('%r is already published to %r by another worker, rejecting '
+            'the local publisher' % (name, appName))
+
+        app = self.factory.applications.get(appName, None)
+
+        if app is None:
+            return
+
+        publisher = app.streams.get(name, None)
+
+        if publisher is None or (appName, name) in self.publishers:
+            return
+
+        for subscriber in publisher.subscribers.keys():
+            if isinstance(subscriber, self.subscriber_class):
+                publisher.removeSubscriber(subscriber)
+
+        try:
+            publisher.unpublish()
+        except:
+            log.err()
+
+        app.removePublisher(name, publisher)
+
+        stream = publisher.stream
+
+        if stream is not None:
+            stream.publishingStopped(status.error(codes.NS_PUBLISH_BADNAME,
+                "'%s' is already used" % (name,)))
+
+
+    def relayUnpublished(self, appName, name):
+        """
+        A stream published to another worker has been unpublished.
+        """
+        publisher = self.publishers.pop((appName, name), None)
+
+        if publisher is None:
+            return
+
+        try:
+            publisher.unpublish()
+        except:
+            log.err()
+
+        app = self.factory.applications.get(appName, None)
+
+        if app is not None:
+            app.removePublisher(name, publisher)
+
+
+    def connectionLost(self, reason):
+        for appName, name in self.publishers.keys():
+            self.relayUnpublished(appName, name)
+
+        if self.reactor is not None and self.reactor.running:
+            self.reactor.stop()
+
+
+
+class MasterRelay(basic.Int32StringReceiver):
+    """
+    The master end of the pipe to one worker.
+
+    @ivar master: The L{Master} that spawned the worker.
+    @ivar paused: Whether the pipe to the worker is full, see L{relayMessage}.
+    @ivar dropping: The streams that video is being dropped for until the next
+        keyframe.
+    @type dropping: C{set} of C{(appName, name)}
+    @ivar dropped: The number of video messages that have been dropped.
+    """
+
+    implements(IPushProducer)
+
+    MAX_LENGTH = WorkerRelay.MAX_LENGTH
+
+    def __init__(self, master):
+        self.master = master
+        self.paused = False
+        self.dropping = set()
+        self.dropped = 0
+
+
+    def connectionMade(self):
+        self.transport.registerProducer(self, True)
+        self.master.workerStarted(self)
+
+
+    def pauseProducing(self):
+        self.paused = True
+
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+    def stopProducing(self):
+        self.paused = True
+
+
+    def relayMessage(self, kind, key, data):
+        """
+        Sends the message C{data} about the stream C{key} to the worker.
+
+        While the pipe is full, inter frames are dropped until the next
+        keyframe of the stream. Everything else is always sent.
+        """
+        if kind == VIDEO:
+            payload = get_payload(data)
+
+            if flv.is_keyframe(payload):
+                self.dropping.discard(key)
+            elif flv.is_disposable(payload) and (
+                    self.paused or key in self.dropping):
+                self.dropping.add(key)
+                self.dropped += 1
+
+                return
+        elif kind == UNPUBLISH:
+            self.dropping.discard(key)
+
+        self.sendString(data)
+
+
+    def stringReceived(self, data):
+        self.master.messageReceived(self, data)
+
+
+    def connectionLost(self, reason):
+        self.master.workerStopped(self, reason)
+
+
+
+class Master(object):
+    """
+    Owns the listening socket and the worker processes.
+
+    @ivar factoryName: The dotted name of a callable returning the
+        L{server.ServerFactory} that each worker serves.
+    @ivar workers: The number of worker processes.
+    @ivar relays: The L{MasterRelay} of each running worker.
+    @ivar published: The streams that are currently published.
+        They are replayed to workers that start after the publication.
+        Messages about a name published to another worker are not forwarded
+        and a L{PUBLISH} of such a name is answered with L{REJECT}.
+    @type published: C{dict} of C{(appName, name)} -> C{(relay, messages)},
+        C{relay} being the L{MasterRelay} of the publishing worker and
+        C{messages} the L{PUBLISH} message and the latest L{META} message.
+    @ivar port: The listening port.
+    @ivar running: Whether the workers are restarted when they exit.
+    """
+
+    relay_class = MasterRelay
+
+    def __init__(self, factoryName, workers=None, reactor=None):
+        if workers is None:
+            workers = get_worker_count()
+
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.factoryName = factoryName
+        self.workers = workers
+        self.reactor = reactor
+
+        self.relays = []
+        self.published = {}
+        self.port = None
+        self.running = False
+
+
+    def listenTCP(self, port, interface='', backlog=50):
+        """
+        Opens the listening socket and spawns the workers.
+        """
+        self.port = self.reactor.listenTCP(port, protocol.ServerFactory(),
+            backlog=backlog, interface=interface)
+
+        # the workers accept the connections.
+        self.port.stopReading()
+        self.running = True
+
+        for i in xrange(self.workers):
+            self.spawnWorker()
+
+        return self.port
+
+
+    def stop(self):
+        """
+        Stops the workers and closes the listening socket.
+        """
+        self.running = False
+
+        for relay in self.relays:
+            relay.transport.loseConnection()
+
+        if self.port is not None:
+            return self.port.stopListening()
+
+
+    def spawnWorker(self):
+        """
+        Starts a worker process, the listening socket is passed as a file
+        descriptor with the same number.
+        """
+        fd = self.port.fileno()
+        args = [
+            sys.executable, '-m', __name__,
+            self.factoryName, str(fd), str(self.port.addressFamily)
+        ]
+
+        endpoint = endpoints.ProcessEndpoint(self.reactor, sys.executable,
+            args, env=os.environ, childFDs={0: 'w', 1: 'r', 2: 2, fd: fd})
+
+        d = endpoint.connect(protocol.Factory.forProtocol(
+            lambda: self.relay_class(self)))
+
+        d.addErrback(log.err)
+
+        return d
+
+
+    def workerStarted(self, relay):
+        self.relays.append(relay)
+
+        for origin, messages in self.published.values():
+            for data in messages:
+                relay.sendString(data)
+
+
+    def workerStopped(self, relay, reason):
+        self.relays.remove(relay)
+
+        # the streams that were published to the worker are gone
+        for key, (origin, messages) in self.published.items():
+            if origin is not relay:
+                continue
+
+            del self.published[key]
+
+            data = encode_message(UNPUBLISH, *key)
+
+            for r in self.relays:
+                r.sendString(data)
+
+        if self.running:
+            log.msg('Worker exited (%s), restarting' % (reason.value,))
+
+            self.spawnWorker()
+
+
+    def messageReceived(self, origin, data):
+        """
+        Forwards the message C{data} from the C{origin} worker to all of the
+        other workers.
+        """
+        kind = ord(data[0])
+        key = decode_key(data)
+        published = self.published.get(key, None)
+
+        if published is not None and published[0] is not origin:
+            if kind == PUBLISH:
+                self.rejectPublish(origin, key)
+
+            return
+
+        if kind == PUBLISH:
+            self.published[key] = (origin, [data])
+        elif kind == UNPUBLISH:
+            self.published.pop(key, None)
+        elif kind == META and published is not None:
+            published[1][1:] = [data]
+
+        for relay in self.relays:
+            if relay is not origin:
+                relay.relayMessage(kind, key, data)
+
+
+    def rejectPublish(self, relay, key):
+        """
+        The worker of C{relay} published the stream C{key}, which is already
+        published to another worker. The stream is rejected and the one that
+        is published is relayed to the worker instead.
+        """
+        log.msg('%r is already published to %r, rejecting it' % (key[1],
+            key[0]))
+
+        relay.sendString(encode_message(REJECT, *key))
+
+        for data in self.published[key][1]:
+            relay.sendString(data)
+
+
+
+def run_worker(factoryName, fd, family=socket.AF_INET, reactor=None):
+    """
+    The entry point of a worker process. Serves the factory returned by
+    C{factoryName} on the inherited listening socket C{fd} and relays streams
+    to and from the master over stdin/stdout.
+    """
+    from twisted.internet import stdio
+
+    if reactor is None:
+        from twisted.internet import reactor
+
+    log.startLogging(sys.stderr)
+
+    factory = reflect.namedAny(factoryName)()
+    relay = factory.relay = WorkerRelay(factory, reactor)
+
+    stdio.StandardIO(relay, reactor=reactor)
+    reactor.adoptStreamPort(fd, family, factory)
+
+    reactor.run()
+
+
+if __name__ == '__main__':
+    run_worker(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
@@ -350,7 +350,8 @@ def get_extensions():
 
     extensions = []
     mods = [
-        'rtmpy.protocol.rtmp.header'
+        'rtmpy.protocol.rtmp.header',
+        'rtmpy.protocol.rtmp._codec'
     ]
 
     for m in mods: